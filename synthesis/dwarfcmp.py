@@ -2,13 +2,15 @@
 
 import operator
 import argparse
+import heapq
+import struct
 from elftools.elf.elffile import ELFFile
 from elftools.dwarf.descriptions import (
     set_global_machine_arch,
     describe_CFI_register_rule,
     describe_CFI_CFA_rule,
 )
-from elftools.dwarf.callframe import FDE, CFARule, RegisterRule
+from elftools.dwarf.callframe import CallFrameInfo, FDE, CFARule, RegisterRule
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--strict', help='enable strict mode', action='store_true')
@@ -41,59 +43,104 @@ for elf_file in elf_files:
         raise "Cannot compare ELF files with different machine architectures"
 set_global_machine_arch(machine_arch)
 
-# TODO: optimize dwarf_tables data type
-dwarf_tables = []
-pcs = set()
-for elf_file in elf_files:
+def eh_frame_hdr_index(elf_file):
+    """ The (initial location, offset) of the FDEs, sorted, from the binary
+    search table of .eh_frame_hdr; None if there is none, or if it is not
+    encoded as usual (datarel sdata4) """
+    hdr = elf_file.get_section_by_name('.eh_frame_hdr')
+    eh_frame = elf_file.get_section_by_name('.eh_frame')
+    if hdr is None or eh_frame is None or not elf_file.little_endian:
+        return None
+    data = hdr.data()
+    version, ptr_enc, count_enc, table_enc = struct.unpack_from('<BBBB', data)
+    # a 4-byte eh_frame_ptr, a udata4 count, datarel sdata4 entries
+    if (version != 1 or ptr_enc & 0x0f not in (0x03, 0x0b)
+            or count_enc != 0x03 or table_enc != 0x3b):
+        return None
+    count, = struct.unpack_from('<I', data, 8)
+    table = struct.unpack_from('<%di' % (2 * count), data, 12)
+    base = hdr['sh_addr']
+    return sorted((base + table[i], base + table[i + 1] - eh_frame['sh_addr'])
+                  for i in range(0, 2 * count, 2))
+
+def fde_index(cfi):
+    """ The (initial location, offset) of the FDEs of `cfi`, sorted; the
+    entries are parsed one at a time, and only the CIEs are kept """
+    fdes = []
+    offset = 0
+    while offset < cfi.size:
+        entry = cfi._parse_entry_at(offset)
+        if isinstance(entry, FDE):
+            fdes.append((entry['initial_location'], offset))
+            del cfi._entry_cache[offset]
+        offset = cfi.stream.tell()
+    fdes.sort()
+    return fdes
+
+def dwarf_rows(elf_file):
+    """ The rows of the CFI of `elf_file`, sorted by pc, rows of the same pc
+    in the order of their FDEs.  The FDEs are decoded lazily, in the order
+    of their initial location: only those overlapping the current pc are
+    in memory. """
     if not elf_file.has_dwarf_info():
         raise "ELF file is missing DWARF info"
 
     dwarf_info = elf_file.get_dwarf_info()
-    dwarf_table = {}
-    cfi_entries = None
-    if dwarf_info.has_EH_CFI():
-        cfi_entries = dwarf_info.EH_CFI_entries()
     # TODO: .debug_frame
-    if cfi_entries is None:
+    if not dwarf_info.has_EH_CFI():
         raise "ELF file is missing CFI entries"
-
-    # TODO: sorted insertion
-    dwarf_table = []
-    for entry in cfi_entries:
-        if isinstance(entry, FDE):
-            decoded_table = entry.get_decoded()
-            for line in decoded_table.table:
+    cfi = CallFrameInfo(stream=dwarf_info.eh_frame_sec.stream,
+                        size=dwarf_info.eh_frame_sec.size,
+                        address=dwarf_info.eh_frame_sec.address,
+                        base_structs=dwarf_info.structs,
+                        for_eh_frame=True)
+    fdes = eh_frame_hdr_index(elf_file)
+    if fdes is None:
+        fdes = fde_index(cfi)
+
+    # (pc, offset of the FDE, index of the row, rows) of each open FDE: the
+    # rows of the same pc come in the order of their FDEs in .eh_frame
+    heap = []
+    i = 0
+    while i < len(fdes) or heap:
+        while i < len(fdes) and (not heap or fdes[i][0] <= heap[0][0]):
+            initial_location, offset = fdes[i]
+            decoded_table = cfi._parse_entry_at(offset).get_decoded()
+            del cfi._entry_cache[offset]
+            rows = decoded_table.table
+            for line in rows:
                 line['reg_order'] = decoded_table.reg_order
-                dwarf_table.append(line)
-                pcs.add(line['pc'])
-    dwarf_table = sorted(dwarf_table, key=lambda line: line['pc'])
-
-    dwarf_tables.append(dwarf_table)
+            if rows:
+                heapq.heappush(heap, (rows[0]['pc'], offset, 0, rows))
+            i += 1
+        if not heap:
+            continue
+        pc, offset, j, rows = heapq.heappop(heap)
+        if j + 1 < len(rows):
+            heapq.heappush(heap, (rows[j + 1]['pc'], offset, j + 1, rows))
+        yield rows[j]
 
-pcs = sorted(pcs)
+# The rows of each file: the current one, the last one at or below the pc
+# being compared, and the next one
+row_streams = [dwarf_rows(elf_file) for elf_file in elf_files]
+current_lines = [None] * len(row_streams)
+next_lines = [next(rows, None) for rows in row_streams]
 
 mismatched = False
-for pc in pcs:
+while any(line is not None for line in next_lines):
+    pc = min(line['pc'] for line in next_lines if line is not None)
+    for i, rows in enumerate(row_streams):
+        while next_lines[i] is not None and next_lines[i]['pc'] <= pc:
+            current_lines[i] = next_lines[i]
+            next_lines[i] = next(rows, None)
+
     if verbose:
         print("pc=%x" % pc)
 
     ref_line = {}
     ref_filenames = {}
-    for i, dwarf_table in enumerate(dwarf_tables):
+    for i, line in enumerate(current_lines):
         filename = filenames[i]
-
-        line = None
-        while len(dwarf_table) > 0:
-            line = dwarf_table[0]
-            if line['pc'] > pc:
-                line = None
-                break
-            if len(dwarf_table) < 2:
-                break
-            next_line = dwarf_table[1]
-            if next_line['pc'] > pc:
-                break
-            dwarf_table.pop(0)
         if line is None:
             continue
 
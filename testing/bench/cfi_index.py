@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+""" Compare the memory and lookup time of the eh_frame rows of a library
+memorized in an IntervalTree and in the flat CFITable of eh_frame_check """
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import eh_frame_check as efc
+from eh_frame_check import ELFFile, IntervalTree
+
+
+class IntervalTreeTable:
+    ''' The eh_frame rows memorized as eh_frame_check did before CFITable '''
+
+    def __init__(self):
+        self.tree = IntervalTree()
+
+    def add_rows(self, base, rows):
+        for begin, end, index in zip(rows.begins, rows.ends, rows.indexes):
+            self.tree[base + begin:base + end] = rows.entries[index]
+
+    def lookup(self, ip):
+        rows = self.tree[ip]
+        if rows:
+            return rows.pop().data
+        return None
+
+
+def memorize(path, table):
+    ''' Returns (seconds, bytes allocated) to memorize the rows of `path` '''
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        dwarfinfo = efc.read_eh_frame_table(ELFFile(f))
+        efc.memorize_eh_frame_table(dwarfinfo, table)
+    elapsed = time.perf_counter() - start
+    # keep the rows alive, drop the parsed DWARF
+    del dwarfinfo
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size
+
+
+def time_lookups(table, ips):
+    start = time.perf_counter()
+    misses = 0
+    for ip in ips:
+        if table.lookup(ip) is None:
+            misses += 1
+    return time.perf_counter() - start, misses
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the eh_frame row index of eh_frame_check")
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('library', nargs='?',
+                        default='/lib/x86_64-linux-gnu/libm.so.6')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    efc.verbose = False
+    with open(args.library, 'rb') as f:
+        efc.ARCH = ELFFile(f).get_machine_arch()
+    efc.pyelftools_init()
+
+    tables = [('IntervalTree', IntervalTreeTable()),
+              ('CFITable', efc.CFITable())]
+    for name, table in tables:
+        elapsed, size = memorize(args.library, table)
+        print("{:<13} memorize: {:7.2f} s {:9.1f} MiB".format(
+            name, elapsed, size / 2**20))
+
+    # random ips inside the rows, and runs of ips in the same row, the
+    # pattern of single-stepping
+    rows = list(tables[1][1].rows())
+    rng = random.Random(args.seed)
+    scattered = [rng.randrange(begin, end)
+                 for begin, end, _ in rng.choices(rows, k=args.lookups)]
+    sequential = []
+    for begin, end, _ in rows:
+        sequential.extend(range(begin, min(end, begin + 8)))
+        if len(sequential) >= args.lookups:
+            break
+
+    for pattern, ips in (('scattered', scattered),
+                         ('sequential', sequential)):
+        for name, table in tables:
+            elapsed, misses = time_lookups(table, ips)
+            print("{:<13} {:<10} {:7} lookups {:7.3f} s {:6.2f} us/lookup"
+                  " ({} misses)".format(name, pattern, len(ips), elapsed,
+                                        1e6 * elapsed / len(ips), misses))
+    print(tables[1][1].stats())
+
+
+if __name__ == '__main__':
+    main()
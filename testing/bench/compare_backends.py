@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+""" Run eh_frame_check.py with the gdb and the ptrace backends, or with
+several engines, on the same binaries, and compare their speed and
+verdicts """
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKER = os.path.join(os.path.dirname(BENCH_DIR), 'eh_frame_check.py')
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+
+def build_fixtures(out_dir, cc, cflags):
+    ''' Compile every fixture of `fixtures/`, returns the binaries '''
+    binaries = []
+    for source in sorted(os.listdir(FIXTURES_DIR)):
+        if not source.endswith('.c'):
+            continue
+        binary = os.path.join(out_dir, source[:-2])
+        subprocess.run([cc] + cflags + ['-o', binary,
+                                        os.path.join(FIXTURES_DIR, source)],
+                       check=True)
+        binaries.append(binary)
+    return binaries
+
+
+def checker_command(backend, engine, binary, checker=CHECKER):
+    if backend == 'gdb':
+        return ['gdb', '-q', '-batch',
+                '-ex', 'py arg_verbose = False',
+                '-ex', 'py arg_engine = "{}"'.format(engine),
+                '-x', checker, binary]
+    return [sys.executable, checker, '--engine', engine, binary]
+
+
+def run_checker(backend, engine, binary, timeout, checker=CHECKER):
+    ''' Returns (seconds, instructions checked, verdict) '''
+    start = time.monotonic()
+    try:
+        out = subprocess.run(checker_command(backend, engine, binary,
+                                             checker),
+                             stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             universal_newlines=True,
+                             timeout=timeout).stdout
+    except subprocess.TimeoutExpired:
+        return time.monotonic() - start, None, 'timeout'
+    elapsed = time.monotonic() - start
+
+    checked = re.search(r'(\d+) instructions checked', out)
+    if 'Aborting' in out:
+        verdict = 'mismatch'
+    elif 'Completed' in out:
+        verdict = 'ok'
+    else:
+        verdict = 'error'
+    return elapsed, int(checked.group(1)) if checked else None, verdict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the backends and engines of eh_frame_check")
+    parser.add_argument('--engine', default='step',
+                        help="Comma-separated engines among step, events "
+                             "and saturate (default: step)")
+    parser.add_argument('--backends', default='gdb,ptrace',
+                        help="Comma-separated backends (default: gdb,ptrace)")
+    parser.add_argument('--cc', default=os.environ.get('CC', 'cc'))
+    parser.add_argument('--cflags', default='-O1 -no-pie',
+                        help="Flags used to build the fixtures")
+    parser.add_argument('--timeout', type=int, default=600)
+    parser.add_argument('binaries', nargs='*',
+                        help="Binaries to check (default: the fixtures)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    backends = args.backends.split(',')
+    if 'gdb' in backends and shutil.which('gdb') is None:
+        print("gdb not found, skipping the gdb backend", file=sys.stderr)
+        backends.remove('gdb')
+
+    engines = args.engine.split(',')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        binaries = args.binaries or build_fixtures(tmp_dir, args.cc,
+                                                   args.cflags.split())
+
+        print("{:<24} {:<8} {:<9} {:>10} {:>9} {:>10}  {}".format(
+            'binary', 'backend', 'engine', 'checked', 'seconds', 'insn/s',
+            'verdict'))
+        for binary in binaries:
+            times = {}
+            for backend in backends:
+                for engine in engines:
+                    elapsed, checked, verdict = run_checker(
+                        backend, engine, binary, args.timeout)
+                    times[backend, engine] = elapsed
+                    rate = (checked / elapsed) if checked else 0
+                    print("{:<24} {:<8} {:<9} {:>10} {:>9.2f} {:>10.0f}  "
+                          "{}".format(os.path.basename(binary), backend,
+                                      engine, checked or '-', elapsed, rate,
+                                      verdict))
+            for engine in engines:
+                if ('gdb', engine) in times and ('ptrace', engine) in times:
+                    print("{:<24} {} speedup of ptrace: {:.1f}x".format(
+                        '', engine, times['gdb', engine]
+                        / times['ptrace', engine]))
+            for backend in backends:
+                for engine in engines[1:]:
+                    print("{:<24} {} speedup of {}: {:.1f}x".format(
+                        '', backend, engine, times[backend, engines[0]]
+                        / times[backend, engine]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+""" Compare the time and peak memory of two versions of
+synthesis/dwarfcmp.py on large ELF files, eg. before and after the
+streaming merge of its rows:
+
+    git show <rev>:synthesis/dwarfcmp.py > /tmp/dwarfcmp-base.py
+    ./dwarfcmp_merge.py --base /tmp/dwarfcmp-base.py
+
+Each run is a fresh process; its peak memory is its maximum resident set
+size.  By default, libc is compared with itself, which walks all of its
+rows without printing any mismatch.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DWARFCMP = os.path.join(BENCH_DIR, '..', '..', 'synthesis', 'dwarfcmp.py')
+
+
+def run_dwarfcmp(dwarfcmp, files, flags):
+    ''' Returns (seconds, peak RSS in KiB, exit code, lines printed) of a
+    run of `dwarfcmp` on `files` '''
+    with tempfile.TemporaryFile() as errors:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, dwarfcmp] + flags + files,
+                                   stdout=subprocess.PIPE, stderr=errors)
+        lines = sum(1 for line in process.stdout)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        errors.seek(0)
+        error_lines = errors.read().decode('utf-8', 'replace').splitlines()
+    # dwarfcmp.py exits with 1 on mismatches, and crashes with tracebacks
+    if error_lines:
+        print("{} failed: {}".format(dwarfcmp, error_lines[-1]),
+              file=sys.stderr)
+    return elapsed, usage.ru_maxrss, process.returncode, lines
+
+
+def measure(dwarfcmp, files, flags, repeat):
+    ''' The fastest of `repeat` runs, and the largest peak memory '''
+    runs = [run_dwarfcmp(dwarfcmp, files, flags) for _ in range(repeat)]
+    return {'seconds': min(run[0] for run in runs),
+            'peak_rss_kib': max(run[1] for run in runs),
+            'exit_code': runs[0][2], 'lines': runs[0][3]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time and peak memory of dwarfcmp.py on large files")
+    parser.add_argument('--base', help="The dwarfcmp.py to compare with")
+    parser.add_argument('--dwarfcmp', default=DWARFCMP,
+                        help="The dwarfcmp.py to benchmark (default: the one "
+                             "of this checkout)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Runs of each version, the fastest counts "
+                             "(default: 3)")
+    parser.add_argument('--flags', default='',
+                        help="Options of dwarfcmp.py, eg. '--strict --cfa'")
+    parser.add_argument('--output', '-o',
+                        help="Also write the results to this file, as JSON")
+    parser.add_argument('files', nargs='*',
+                        default=['/lib/x86_64-linux-gnu/libc.so.6'] * 2,
+                        help="The ELF files compared (default: libc with "
+                             "itself)")
+    args = parser.parse_args()
+
+    versions = [('new', args.dwarfcmp)]
+    if args.base:
+        versions.insert(0, ('base', args.base))
+    results = {'files': args.files, 'flags': args.flags}
+    for name, dwarfcmp in versions:
+        results[name] = measure(dwarfcmp, args.files, args.flags.split(),
+                                args.repeat)
+
+    print("{:<6} {:>10} {:>14} {:>6} {:>8}".format(
+        'run', 'seconds', 'peak RSS MiB', 'exit', 'lines'))
+    for name, _ in versions:
+        result = results[name]
+        print("{:<6} {:>10.2f} {:>14.1f} {:>6} {:>8}".format(
+            name, result['seconds'], result['peak_rss_kib'] / 1024.,
+            result['exit_code'], result['lines']))
+    if args.base:
+        base, new = results['base'], results['new']
+        print("speedup {:.2f}x, peak memory {:.2f}x".format(
+            base['seconds'] / max(new['seconds'], 1e-9),
+            new['peak_rss_kib'] / float(max(base['peak_rss_kib'], 1))))
+        if (base['exit_code'], base['lines']) != (new['exit_code'],
+                                                  new['lines']):
+            print("The two versions disagree", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
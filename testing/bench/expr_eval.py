@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+""" Compare the compiled evaluators of eh_frame_check with the reference
+interpreter (a visitor of the Dwarf expression) on common CFA rules.
+
+The compiled evaluators are first checked against the expected CFA of each
+rule, and against the visitor where it implements all the operations of
+the rule; the rules with stack and control flow operations (drop, bra,
+skip) are there for that check more than for their timings. """
+
+import argparse
+import contextlib
+import io
+import os
+import signal
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import eh_frame_check as efc
+from elftools.dwarf.callframe import CFARule
+from elftools.dwarf.structs import DWARFStructs
+
+# DW_OP_breg7 (rsp) 8; DW_OP_breg16 (rip) 0; DW_OP_lit15; DW_OP_and;
+# DW_OP_lit11; DW_OP_ge; DW_OP_lit3; DW_OP_shl; DW_OP_plus
+PLT_EXPR = [0x77, 0x08, 0x80, 0x00, 0x3f, 0x1a, 0x3b, 0x2a, 0x33, 0x24, 0x22]
+# DW_OP_breg6 (rbp) 16; DW_OP_lit8; DW_OP_minus; DW_OP_dup; DW_OP_lit0;
+# DW_OP_ne; DW_OP_bra +1; DW_OP_nop; DW_OP_plus_uconst 8
+BRANCH_EXPR = [0x76, 0x10, 0x38, 0x1c, 0x12, 0x30, 0x2e, 0x28, 0x01, 0x00,
+               0x96, 0x23, 0x08]
+# DW_OP_lit1; DW_OP_lit0; DW_OP_drop: a zero dropped is not a branch
+DROP_ZERO_EXPR = [0x31, 0x30, 0x13]
+# DW_OP_lit1; DW_OP_lit2; DW_OP_drop
+DROP_EXPR = [0x31, 0x32, 0x13]
+# DW_OP_lit1; DW_OP_skip +1; DW_OP_lit2; DW_OP_lit3; DW_OP_plus
+SKIP_EXPR = [0x31, 0x2f, 0x01, 0x00, 0x32, 0x33, 0x22]
+# DW_OP_lit5; DW_OP_lit<cond>; DW_OP_bra +1; DW_OP_lit2
+BRA_EXPR = [0x35, 0x30, 0x28, 0x01, 0x00, 0x32]
+BRA_TAKEN_EXPR = [0x35, 0x31, 0x28, 0x01, 0x00, 0x32]
+# DW_OP_lit3; loop: DW_OP_lit1; DW_OP_minus; DW_OP_dup; DW_OP_bra loop
+LOOP_EXPR = [0x33, 0x31, 0x1c, 0x12, 0x28, 0xfa, 0xff]
+
+
+class Registers:
+    ''' Stands in for the backend '''
+
+    def __init__(self):
+        self.regs = {'rsp': 0x7fffffffe000, 'rip': 0x401020,
+                     'rbp': 0x7fffffffe040}
+
+    def get_reg(self, reg):
+        return self.regs[reg]
+
+    def read_memory(self, addr, size):
+        return addr & ((1 << (8 * size)) - 1)
+
+    def quit(self, code):
+        raise Unsupported()
+
+
+class Unsupported(Exception):
+    ''' The visitor aborted the evaluation '''
+
+
+class Timeout(Exception):
+    ''' An evaluation did not terminate '''
+
+
+def evaluate(f, seconds=5):
+    ''' The value of f(), which must return within `seconds` '''
+    def alarm(signum, frame):
+        raise Timeout()
+    previous = signal.signal(signal.SIGALRM, alarm)
+    signal.alarm(seconds)
+    try:
+        return f()
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def time_calls(f, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        f()
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the evaluators of CFA rules")
+    parser.add_argument('-n', type=int, default=100000,
+                        help="Evaluations per rule")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    efc.ARCH = 'x64'
+    efc.verbose = False
+    efc.dbg_eval = False
+    efc.pyelftools_init()
+    efc.backend = Registers()
+    structs = DWARFStructs(little_endian=True, dwarf_format=32,
+                           address_size=8)
+
+    # name, rule, rip, expected CFA
+    rules = [
+        ('reg+offset', CFARule(reg=7, offset=16), None, 0x7fffffffe010),
+        ('plt', CFARule(expr=PLT_EXPR), None, 0x7fffffffe008),
+        ('plt, ip in 2nd half', CFARule(expr=PLT_EXPR), 0x40102c,
+         0x7fffffffe010),
+        ('branches', CFARule(expr=BRANCH_EXPR), None, 0x7fffffffe050),
+        ('drop zero', CFARule(expr=DROP_ZERO_EXPR), None, 1),
+        ('drop', CFARule(expr=DROP_EXPR), None, 1),
+        ('skip', CFARule(expr=SKIP_EXPR), None, 4),
+        ('bra', CFARule(expr=BRA_EXPR), None, 2),
+        ('bra taken', CFARule(expr=BRA_TAKEN_EXPR), None, 5),
+        ('bra loop', CFARule(expr=LOOP_EXPR), None, 0),
+    ]
+
+    def visitor(rule):
+        if rule.expr is None:
+            return lambda: efc.eval_reg(rule.reg) + rule.offset
+        return lambda: efc.eval_expr(structs, rule.expr)
+
+    print("{:<22} {:>12} {:>12} {:>8}".format(
+        'rule', 'visitor us', 'compiled us', 'speedup'))
+    for name, rule, ip, expected in rules:
+        if ip is not None:
+            efc.backend.regs['rip'] = ip
+        compiled = efc.compile_CFARule(structs, rule)
+        try:
+            value = evaluate(compiled)
+        except Timeout:
+            print("{}: the compiled evaluator does not terminate".format(name))
+            sys.exit(1)
+        if value != expected:
+            print("{}: compiled {:#x} != {:#x}".format(name, value, expected))
+            sys.exit(1)
+        reference = visitor(rule)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                reference_value = evaluate(reference)
+        except (Unsupported, Timeout):
+            # the visitor aborts on the operations it does not implement
+            reference_value = None
+        if reference_value is not None and reference_value != value:
+            # and skips some of them, eg. drop: its value is wrong
+            reference_value = None
+            status = 'wrong'
+        else:
+            status = 'unsupported'
+
+        compiled_time = time_calls(compiled, args.n)
+        if reference_value is None:
+            print("{:<22} {:>12} {:>12.3f} {:>8}".format(
+                name, status, 1e6 * compiled_time / args.n, '-'))
+            continue
+        visitor_time = time_calls(reference, args.n)
+        print("{:<22} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+            name, 1e6 * visitor_time / args.n,
+            1e6 * compiled_time / args.n, visitor_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
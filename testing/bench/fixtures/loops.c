@@ -0,0 +1,18 @@
+/* Tight loops: few stack events, many instructions in the same row. */
+
+#define N 512
+
+int data[N];
+
+int main(void)
+{
+  int i, round;
+  long sum = 0;
+
+  for (i = 0; i < N; i++)
+    data[i] = i * 7 % 13;
+  for (round = 0; round < 8; round++)
+    for (i = 0; i < N; i++)
+      sum += data[i] * round;
+  return sum == 0;
+}
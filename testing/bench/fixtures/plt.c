@@ -0,0 +1,21 @@
+/* PLT-heavy calls: many distinct libc functions, each bound lazily on
+   its first call, then called again through the resolved PLT slot. */
+
+#include <ctype.h>
+#include <stdlib.h>
+#include <unistd.h>
+
+int main(void)
+{
+  int i, total = 0;
+  char number[] = "1234";
+
+  srand(1);
+  for (i = 0; i < 32; i++) {
+    total += toupper('a' + i % 26) + tolower('A' + i % 26);
+    total += strtol(number, NULL, 10) + atoi(number);
+    total += div(i + 7, 3).rem + ldiv(i + 11, 5).quot;
+    total += rand() % 2 + (getpid() > 0);
+  }
+  return total == 0;
+}
@@ -0,0 +1,13 @@
+/* Deep recursion: many calls and returns, short frames. */
+
+int fib(int n)
+{
+  if (n < 2)
+    return n;
+  return fib(n - 1) + fib(n - 2);
+}
+
+int main(void)
+{
+  return fib(12) == 144 ? 0 : 1;
+}
@@ -0,0 +1,21 @@
+/* Many small functions: a new eh_frame row and symbol at every call. */
+
+#define F(n) \
+  __attribute__((noinline)) int f##n(int x) { return x * (n + 1) + n; }
+
+#define F8(n) F(n##0) F(n##1) F(n##2) F(n##3) F(n##4) F(n##5) F(n##6) F(n##7)
+
+F8(1) F8(2) F8(3) F8(4) F8(5) F8(6) F8(7) F8(8)
+
+#define C(n) x = f##n(x) & 0xffff;
+#define C8(n) C(n##0) C(n##1) C(n##2) C(n##3) C(n##4) C(n##5) C(n##6) C(n##7)
+
+int main(void)
+{
+  int x = 1, round;
+
+  for (round = 0; round < 16; round++) {
+    C8(1) C8(2) C8(3) C8(4) C8(5) C8(6) C8(7) C8(8)
+  }
+  return x == 0;
+}
@@ -0,0 +1,20 @@
+/* libc-heavy string work: most instructions run in libc. */
+
+#include <stdio.h>
+#include <string.h>
+
+int main(void)
+{
+  char buf[128], copy[128];
+  int i, total = 0;
+
+  for (i = 0; i < 16; i++) {
+    snprintf(buf, sizeof buf, "item %d of %s", i, "strings");
+    strcpy(copy, buf);
+    strcat(copy, buf + 5);
+    total += strlen(copy);
+    if (strcmp(copy, buf) == 0 || memchr(copy, 'x', strlen(copy)))
+      total++;
+  }
+  return total == 0;
+}
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+""" The benchmark suite of eh_frame_check: steps per second of whole runs
+on the fixtures, and microbenchmarks of its hot paths.
+
+`run` writes the results as JSON; `compare` flags the regressions between
+two result files, eg. of two checkouts:
+
+    ./suite.py run -o base.json --checker ~/base/testing/eh_frame_check.py
+    ./suite.py run -o new.json
+    ./suite.py compare base.json new.json
+
+The microbenchmarks adapt to the API of the checkout: the checkouts older
+than the backends read the registers through gdb, which a FakeGdb stands
+in for, and have other signatures for the lookups.
+"""
+
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import compare_backends
+
+# The CFA of the PLT entries: DW_OP_breg7 (rsp) 8; DW_OP_breg16 (rip) 0;
+# DW_OP_lit15; DW_OP_and; DW_OP_lit11; DW_OP_ge; DW_OP_lit3; DW_OP_shl;
+# DW_OP_plus
+PLT_EXPR = [0x77, 0x08, 0x80, 0x00, 0x3f, 0x1a, 0x3b, 0x2a, 0x33, 0x24, 0x22]
+
+# The metrics of the results, and whether more is better
+METRICS = {'steps_per_s': True, 'seconds': False, 'us_per_op': False}
+
+
+class FakeBackend:
+    ''' Stands in for the backend of the microbenchmarks '''
+
+    name = 'fake'
+
+    def __init__(self):
+        self.regs = {'rsp': 0x7fffffffe000, 'rip': 0x401020,
+                     'rbp': 0x7fffffffe040}
+
+    def get_reg(self, reg):
+        return self.regs[reg]
+
+    def get_sp(self):
+        return self.regs['rsp']
+
+    def read_memory(self, addr, size):
+        return addr & ((1 << (8 * size)) - 1)
+
+
+class GdbValue(int):
+    ''' A register read through FakeGdb: the older checkouts parse the sp
+    from its string, in hex like gdb prints pointers '''
+
+    def __str__(self):
+        return hex(self)
+
+    def __add__(self, other):
+        return GdbValue(int(self) + other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return GdbValue(int(self) - other)
+
+
+class FakeGdb:
+    ''' Stands in for the gdb module of the checkouts without backends,
+    with the registers of a FakeBackend '''
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def parse_and_eval(self, expr):
+        return GdbValue(self._backend.get_reg(expr.lstrip('$')))
+
+    def execute(self, command, from_tty=False, to_string=False):
+        return ''
+
+
+def load_checker(path):
+    ''' Import the eh_frame_check.py of `path`, of any checkout '''
+    spec = importlib.util.spec_from_file_location('eh_frame_check', path)
+    efc = importlib.util.module_from_spec(spec)
+    sys.modules['eh_frame_check'] = efc
+    spec.loader.exec_module(efc)
+    efc.verbose = False
+    efc.dbg_eval = False
+    return efc
+
+
+def best_time(f, repeat):
+    ''' The shortest of `repeat` runs of `f`, in seconds '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # the checker reports the objects it loads
+        with contextlib.redirect_stdout(io.StringIO()):
+            f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def sample_ips(ranges, count, seed):
+    ''' Runs of ips at the start of `ranges`, the pattern of stepping, and
+    random ips inside them '''
+    sequential = []
+    for begin, end in ranges:
+        sequential.extend(range(begin, min(end, begin + 8)))
+        if len(sequential) >= count:
+            break
+    rng = random.Random(seed)
+    scattered = [rng.randrange(begin, end)
+                 for begin, end in rng.choices(ranges, k=count)]
+    return {'sequential': sequential[:count], 'scattered': scattered}
+
+
+def new_cfi_table(efc):
+    # checkouts older than CFITable memorize the rows in an IntervalTree
+    if hasattr(efc, 'CFITable'):
+        return efc.CFITable()
+    return efc.IntervalTree()
+
+
+def new_symbol_table(efc):
+    # and the symbols in a dict of an IntervalTree and of the files loaded
+    if hasattr(efc, 'SymbolTable'):
+        return efc.SymbolTable()
+    return {'files': [], 'table': efc.IntervalTree()}
+
+
+def symbol_ranges(symbol_table):
+    if isinstance(symbol_table, dict):
+        return sorted((row.begin, row.end) for row in symbol_table['table'])
+    return sorted((begin, end) for begin, end, _ in symbol_table)
+
+
+def new_modules(efc):
+    # the objects mapped, all loaded: a ModuleRegistry, or the linked files
+    # of the older checkouts
+    if hasattr(efc, 'ModuleRegistry'):
+        return efc.ModuleRegistry([])
+    return efc.IntervalTree()
+
+
+def search_function(efc):
+    ''' search_eh_frame_table(table, modules, ip), of any checkout '''
+    search = efc.search_eh_frame_table
+    if len(inspect.signature(search).parameters) == 4:
+        # older checkouts also take the symbol table
+        symbol_table = new_symbol_table(efc)
+        return lambda table, modules, ip: search(table, modules,
+                                                 symbol_table, ip)
+    return search
+
+
+def status_functions(efc):
+    ''' The (call, push, pop, ret) updates of an X86_Status, of any
+    checkout '''
+    if hasattr(efc, 'process_x86_insn'):
+        return (lambda status: efc.process_x86_insn(status, efc.INSN_CALL,
+                                                    ''),
+                efc.process_push, efc.process_pop,
+                lambda status: efc.process_x86_insn(status, efc.INSN_RET,
+                                                    ''))
+
+    # older checkouts update the status in their main loop
+    def call(status):
+        status.push_ra(efc.gdb_get_sp() - 8)
+        status.reset_cs_tracking()
+
+    def ret(status):
+        status.pop_ra()
+        status.purge_restored_cs()
+        status.restore_cs_tracking()
+    return call, efc.process_push, efc.process_pop, ret
+
+
+def cfi_rows(table):
+    if hasattr(table, 'rows'):
+        return [(begin, end) for begin, end, _ in table.rows()]
+    return sorted((row.begin, row.end) for row in table)
+
+
+def setup_cfi(efc, args):
+    def memorize():
+        with open(args.library, 'rb') as f:
+            dwarfinfo = efc.read_eh_frame_table(efc.ELFFile(f))
+            efc.memorize_eh_frame_table(dwarfinfo, new_cfi_table(efc))
+
+    table = new_cfi_table(efc)
+    with open(args.library, 'rb') as f:
+        efc.memorize_eh_frame_table(efc.read_eh_frame_table(efc.ELFFile(f)),
+                                    table)
+    rows = cfi_rows(table)
+    benchmarks = [('memorize_eh_frame_table', len(rows), memorize)]
+
+    modules = new_modules(efc)
+    search_eh_frame_table = search_function(efc)
+    for pattern, ips in sorted(sample_ips(rows, args.lookups,
+                                          args.seed).items()):
+        def search(ips=ips):
+            for ip in ips:
+                search_eh_frame_table(table, modules, ip)
+        benchmarks.append(('search_eh_frame_table/' + pattern, len(ips),
+                           search))
+    return benchmarks
+
+
+def setup_symbols(efc, args):
+    symbol_table = new_symbol_table(efc)
+    with open(args.library, 'rb') as f:
+        efc.memorize_symbol_table(efc.ELFFile(f), symbol_table, args.library)
+    functions = symbol_ranges(symbol_table)
+    modules = new_modules(efc)
+    benchmarks = []
+    for pattern, ips in sorted(sample_ips(functions, args.lookups,
+                                          args.seed).items()):
+        def names(ips=ips):
+            for ip in ips:
+                efc.get_function_name(symbol_table, modules, ip)
+        benchmarks.append(('get_function_name/' + pattern, len(ips), names))
+    return benchmarks
+
+
+def setup_eval(efc, args):
+    from elftools.dwarf.callframe import CFARule
+    from elftools.dwarf.structs import DWARFStructs
+
+    structs = DWARFStructs(little_endian=True, dwarf_format=32,
+                           address_size=8)
+    benchmarks = []
+    for name, rule in (('reg+offset', CFARule(reg=7, offset=16)),
+                       ('expr', CFARule(expr=PLT_EXPR))):
+        def cfa(rule=rule):
+            for _ in range(args.evals):
+                efc.eval_CFARule(structs, rule)
+        benchmarks.append(('eval_CFARule/' + name, args.evals, cfa))
+
+    def expr_eval():
+        for _ in range(args.evals):
+            efc.eval_expr(structs, PLT_EXPR)
+    benchmarks.append(('ExprEval', args.evals, expr_eval))
+    return benchmarks
+
+
+def setup_status(efc, args):
+    call, push, pop, ret = status_functions(efc)
+
+    def push_pop():
+        status = efc.X86_Status(GdbValue(FakeBackend().get_sp()))
+        for _ in range(args.evals // 4):
+            call(status)
+            push(status, 'rbp')
+            pop(status, 'rbp')
+            ret(status)
+    return [('X86_Status/call-push-pop-ret', args.evals // 4 * 4, push_pop)]
+
+
+# The setups of the microbenchmarks, each returning (name, ops, function)
+MICRO_SETUPS = [setup_cfi, setup_symbols, setup_eval, setup_status]
+
+
+def run_micro(efc, args, results):
+    with open(args.library, 'rb') as f:
+        efc.ARCH = efc.ELFFile(f).get_machine_arch()
+    efc.pyelftools_init()
+    backend = FakeBackend()
+    if hasattr(efc, 'backend'):
+        efc.backend = backend
+    else:
+        efc.gdb = FakeGdb(backend)
+
+    benchmarks = []
+    for setup in MICRO_SETUPS:
+        try:
+            # the checker reports the objects it loads
+            with contextlib.redirect_stdout(io.StringIO()):
+                benchmarks.extend(setup(efc, args))
+        except (AttributeError, NameError, TypeError) as exn:
+            # an older checkout without these functions, or another API
+            print("{}: unavailable ({})".format(setup.__name__, exn),
+                  file=sys.stderr)
+    for name, ops, f in benchmarks:
+        try:
+            elapsed = best_time(f, args.repeat)
+        except (AttributeError, NameError, TypeError) as exn:
+            print("{}: unavailable ({})".format(name, exn), file=sys.stderr)
+            continue
+        results['micro/' + name] = {
+            'ops': ops,
+            'seconds': round(elapsed, 6),
+            'us_per_op': round(1e6 * elapsed / max(ops, 1), 4),
+        }
+        print("{:<44} {:>8} ops {:>10.3f} us/op".format(
+            name, ops, 1e6 * elapsed / max(ops, 1)))
+
+
+def run_end_to_end(args, results):
+    backends = args.backends.split(',')
+    engines = args.engine.split(',')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        binaries = compare_backends.build_fixtures(tmp_dir, args.cc,
+                                                   args.cflags.split())
+        for binary in binaries:
+            for backend in backends:
+                for engine in engines:
+                    runs = [compare_backends.run_checker(
+                        backend, engine, binary, args.timeout, args.checker)
+                        for _ in range(args.repeat)]
+                    elapsed, checked, verdict = min(runs,
+                                                    key=lambda run: run[0])
+                    rate = checked / elapsed if checked else 0
+                    name = '{}/{}/{}'.format(backend, engine,
+                                             os.path.basename(binary))
+                    results['e2e/' + name] = {
+                        'seconds': round(elapsed, 4),
+                        'checked': checked,
+                        'steps_per_s': round(rate, 1),
+                        'verdict': verdict,
+                    }
+                    print("{:<44} {:>8} checked {:>10.0f} steps/s  {}".format(
+                        name, checked or '-', rate, verdict))
+
+
+def checkout_commit(checker):
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(checker),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def do_run(args):
+    args.checker = os.path.abspath(args.checker)
+    results = {}
+    if not args.no_micro:
+        run_micro(load_checker(args.checker), args, results)
+    if not args.no_e2e:
+        run_end_to_end(args, results)
+
+    with open(args.output, 'w') as handle:
+        json.dump({
+            'meta': {
+                'checker': args.checker,
+                'commit': checkout_commit(args.checker),
+                'python': platform.python_version(),
+                'host': platform.node(),
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            },
+            'results': results,
+        }, handle, indent=1, sort_keys=True)
+    print("Results in {}".format(args.output))
+
+
+def compare(base, new, threshold):
+    ''' The lines comparing the results `base` and `new`, and the number of
+    regressions beyond `threshold` (a ratio) '''
+    lines = []
+    regressions = 0
+    for name in sorted(set(base) & set(new)):
+        for metric, higher_is_better in sorted(METRICS.items()):
+            if metric not in base[name] or metric not in new[name]:
+                continue
+            if metric == 'seconds' and ('us_per_op' in base[name]
+                                        or 'steps_per_s' in base[name]):
+                continue  # the same, per operation
+            old, now = base[name][metric], new[name][metric]
+            if not old or not now:
+                continue
+            # > 0 when slower
+            change = (old / now if higher_is_better else now / old) - 1
+            flag = ''
+            if change > threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            elif change < -threshold:
+                flag = 'improvement'
+            lines.append("{:<44} {:<12} {:>12.4g} {:>12.4g} {:>+7.1f}%  {}"
+                         .format(name, metric, old, now, 100 * change, flag))
+        if base[name].get('verdict') != new[name].get('verdict'):
+            regressions += 1
+            lines.append("{:<44} verdict changed: {} -> {}".format(
+                name, base[name].get('verdict'), new[name].get('verdict')))
+    for name in sorted(set(base) - set(new)):
+        lines.append("{:<44} missing in the new results".format(name))
+    for name in sorted(set(new) - set(base)):
+        lines.append("{:<44} missing in the base results".format(name))
+    return lines, regressions
+
+
+def do_compare(args):
+    with open(args.base) as handle:
+        base = json.load(handle)
+    with open(args.new) as handle:
+        new = json.load(handle)
+    print("base: {} ({})".format(base['meta']['checker'],
+                                 base['meta']['commit']))
+    print("new:  {} ({})".format(new['meta']['checker'],
+                                 new['meta']['commit']))
+    print("{:<44} {:<12} {:>12} {:>12} {:>8}".format(
+        'benchmark', 'metric', 'base', 'new', 'slower'))
+    lines, regressions = compare(base['results'], new['results'],
+                                 args.threshold / 100)
+    for line in lines:
+        print(line)
+    compared = set(base['results']) & set(new['results'])
+    print("{} regressions beyond {}% in {} benchmarks compared, {} in one "
+          "result only".format(regressions, args.threshold, len(compared),
+                               len(set(base['results'])
+                                   ^ set(new['results']))))
+    sys.exit(1 if regressions else 0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark suite of eh_frame_check")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help="Run the benchmarks")
+    run_parser.add_argument('--output', '-o', default='bench.json',
+                            help="The JSON results (default: bench.json)")
+    run_parser.add_argument('--checker', default=compare_backends.CHECKER,
+                            help="The eh_frame_check.py to benchmark "
+                                 "(default: the one of this checkout)")
+    run_parser.add_argument('--repeat', type=int, default=3,
+                            help="Runs of each benchmark, the fastest "
+                                 "counts (default: 3)")
+    run_parser.add_argument('--no-micro', action='store_true',
+                            help="Skip the microbenchmarks")
+    run_parser.add_argument('--no-e2e', action='store_true',
+                            help="Skip the runs on the fixtures")
+    run_parser.add_argument('--library',
+                            default='/lib/x86_64-linux-gnu/libm.so.6',
+                            help="The library of the microbenchmarks")
+    run_parser.add_argument('--lookups', type=int, default=100000,
+                            help="Lookups per lookup microbenchmark")
+    run_parser.add_argument('--evals', type=int, default=100000,
+                            help="Evaluations per evaluation microbenchmark")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--engine', default='step',
+                            help="Comma-separated engines of the runs "
+                                 "(default: step)")
+    run_parser.add_argument('--backends', default='ptrace',
+                            help="Comma-separated backends of the runs "
+                                 "(default: ptrace)")
+    run_parser.add_argument('--cc', default=os.environ.get('CC', 'cc'))
+    run_parser.add_argument('--cflags', default='-O1 -no-pie',
+                            help="Flags used to build the fixtures")
+    run_parser.add_argument('--timeout', type=int, default=600)
+    run_parser.set_defaults(func=do_run)
+
+    compare_parser = commands.add_parser(
+        'compare', help="Flag the regressions between two results")
+    compare_parser.add_argument('--threshold', type=float, default=10,
+                                help="Slowdown, in percent, flagged as a "
+                                     "regression (default: 10)")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.set_defaults(func=do_compare)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
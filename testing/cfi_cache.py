@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+""" Manage the cache of eh_frame rows of `eh_frame_check.py`.
+
+`warm` decodes the eh_frame of every ELF object under the given
+directories (e.g. a sysroot) that is not cached yet, `stats` reports the
+cache size and `clear` empties it.
+"""
+
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import eh_frame_check as efc
+from eh_frame_check import ELFFile
+
+ELF_MAGIC = b'\x7fELF'
+
+
+def elf_objects(roots):
+    ''' The regular ELF files under `roots` '''
+    for root in roots:
+        for dir_path, dir_names, file_names in os.walk(root):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        if f.read(4) != ELF_MAGIC:
+                            continue
+                except OSError:
+                    continue
+                yield path
+
+
+_cache = None
+
+
+def init_worker(directory, max_bytes):
+    global _cache
+    efc.verbose = False
+    _cache = efc.CFICache(directory, max_bytes)
+
+
+def warm_one(path):
+    ''' Returns 'cached', 'stored', 'no eh_frame' or the error '''
+    try:
+        with open(path, 'rb') as f:
+            elffile = ELFFile(f)
+            if not elffile.get_section_by_name('.eh_frame'):
+                return 'no eh_frame'
+            key = _cache.key(path, elffile)
+            if os.path.exists(_cache._path(key)):
+                return 'cached'
+            efc.ARCH = elffile.get_machine_arch()
+            efc.pyelftools_init()
+            rows = efc.memorize_eh_frame_table(
+                efc.read_eh_frame_table(elffile), efc.CFITable())
+            _cache.store(key, rows)
+            return 'stored'
+    except Exception as e:
+        return '{0}: {1}'.format(type(e).__name__, e)
+
+
+def warm(args):
+    counts = {}
+    with Pool(args.jobs, initializer=init_worker,
+              initargs=(args.cache_dir, args.max_size << 20)) as pool:
+        paths = list(elf_objects(args.roots))
+        for path, result in zip(paths, pool.imap(warm_one, paths)):
+            if result not in ('cached', 'stored', 'no eh_frame'):
+                print("{0}: skipped, {1}".format(path, result))
+                result = 'skipped'
+            counts[result] = counts.get(result, 0) + 1
+    print(", ".join("{0} {1}".format(n, r) for r, n in sorted(counts.items())))
+    # the workers evict concurrently: enforce the cap once more
+    cache = efc.CFICache(args.cache_dir, args.max_size << 20)
+    cache.evict()
+    print(cache.stats())
+
+
+def stats(args):
+    print(efc.CFICache(args.cache_dir, args.max_size << 20).stats())
+
+
+def clear(args):
+    cache = efc.CFICache(args.cache_dir, args.max_size << 20)
+    for mtime, size, path in cache.files():
+        os.remove(path)
+    print(cache.stats())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Manage the eh_frame cache of eh_frame_check.py")
+    parser.add_argument('--cache-dir', default=efc.cfi_cache_dir,
+                        required=efc.cfi_cache_dir is None,
+                        help="The cache directory "
+                             "(default: $EH_FRAME_CHECK_CFI_CACHE)")
+    parser.add_argument('--max-size', metavar='MiB', type=int,
+                        default=efc.cfi_cache_size >> 20,
+                        help="Size cap of the cache (default: 512)")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    warm_parser = commands.add_parser(
+        'warm', help="Cache the ELF objects under the given directories")
+    warm_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                             help="Number of worker processes "
+                                  "(default: all cores)")
+    warm_parser.add_argument('roots', nargs='+', metavar='DIR')
+    warm_parser.set_defaults(func=warm)
+
+    commands.add_parser('stats', help="Report the cache size").set_defaults(
+        func=stats)
+    commands.add_parser('clear', help="Empty the cache").set_defaults(
+        func=clear)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
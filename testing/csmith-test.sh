@@ -8,6 +8,8 @@ if [ -z "$CC" ] ; then
 	CC="cc"
 fi
 
+rm -f csmith.mismatches.ndjson
 $CC $CFLAGS $LDFLAGS -o csmith.out "$1"
-gdb -q -x "$bin_dir/eh_frame_check.py" csmith.out | tee csmith.log
+gdb -q -ex "py arg_report = 'csmith.mismatches.ndjson'" \
+	-x "$bin_dir/eh_frame_check.py" csmith.out | tee csmith.log
 grep Mismatch csmith.log && exit 1 || exit 0
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+""" Decode a binary event trace written by `eh_frame_check.py` with
+`events_binary`, as text or as NDJSON """
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import eh_frame_check as efc
+
+
+def format_text(event, out):
+    kind = event['event']
+    if kind == 'step':
+        out.write("=> {0} ({1}) [{2}] ({3} {4})".format(
+            efc.format_hex(event['ip']), efc.format_hex(event['offset']),
+            event['function'], event['mnemonic'], event['operand']))
+    elif kind == 'result':
+        verdict = event['verdict']
+        out.write("\n" if verdict == 'CHECKED' else "  [{0}]\n".format(verdict))
+    elif kind == 'stack':
+        indent = '|..' * event['depth']
+        if event['ra'] is None:
+            out.write("{0} {1}\n".format(indent, event['label']))
+        else:
+            out.write("{0} {1}: RA {2}\n".format(
+                indent, event['label'], efc.format_hex(event['ra'])))
+    else:
+        out.write(event['text'] + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Decode a binary event trace of eh_frame_check.py")
+    parser.add_argument('--format', choices=['text', 'ndjson'],
+                        default='text')
+    parser.add_argument('trace', help="The binary event trace")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.trace, 'rb') as f:
+        for event in efc.read_events(f):
+            if args.format == 'ndjson':
+                sys.stdout.write(json.dumps(event) + "\n")
+            else:
+                format_text(event, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
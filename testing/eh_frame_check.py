@@ -31,10 +31,24 @@
 
 import sys
 import re
+import time
 from copy import copy
 import traceback
 import functools
 import signal
+import os
+import ctypes
+import platform
+import subprocess
+import argparse
+import struct
+import json
+import mmap
+import hashlib
+import fnmatch
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
 
 import cProfile
 
@@ -42,6 +56,37 @@ import cProfile
 verbose = False
 dbg_eval = False
 cs_eval = False
+engine = 'step'
+# validations of an address, in the same stack state, after which the
+# saturate engine stops checking it
+saturation = 100
+record_path = None
+# event traces in NDJSON and binary format, disabled if None
+events_ndjson_path = None
+events_binary_path = None
+# on a mismatch, report it in `report_path` (NDJSON, if not None) and
+# abort, or resync and go on if `keep_going`, up to `max_reports` reports
+keep_going = False
+report_path = None
+max_reports = 100
+# calls into code matching these specs are stepped over, see StepOver
+allow_specs = []
+deny_specs = []
+# stop the run after this many stops of the inferior or checked
+# instructions, if not None
+max_steps = None
+max_checked = None
+# append a heartbeat to `heartbeat_path` (NDJSON, if not None) every
+# `heartbeat_interval` seconds
+heartbeat_path = None
+heartbeat_interval = 10
+# time the phases of the run and count the checked instructions by
+# function, in `profile_path` (if not None) as 'speedscope' or 'pstats'
+profile_path = None
+profile_format = 'speedscope'
+# directory and size cap (bytes) of the cfi cache, disabled if None
+cfi_cache_dir = os.environ.get('EH_FRAME_CHECK_CFI_CACHE')
+cfi_cache_size = 512 << 20
 
 # Setup pyelftools
 # myPath = '/home/raph/Documents/TRAVAIL/X/Project/pyelftools/'
@@ -53,7 +98,8 @@ from elftools.elf.elffile import ELFFile
 from elftools.elf.sections import SymbolTableSection
 from elftools.elf.descriptions import describe_symbol_type
 
-from elftools.dwarf.callframe import CIE, FDE, RegisterRule
+from elftools.dwarf.callframe import (
+    CIE, FDE, RegisterRule, CFARule, CallFrameInfo)
 from elftools.common.py3compat import (
     ifilter, bytes2str )
 from elftools.dwarf.descriptions import (
@@ -73,6 +119,13 @@ from intervaltree import Interval, IntervalTree
 
 ARCH = '<unknown>'
 
+# The backend driving the inferior: GdbBackend or PtraceBackend
+backend = None
+# The signal handlers, see Killer
+killer = None
+# The Profiler of the run, if profiling
+profiler = None
+
 def cs_eval_func(default_return=None):
     """ A function returning None that should be executed iff `cs_eval`
 
@@ -102,9 +155,16 @@ def pyelftools_init():
     set_global_machine_arch(ARCH)
 
 # Aux functions
-def abort():
+def abort(from_handler=False):
+    """ Quit with 1; `from_handler` when invoked by a signal handler, which
+    must not query the backend nor load tables """
     print ('Aborting...')
-    gdb_execute ('quit')
+    tracer.close()
+    if profiler != None:
+        profiler.close(resolve=not from_handler)
+    if backend is None:
+        sys.exit(1)
+    backend.quit(1)
 
 def error(e):
     print ("\n*** Error")
@@ -141,6 +201,190 @@ def emitline(s=''):
     if verbose:
         sys.stdout.write(indent_str+' '+str(s).rstrip() + '\n')
 
+# tracing
+#
+# The checker reports what it does to `tracer`.  Call sites test
+# `tracer.enabled` before building an event, so that nothing is computed
+# when no sink is enabled.
+
+class TextSink:
+    """ The human readable trace of `verbose` """
+
+    def step(self, ip, offset, function, mnemonic, operand):
+        sys.stdout.write("%s => %s (%s) [%s] (%s %s)" % (
+            indent_str, format_hex(ip), format_hex(offset) or '', function,
+            mnemonic, operand))
+
+    def result(self, verdict):
+        sys.stdout.write("  [%s]\n" % verdict if verdict else "\n")
+
+    def stack(self, label, status):
+        if status == None:
+            sys.stdout.write(indent_str+' '+label + '\n')
+        else:
+            sys.stdout.write(indent_str+' '+(label+': '+str(status)).rstrip()
+                             + '\n')
+
+    def note(self, text):
+        sys.stdout.write(indent_str+' '+text.rstrip() + '\n')
+
+    def close(self):
+        sys.stdout.flush()
+
+def status_ra(status):
+    ra = status.get_ra()
+    return ra if isinstance(ra, int) else None
+
+class NdjsonSink:
+    """ One JSON object per event """
+
+    def __init__(self, path):
+        self._file = open(path, 'w')
+
+    def _write(self, event):
+        self._file.write(json.dumps(event) + '\n')
+
+    def step(self, ip, offset, function, mnemonic, operand):
+        self._write({'event': 'step', 'ip': ip, 'offset': offset,
+                     'function': function, 'mnemonic': mnemonic,
+                     'operand': operand})
+
+    def result(self, verdict):
+        self._write({'event': 'result', 'verdict': verdict or 'CHECKED'})
+
+    def stack(self, label, status):
+        self._write({'event': 'stack', 'label': label,
+                     'ra': None if status == None else status_ra(status),
+                     'depth': len(indent_str) // 3})
+
+    def note(self, text):
+        self._write({'event': 'note', 'text': text})
+
+    def close(self):
+        self._file.close()
+
+# Binary event traces: the magic, then records made of a type byte and of
+# its payload.  Strings are sent once, as EVENT_STRING records, and then
+# referred to by index.
+EVENT_MAGIC = b'EHEVENT1'
+EVENT_STRING, EVENT_STEP, EVENT_RESULT, EVENT_STACK, EVENT_NOTE = range(5)
+EVENT_PAYLOADS = {
+    EVENT_STRING: struct.Struct('<IH'),    # index, length, then utf-8
+    EVENT_STEP: struct.Struct('<QQIII'),   # ip, offset, function, mnemonic, operand
+    EVENT_RESULT: struct.Struct('<I'),     # verdict
+    EVENT_STACK: struct.Struct('<I?qH'),   # label, has ra, ra, depth
+    EVENT_NOTE: struct.Struct('<I'),       # text
+}
+
+class BinarySink:
+    """ A compact binary trace, decoded by decode_events.py """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(EVENT_MAGIC)
+        self._strings = {}
+
+    def _string(self, s):
+        index = self._strings.get(s)
+        if index == None:
+            index = len(self._strings)
+            self._strings[s] = index
+            data = s.encode('utf-8')[:0xffff]
+            self._file.write(bytes([EVENT_STRING]))
+            self._file.write(EVENT_PAYLOADS[EVENT_STRING].pack(index,
+                                                                len(data)))
+            self._file.write(data)
+        return index
+
+    def _write(self, kind, *values):
+        self._file.write(bytes([kind]))
+        self._file.write(EVENT_PAYLOADS[kind].pack(*values))
+
+    def step(self, ip, offset, function, mnemonic, operand):
+        self._write(EVENT_STEP, ip, offset or 0, self._string(function),
+                    self._string(mnemonic), self._string(operand))
+
+    def result(self, verdict):
+        self._write(EVENT_RESULT, self._string(verdict))
+
+    def stack(self, label, status):
+        ra = None if status == None else status_ra(status)
+        self._write(EVENT_STACK, self._string(label), ra != None, ra or 0,
+                    len(indent_str) // 3)
+
+    def note(self, text):
+        self._write(EVENT_NOTE, self._string(text))
+
+    def close(self):
+        self._file.close()
+
+def read_events(f):
+    """ Iterates over the events of a binary trace, as dicts in the format
+    of NdjsonSink """
+    if f.read(len(EVENT_MAGIC)) != EVENT_MAGIC:
+        error ("not an event trace")
+    strings = []
+    while True:
+        kind = f.read(1)
+        if not kind:
+            return
+        kind = kind[0]
+        payload = EVENT_PAYLOADS[kind]
+        values = payload.unpack(f.read(payload.size))
+        if kind == EVENT_STRING:
+            strings.append(f.read(values[1]).decode('utf-8'))
+        elif kind == EVENT_STEP:
+            yield {'event': 'step', 'ip': values[0], 'offset': values[1],
+                   'function': strings[values[2]],
+                   'mnemonic': strings[values[3]],
+                   'operand': strings[values[4]]}
+        elif kind == EVENT_RESULT:
+            yield {'event': 'result',
+                   'verdict': strings[values[0]] or 'CHECKED'}
+        elif kind == EVENT_STACK:
+            yield {'event': 'stack', 'label': strings[values[0]],
+                   'ra': values[2] if values[1] else None,
+                   'depth': values[3]}
+        elif kind == EVENT_NOTE:
+            yield {'event': 'note', 'text': strings[values[0]]}
+
+class Tracer:
+    """ Dispatches the events of the checker to the enabled sinks """
+
+    def __init__(self):
+        self.sinks = []
+        self.enabled = False
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        self.enabled = True
+
+    def step(self, ip, offset, function, mnemonic, operand):
+        for sink in self.sinks:
+            sink.step(ip, offset, function, mnemonic, operand)
+
+    def result(self, verdict=''):
+        """ The outcome of the last step: '' (checked), 'MISMATCH',
+        'SKIPPED' or 'RECORDED' """
+        for sink in self.sinks:
+            sink.result(verdict)
+
+    def stack(self, label, status=None):
+        for sink in self.sinks:
+            sink.stack(label, status)
+
+    def note(self, text):
+        for sink in self.sinks:
+            sink.note(text)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+        self.enabled = False
+
+tracer = Tracer()
+
 def format_hex(addr, fieldsize=None, fullhex=False, lead0x=True, alternate=False):
     """ Format an address into a hexadecimal string.
 
@@ -262,17 +506,487 @@ def dump_eh_frame_table(dwarfinfo):
         dump_eh_frame_table_entry(entry)
 
 def dump_memorized_eh_frame_table(eh_frame_table):
-    for e in sorted(eh_frame_table):
-        s = (' %-9s' % describe_CFI_CFA_rule(e.data[0]['cfa']))
-        for regnum in e.data[1][0]:
-            if regnum in e.data[0]:
-                s += ('%-6s' % describe_CFI_register_rule(e.data[0][regnum]))
+    for begin, end, (row, regs_info) in eh_frame_table.rows():
+        s = (' %-9s' % describe_CFI_CFA_rule(row['cfa']))
+        for regnum in regs_info[0]:
+            if regnum in row:
+                s += ('%-6s' % describe_CFI_register_rule(row[regnum]))
             else:
                 s += ('%-6s' % 'u')
 
-        print (" {0}-{1}: {2}".format(hex(e.begin), hex(e.end), s))
+        print (" {0}-{1}: {2}".format(hex(begin), hex(end), s))
+
+def cfi_rule_key(rule):
+    if isinstance(rule, RegisterRule):
+        if isinstance(rule.arg, list):
+            return (rule.type, tuple(rule.arg))
+        return (rule.type, rule.arg)
+    return (rule.reg, rule.offset,
+            None if rule.expr is None else tuple(rule.expr))
+
+class CFIRows:
+    """ The eh_frame rows of one object, relative to its load address.
+
+    Row bounds are kept in sorted columns (`array('Q')`, or views of a
+    cached file), each row pointing to an interned (row, regs_info) pair:
+    rows with the same CFA rule, register rules, reg_order and ra_regnum
+    share one entry, whose row dict has no 'pc' key.
+    """
+
+    def __init__(self, begins=None, ends=None, indexes=None, entries=None,
+                 keys=None):
+        if begins is None:
+            begins, ends, indexes = array('Q'), array('Q'), array('I')
+        self.begins = begins
+        self.ends = ends
+        self.indexes = indexes
+        self.entries = entries if entries is not None else []
+        self._keys = keys if keys is not None else {}
+        self._sorted = True
+        self.high = max(ends) if len(ends) > 0 else 0
+        # number of FDEs decoded to build the rows
+        self.fdes_decoded = 0
+
+    def __len__(self):
+        return len(self.begins)
+
+    @property
+    def low(self):
+        self.sort()
+        return self.begins[0] if len(self.begins) > 0 else None
+
+    def add(self, begin, end, row, regs_info):
+        reg_order, ra_regnum = regs_info
+        rules = tuple(sorted((regnum, cfi_rule_key(rule))
+                             for regnum, rule in row.items()
+                             if regnum != 'pc' and regnum != 'cfa'))
+        key = (cfi_rule_key(row['cfa']), rules, tuple(reg_order), ra_regnum)
+        index = self._keys.get(key)
+        if index is None:
+            index = len(self.entries)
+            interned = dict((k, v) for k, v in row.items() if k != 'pc')
+            self.entries.append((interned, (list(reg_order), ra_regnum)))
+            self._keys[key] = index
+
+        if len(self.begins) > 0 and begin < self.begins[-1]:
+            self._sorted = False
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.indexes.append(index)
+        self.high = max(self.high, end)
+
+    def sort(self):
+        if self._sorted:
+            return
+        rows = sorted(zip(self.begins, self.ends, self.indexes))
+        self.begins = array('Q', [r[0] for r in rows])
+        self.ends = array('Q', [r[1] for r in rows])
+        self.indexes = array('I', [r[2] for r in rows])
+        self._sorted = True
+
+    def find_row(self, offset):
+        """ Returns the (begin, end, entry) of the row of `offset`, or None """
+        i = bisect_right(self.begins, offset) - 1
+        if i >= 0 and offset < self.ends[i]:
+            return self.begins[i], self.ends[i], self.entries[self.indexes[i]]
+        return None
+
+    def rows(self, begin, end):
+        """ Iterates over the (begin, end, entry) of the rows starting in
+        [begin, end) """
+        i = bisect_left(self.begins, begin)
+        while i < len(self.begins) and self.begins[i] < end:
+            yield self.begins[i], self.ends[i], self.entries[self.indexes[i]]
+            i += 1
+
+# Number of decoded FDEs kept by a LazyCFIRows
+CFI_DECODED_FDES = 1024
+
+class LazyCFIRows:
+    """ The eh_frame rows of one object, decoded one FDE at a time.
+
+    The FDE of an offset is found in the binary search table of
+    .eh_frame_hdr; its rows are decoded the first time an offset falls in
+    its range, and kept in a LRU of CFI_DECODED_FDES FDEs.
+    """
+
+    def __init__(self, dwarfinfo, locations, fde_offsets):
+        self._cfi = CallFrameInfo(stream=dwarfinfo.eh_frame_sec.stream,
+                                  size=dwarfinfo.eh_frame_sec.size,
+                                  address=dwarfinfo.eh_frame_sec.address,
+                                  base_structs=dwarfinfo.structs,
+                                  for_eh_frame=True)
+        self._locations = locations
+        self._fde_offsets = fde_offsets
+        # fde index -> CFIRows, least recently used first
+        self._decoded = OrderedDict()
+        # shared by the CFIRows of the FDEs
+        self.entries = []
+        self._keys = {}
+        self.fdes_decoded = 0
+        self.low = locations[0] if len(locations) > 0 else None
+        self.high = 0
+        if len(locations) > 0:
+            last = self._cfi._parse_entry_at(fde_offsets[-1])
+            self.high = last['initial_location'] + last['address_range']
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._decoded.values())
+
+    def _fde_rows(self, i):
+        rows = self._decoded.get(i)
+        if rows != None:
+            self._decoded.move_to_end(i)
+            return rows
+        rows = CFIRows(entries=self.entries, keys=self._keys)
+        entry = self._cfi._parse_entry_at(self._fde_offsets[i])
+        if isinstance(entry, FDE):
+            memorize_eh_frame_table_entry(rows, entry)
+        rows.sort()
+        self.fdes_decoded += 1
+        self._decoded[i] = rows
+        if len(self._decoded) > CFI_DECODED_FDES:
+            self._decoded.popitem(last=False)
+        return rows
+
+    def find_row(self, offset):
+        i = bisect_right(self._locations, offset) - 1
+        if i < 0:
+            return None
+        return self._fde_rows(i).find_row(offset)
+
+    def rows(self, begin, end):
+        i = max(bisect_right(self._locations, begin) - 1, 0)
+        while i < len(self._locations) and self._locations[i] < end:
+            for row in self._fde_rows(i).rows(begin, end):
+                yield row
+            i += 1
+
+# DW_EH_PE pointer encodings: value formats and applications
+DW_EH_PE_FORMATS = {0x02: 'H', 0x03: 'I', 0x04: 'Q',
+                    0x0a: 'h', 0x0b: 'i', 0x0c: 'q'}
+DW_EH_PE_absptr = 0x00
+DW_EH_PE_pcrel = 0x10
+DW_EH_PE_datarel = 0x30
+DW_EH_PE_omit = 0xff
+
+def encoded_pointer_format(encoding, address_size):
+    """ The struct format of the pointers of `encoding`, or None if it is
+    unsupported """
+    value_format = encoding & 0x0f
+    if value_format == DW_EH_PE_absptr:
+        return '<Q' if address_size == 8 else '<I'
+    elif value_format in DW_EH_PE_FORMATS:
+        return '<' + DW_EH_PE_FORMATS[value_format]
+    return None
+
+def read_encoded_pointer(data, offset, encoding, section_address, address_size):
+    """ Returns the pointer of `encoding` at `offset` of the data of a
+    section, and the offset after it; None if the encoding is unsupported
+    or the data too short """
+    fmt = encoded_pointer_format(encoding, address_size)
+    if fmt == None or offset + struct.calcsize(fmt) > len(data):
+        return None
+    value = struct.unpack_from(fmt, data, offset)[0]
+    application = encoding & 0x70
+    if application == DW_EH_PE_pcrel:
+        value += section_address + offset
+    elif application == DW_EH_PE_datarel:
+        value += section_address
+    elif application != DW_EH_PE_absptr or encoding & 0x80:
+        return None
+    return value & 0xffffffffffffffff, offset + struct.calcsize(fmt)
+
+def read_eh_frame_hdr(elffile):
+    """ Returns the initial locations of the FDEs, sorted, and their offsets
+    in .eh_frame, from the binary search table of .eh_frame_hdr; None if
+    there is no usable table """
+    hdr = elffile.get_section_by_name('.eh_frame_hdr')
+    eh_frame = elffile.get_section_by_name('.eh_frame')
+    if hdr == None or eh_frame == None or not elffile.little_endian:
+        return None
+    data = hdr.data()
+    address_size = elffile.elfclass // 8
+    if len(data) < 4:
+        return None
+    version, ptr_enc, count_enc, table_enc = struct.unpack_from('<BBBB', data)
+    if (version != 1 or count_enc == DW_EH_PE_omit
+            or table_enc == DW_EH_PE_omit):
+        return None
+    pointer = read_encoded_pointer(data, 4, ptr_enc, hdr['sh_addr'],
+                                   address_size)
+    if pointer == None:
+        return None
+    count = read_encoded_pointer(data, pointer[1], count_enc, hdr['sh_addr'],
+                                 address_size)
+    if count == None:
+        return None
+    count, offset = count
+    table_fmt = encoded_pointer_format(table_enc, address_size)
+    # each entry is a location and the address of its FDE
+    if (table_fmt == None
+            or count * 2 * struct.calcsize(table_fmt) > len(data) - offset):
+        return None
+
+    locations = array('Q')
+    fde_offsets = array('Q')
+    for i in range(count):
+        location = read_encoded_pointer(data, offset, table_enc,
+                                        hdr['sh_addr'], address_size)
+        if location == None:
+            return None
+        fde = read_encoded_pointer(data, location[1], table_enc,
+                                   hdr['sh_addr'], address_size)
+        if fde == None:
+            return None
+        locations.append(location[0])
+        fde_offsets.append(fde[0] - eh_frame['sh_addr'])
+        offset = fde[1]
+    return locations, fde_offsets
+
+class CFITable:
+    """ The memorized eh_frame rows of the program and of its libraries.
+
+    Each object contributes a segment of rows (`CFIRows` or `LazyCFIRows`)
+    at its load address.  Lookups bisect the segments and then the rows of
+    the segment, after checking the row found by the previous lookup.
+    """
+
+    def __init__(self):
+        # (low, high, base, rows) sorted by low, and the lows
+        self._segments = []
+        self._lows = []
+        # last row found
+        self._last_begin = 1
+        self._last_end = 0
+        self._last_entry = None
+        self.lookups = 0
+        self.last_hits = 0
+
+    def __len__(self):
+        return sum(len(s[3]) for s in self._segments)
+
+    def add_rows(self, base, rows):
+        if rows.low == None:
+            return
+        low = base + rows.low
+        i = bisect_right(self._lows, low)
+        self._segments.insert(i, (low, base + rows.high, base, rows))
+        self._lows.insert(i, low)
+
+    def _find(self, ip):
+        """ Returns the (begin, end, entry) of the row of `ip`, or None """
+        s = bisect_right(self._lows, ip) - 1
+        if s < 0:
+            return None
+        low, high, base, rows = self._segments[s]
+        if ip >= high:
+            return None
+        row = rows.find_row(ip - base)
+        if row == None:
+            return None
+        return base + row[0], base + row[1], row[2]
+
+    def lookup(self, ip):
+        """ Returns the (row, regs_info) pair of the row of `ip`, or None """
+        self.lookups += 1
+        if self._last_begin <= ip < self._last_end:
+            self.last_hits += 1
+            return self._last_entry
+        row = self._find(ip)
+        if row == None:
+            return None
+        self._last_begin, self._last_end, self._last_entry = row
+        return self._last_entry
+
+    def row_bounds(self, ip):
+        """ Returns the (begin, end) of the row of `ip`, or None """
+        row = self._find(ip)
+        if row == None:
+            return None
+        return row[0], row[1]
+
+    def rows(self, begin=0, end=0xffffffffffffffff):
+        """ Iterates over the (begin, end, entry) of the rows starting in
+        [begin, end) """
+        for low, high, base, rows in self._segments:
+            if high <= begin or low >= end:
+                continue
+            for row_begin, row_end, entry in rows.rows(max(begin - base, 0),
+                                                       end - base):
+                yield base + row_begin, base + row_end, entry
+
+    def stats(self):
+        return ("eh_frame rows: {0} rows, {1} distinct, {2} objects, "
+                "{3} FDEs decoded, {4} lookups, {5} same-row hits".format(
+                    len(self), sum(len(s[3].entries) for s in self._segments),
+                    len(self._segments),
+                    sum(s[3].fdes_decoded for s in self._segments),
+                    self.lookups, self.last_hits))
+
+# persistent cache of the eh_frame rows
+
+CFI_CACHE_MAGIC = b'EHCFI001'
+# number of rows, size of the JSON entries
+CFI_CACHE_HEADER = struct.Struct('<II')
+
+def cfi_rule_to_json(regnum, rule):
+    if regnum == 'cfa':
+        return ['cfa', rule.reg, rule.offset, rule.expr]
+    return [regnum, rule.type, rule.arg]
+
+def cfi_rule_from_json(rule):
+    if rule[0] == 'cfa':
+        return 'cfa', CFARule(reg=rule[1], offset=rule[2], expr=rule[3])
+    return rule[0], RegisterRule(rule[1], rule[2])
+
+def elf_build_id(elffile):
+    """ The GNU build-id of `elffile`, in hex, or None """
+    section = elffile.get_section_by_name('.note.gnu.build-id')
+    if section is not None:
+        for note in section.iter_notes():
+            if note['n_type'] == 'NT_GNU_BUILD_ID':
+                return note['n_desc']
+    return None
+
+class CFICache:
+    """ A persistent cache of the eh_frame rows of each object, in a
+    directory of flat files keyed by build-id (or by path, size and mtime
+    if the object has no build-id).
+
+    A file is the header, the begins, ends and indexes columns of the rows,
+    and the interned entries as JSON.  Files are opened with `mmap`: the
+    columns are used in place, so the pages are shared by all the checkers
+    using the cache.  The least recently used files are evicted when the
+    cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # keep the mappings alive as long as their rows
+        self._maps = []
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(path, elffile):
+        build_id = elf_build_id(elffile)
+        if build_id != None:
+            return build_id
+        st = os.stat(path)
+        name = '{0}:{1}:{2}'.format(os.path.realpath(path), st.st_size,
+                                    st.st_mtime_ns)
+        return 'path-' + hashlib.sha1(name.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.cfi')
+
+    def load(self, key):
+        """ Returns the cached CFIRows of `key`, or None """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if data[:len(CFI_CACHE_MAGIC)] != CFI_CACHE_MAGIC:
+            data.close()
+            self.misses += 1
+            return None
+        # bump the file in the LRU order; another checker may have evicted
+        # it meanwhile, the mapping stays valid
+        try:
+            os.utime(path)
+        except OSError:
+            pass
 
-def memorize_eh_frame_table_entry(eh_frame_table, entry, lib_base):
+        offset = len(CFI_CACHE_MAGIC)
+        count, json_size = CFI_CACHE_HEADER.unpack_from(data, offset)
+        offset += CFI_CACHE_HEADER.size
+        view = memoryview(data)
+        begins = view[offset:offset + 8 * count].cast('Q')
+        offset += 8 * count
+        ends = view[offset:offset + 8 * count].cast('Q')
+        offset += 8 * count
+        indexes = view[offset:offset + 4 * count].cast('I')
+        offset += 4 * count
+        entries = []
+        for rules, reg_order, ra_regnum in json.loads(
+                bytes(view[offset:offset + json_size])):
+            entries.append((dict(cfi_rule_from_json(r) for r in rules),
+                            (reg_order, ra_regnum)))
+
+        self._maps.append(data)
+        self.hits += 1
+        return CFIRows(begins, ends, indexes, entries)
+
+    def store(self, key, rows):
+        rows.sort()
+        entries = json.dumps([[[cfi_rule_to_json(regnum, rule)
+                                for regnum, rule in row.items()],
+                               reg_order, ra_regnum]
+                              for row, (reg_order, ra_regnum) in rows.entries])
+        entries = entries.encode()
+        path = self._path(key)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(CFI_CACHE_MAGIC)
+            f.write(CFI_CACHE_HEADER.pack(len(rows), len(entries)))
+            f.write(array('Q', rows.begins).tobytes())
+            f.write(array('Q', rows.ends).tobytes())
+            f.write(array('I', rows.indexes).tobytes())
+            f.write(entries)
+        os.replace(tmp_path, path)
+        self.stores += 1
+        self.evict(keep=path)
+
+    def files(self):
+        """ Returns the (mtime, size, path) of the cached files, oldest
+        first """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.cfi'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        return sorted(files)
+
+    def evict(self, keep=None):
+        files = self.files()
+        total = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        files = self.files()
+        return ("cfi cache: {0} hits, {1} misses, {2} stored, {3} evicted, "
+                "{4} files, {5} bytes".format(self.hits, self.misses,
+                                              self.stores, self.evictions,
+                                              len(files),
+                                              sum(f[1] for f in files)))
+
+# The CFICache, or None
+cfi_cache = None
+
+def memorize_eh_frame_table_entry(eh_frame_rows, entry):
     decoded_entry = entry.get_decoded()
 
     for line, next_line in zip(decoded_entry.table, decoded_entry.table[1:]+[None]):
@@ -284,51 +998,150 @@ def memorize_eh_frame_table_entry(eh_frame_table, entry, lib_base):
         if base == top:
             print("Warning: empty Interval at base: "+hex(base)+"  top: "+hex(top))
             return
-        eh_frame_table[base+lib_base:top+lib_base] = (line,
-                                                      (decoded_entry.reg_order,
-                                                       entry.cie['return_address_register']))
+        eh_frame_rows.add(base, top, line,
+                          (decoded_entry.reg_order,
+                           entry.cie['return_address_register']))
 
 def memorize_eh_frame_table(dwarfinfo, eh_frame_table, base=0):
+    """ Adds the rows of `dwarfinfo` at `base` to `eh_frame_table`, returns
+    them """
 
     print("*** memorize_eh_frame_table ***")
-    
+
+    eh_frame_rows = CFIRows()
     for entry in dwarfinfo.EH_CFI_entries():
         if isinstance(entry, FDE):
-            memorize_eh_frame_table_entry(eh_frame_table, entry, base)
+            memorize_eh_frame_table_entry(eh_frame_rows, entry)
+            eh_frame_rows.fdes_decoded += 1
+
+    eh_frame_table.add_rows(base, eh_frame_rows)
+    return eh_frame_rows
 
 #    dump_memorized_eh_frame_table(eh_frame_table)
-            
-def search_eh_frame_table(eh_frame_table, linked_files, symbol_table, ip):
+
+def load_eh_frame_table(elffile, file_name, eh_frame_table, base=0,
+                        dwarfinfo=None):
+    """ Adds the rows of `elffile` at `base` to `eh_frame_table`: from the
+    cfi cache if possible, otherwise decoded and cached in full.  Without a
+    cache, the FDEs are decoded lazily when .eh_frame_hdr has a search
+    table. """
+    if dwarfinfo == None:
+        dwarfinfo = read_eh_frame_table(elffile)
+    if cfi_cache != None:
+        key = cfi_cache.key(file_name, elffile)
+        rows = cfi_cache.load(key)
+        if rows != None:
+            eh_frame_table.add_rows(base, rows)
+            return
+        rows = memorize_eh_frame_table(dwarfinfo, eh_frame_table, base)
+        cfi_cache.store(key, rows)
+        return
+
+    fde_index = read_eh_frame_hdr(elffile)
+    if fde_index == None:
+        memorize_eh_frame_table(dwarfinfo, eh_frame_table, base)
+    else:
+        eh_frame_table.add_rows(base, LazyCFIRows(dwarfinfo, *fde_index))
+
+class Module:
+    """ An object mapped in the inferior, and which of its tables are
+    loaded """
+
+    def __init__(self, path):
+        self.path = path
+        self.base = None
+        self.cfi_loaded = False
+        self.symbols_loaded = False
+
+    def compute_base(self, elffile, section_name, section_begin):
+        """ The load address, from the address of one of its sections """
+        if self.base == None:
+            section = elffile.get_section_by_name(section_name)
+            self.base = section_begin - section['sh_offset']
+        return self.base
+
+class ModuleRegistry:
+    """ The objects mapped in the inferior, by address range.
+
+    Each object is parsed at most once for its eh_frame and once for its
+    symbols.  A miss at an address outside every object, or in an object
+    whose tables are already loaded, is known: it costs one bisect, and is
+    counted as an avoided re-parse.
+    """
+
+    def __init__(self, linked_files):
+        self._begins = array('Q')
+        self._ends = array('Q')
+        # (module, section name) of each range
+        self._sections = []
+        self.modules = {}
+        for f in sorted(linked_files):
+            path, section = f.data
+            module = self.modules.setdefault(path, Module(path))
+            self._begins.append(f.begin)
+            self._ends.append(f.end)
+            self._sections.append((module, section))
+        # the gaps between objects already reported
+        self._warned = set()
+        self.avoided_cfi = 0
+        self.avoided_symbols = 0
+
+    def find(self, ip):
+        """ Returns the (module, section name, section begin) of `ip`, or
+        None """
+        i = bisect_right(self._begins, ip) - 1
+        if i >= 0 and ip < self._ends[i]:
+            module, section = self._sections[i]
+            return module, section, self._begins[i]
+        return None
+
+    def warn_unmapped(self, ip):
+        """ Warns once for each gap between objects """
+        gap = bisect_right(self._begins, ip)
+        if gap not in self._warned:
+            self._warned.add(gap)
+            print("Warning: cannot determine lib_name for ip: "+str(ip))
+
+    def stats(self):
+        return ("modules: {0} objects, {1} eh_frame and {2} symbol tables "
+                "loaded, {3} eh_frame and {4} symbol re-parses avoided".format(
+                    len(self.modules),
+                    sum(m.cfi_loaded for m in self.modules.values()),
+                    sum(m.symbols_loaded for m in self.modules.values()),
+                    self.avoided_cfi, self.avoided_symbols))
+
+def search_eh_frame_table(eh_frame_table, modules, ip):
+    found = eh_frame_table.lookup(ip)
+    if found != None:
+        return found
+
+    mapped = modules.find(ip)
+    if mapped == None:
+        modules.warn_unmapped(ip)
+        return None
+    module, lib_section, section_begin = mapped
+    if module.cfi_loaded:
+        modules.avoided_cfi += 1
+        return None
+    module.cfi_loaded = True
+
     try:
-        return eh_frame_table[ip].pop().data
-    except:
-        try:
-            try:
-                lib_name = linked_files[ip].pop().data[0]
-            except:
-                print("Warning: cannot determine lib_name for ip: "+str(ip))
-                return None
-            lib_section = linked_files[ip].pop().data[1]
-            with open(lib_name, 'rb') as f:
-                lib_elffile = ELFFile(f)
-                lib_dwarfinfo = read_eh_frame_table(lib_elffile)
-                # retrieve the offset of the section 
-                section = lib_elffile.get_section_by_name(lib_section)
-                # compute base 
-                lib_base = linked_files[ip].pop().begin - section['sh_offset']
-                
-                print ("\n* importing eh_frame for {0} at {1} ".format(lib_name, hex(lib_base)))
-
-                memorize_eh_frame_table(lib_dwarfinfo, eh_frame_table, lib_base)
+        lib_name = module.path
+        with open(lib_name, 'rb') as f:
+            lib_elffile = ELFFile(f)
+            lib_base = module.compute_base(lib_elffile, lib_section, section_begin)
 
-            try:
-                return eh_frame_table[ip].pop().data
-            except:
-                print("****** ISSUE A ******")
-                return None
-        except:
-            print("****** ISSUE B ******")
-            raise
+            print ("\n* importing eh_frame for {0} at {1} ".format(lib_name, hex(lib_base)))
+
+            load_eh_frame_table(lib_elffile, lib_name, eh_frame_table, lib_base)
+
+        found = eh_frame_table.lookup(ip)
+        if found == None:
+            print("****** ISSUE A ******")
+        return found
+    except:
+        print("****** ISSUE B ******")
+        raise
 
 
 
@@ -341,8 +1154,69 @@ def read_eh_frame_table(elffile):
     dwarfinfo = elffile.get_dwarf_info()
     return dwarfinfo
 
+class SymbolTable:
+    """ The function symbols of the program and of its libraries.
+
+    Symbols are kept in sorted `array('Q')` columns of begin and end
+    addresses, with interned names.  Symbols added since the last lookup
+    are merged in at the next one.  Lookups check first the function found
+    by the previous lookup.
+    """
+
+    def __init__(self):
+        self.files = []
+        self._begins = array('Q')
+        self._ends = array('Q')
+        self._names = []
+        self._pending = []
+        # last function found
+        self._last = (1, 0, None)
+        self.lookups = 0
+        self.last_hits = 0
+
+    def __len__(self):
+        return len(self._begins) + len(self._pending)
+
+    def add(self, begin, end, name):
+        self._pending.append((begin, end, sys.intern(name)))
+
+    def _merge(self):
+        symbols = sorted(set(zip(self._begins, self._ends, self._names))
+                         | set(self._pending))
+        self._begins = array('Q')
+        self._ends = array('Q')
+        self._names = []
+        for begin, end, name in symbols:
+            # keep one name per range
+            if (len(self._begins) > 0 and self._begins[-1] == begin
+                    and self._ends[-1] == end):
+                continue
+            self._begins.append(begin)
+            self._ends.append(end)
+            self._names.append(name)
+        self._pending = []
+
+    def function(self, ip):
+        """ Returns the (begin, end, name) of the function of `ip`, or None """
+        self.lookups += 1
+        if self._last[0] <= ip < self._last[1]:
+            self.last_hits += 1
+            return self._last
+        if self._pending:
+            self._merge()
+        i = bisect_right(self._begins, ip) - 1
+        if i >= 0 and ip < self._ends[i]:
+            self._last = (self._begins[i], self._ends[i], self._names[i])
+            return self._last
+        return None
+
+    def __iter__(self):
+        if self._pending:
+            self._merge()
+        return zip(self._begins, self._ends, self._names)
+
 def memorize_symbol_table(elffile, symbol_table, file_name, base=0):
-    if file_name in symbol_table['files']:
+    if file_name in symbol_table.files:
         return
 
     for section in elffile.iter_sections():
@@ -358,50 +1232,59 @@ def memorize_symbol_table(elffile, symbol_table, file_name, base=0):
                 start = symbol['st_value']+base
                 end = symbol['st_value']+symbol['st_size']+base
                 if end != start:
-                    symbol_table['table'][start:end] = symbol.name+"@"+file_name
+                    symbol_table.add(start, end, symbol.name+"@"+file_name)
 
-    symbol_table['files'].append(file_name)
+    symbol_table.files.append(file_name)
 
 def dump_symbol_table(symbol_table):
     print ("*** dump symbol table")
-    for f in symbol_table['files']:
+    for f in symbol_table.files:
         print (" :: "+f)
-    for s in sorted(symbol_table['table']):
-        print (" {0}-{1}: {2}".format(hex(s.begin), hex(s.end), s.data))
+    for begin, end, name in symbol_table:
+        print (" {0}-{1}: {2}".format(hex(begin), hex(end), name))
 
 
-def get_function_name(symbol_table, linked_files, ip):
-#    print ("*** looking for "+hex(ip))
-#    dump_symbol_table(symbol_table)
-    try:
-        return symbol_table['table'][ip].pop().data
-    except:
-        try:
-            lib_name = linked_files[ip].pop().data[0]
-            if lib_name in symbol_table['files']:
-                return '_unknown @ [{0}]'.format(lib_name)
+def find_function(symbol_table, modules, ip):
+    """ Returns the (begin, end, name) of the function of `ip`, or None;
+    loads the symbols of its object the first time """
+    function = symbol_table.function(ip)
+    if function != None:
+        return function
 
-            lib_section = linked_files[ip].pop().data[1]
-            with open(lib_name, 'rb') as f:
-                lib_elffile = ELFFile(f)
-                                
-                # retrieve the offset of the section
-                section = lib_elffile.get_section_by_name(lib_section)
+    mapped = modules.find(ip)
+    if mapped == None:
+        return None
+    module, lib_section, section_begin = mapped
+    lib_name = module.path
+    if module.symbols_loaded or lib_name in symbol_table.files:
+        modules.avoided_symbols += 1
+        return None
+    module.symbols_loaded = True
 
-                # compute base
-                lib_base = linked_files[ip].pop().begin - section['sh_offset']
-                print ("* loading symbol table for {0} at {1} ".format(lib_name, hex(lib_base)))
+    try:
+        with open(lib_name, 'rb') as f:
+            lib_elffile = ELFFile(f)
+            lib_base = module.compute_base(lib_elffile, lib_section, section_begin)
+            print ("* loading symbol table for {0} at {1} ".format(lib_name, hex(lib_base)))
 
-                memorize_symbol_table(lib_elffile, symbol_table, lib_name, lib_base)
+            memorize_symbol_table(lib_elffile, symbol_table, lib_name, lib_base)
 
-#                dump_symbol_table(symbol_table)
-            try:
-                return symbol_table['table'][ip].pop().data
-            except:
-                return '_unknown @ [{0}]'.format(lib_name)
+#            dump_symbol_table(symbol_table)
+    except:
+        return None
 
-        except:
-            return '_unknown @ [???]'
+    return symbol_table.function(ip)
+
+def get_function_name(symbol_table, modules, ip):
+#    print ("*** looking for "+hex(ip))
+#    dump_symbol_table(symbol_table)
+    function = find_function(symbol_table, modules, ip)
+    if function != None:
+        return function[2]
+    mapped = modules.find(ip)
+    if mapped == None:
+        return '_unknown @ [???]'
+    return '_unknown @ [{0}]'.format(mapped[0].path)
 
 
 # arch specific
@@ -427,6 +1310,47 @@ def reg_ip():
         error("unsupported arch in reg_ip")
 
 # gdb interaction
+
+# Number of calls into gdb, per kind
+gdb_round_trips = {'execute': 0, 'frame': 0, 'register': 0, 'breakpoint': 0,
+                   'memory': 0}
+
+class GdbRegisters:
+    """ A snapshot of the registers at the current stop.
+
+    Each register is read at most once per stop, through the frame
+    `read_register` API.  The snapshot is invalidated by `gdb_execute`,
+    since any command may resume the inferior.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._values = {}
+
+    def invalidate(self):
+        self._frame = None
+        self._values = {}
+
+    def get(self, reg):
+        try:
+            return self._values[reg]
+        except KeyError:
+            pass
+
+        if self._frame is None:
+            gdb_round_trips['frame'] += 1
+            self._frame = gdb.selected_frame()
+        gdb_round_trips['register'] += 1
+        try:
+            value = int(self._frame.read_register(reg))
+        except AttributeError:
+            # gdb without Frame.read_register
+            value = int(gdb.parse_and_eval('$' + reg))
+        self._values[reg] = value
+        return value
+
+gdb_registers = GdbRegisters()
+
 def gdb_check_and_init():
     "eh_frame_check requires a gdb linked to Python"
     if sys.version_info[0] > 3:
@@ -442,6 +1366,8 @@ def gdb_execute(s, sl=[]):
     """ Execute one or more GDB commands.
         Returns the output of the last one.
     """
+    gdb_registers.invalidate()
+    gdb_round_trips['execute'] += 1 + len(sl)
     try:
         gdb_out = gdb.execute(s, from_tty=False, to_string=True)
     except UnicodeDecodeError as e:
@@ -498,40 +1424,555 @@ def gdb_dyn_linked_files():
     return linked_files
 
 def gdb_get_ip():
-    return int(gdb.parse_and_eval(reg_ip()))
+    return gdb_registers.get(reg_ip()[1:])
+
+def gdb_get_sp():
+    return gdb_registers.get(reg_sp()[1:])
+
+def gdb_get_reg(reg):
+    return gdb_registers.get(reg)
+
+def gdb_read_memory(addr, size):
+    gdb_round_trips['memory'] += 1
+    data = gdb.selected_inferior().read_memory(addr, size)
+    return int.from_bytes(bytes(data), 'little')
+
+def gdb_disassemble(start, end):
+    text = gdb_execute('disassemble /r {0},{1}'.format(format_hex(start),
+                                                       format_hex(end)))
+    insns = []
+    for line in text.split('\n'):
+        parsed = parse_disassembly_line(line)
+        if parsed != None:
+            insns.append(parsed)
+    return insns
+
+class GdbBackend:
+    """ Runs the inferior under gdb, through the gdb_* helpers """
+
+    name = 'gdb'
+
+    def __init__(self):
+        self._always_inserted = False
+        # addr -> gdb.Breakpoint
+        self._breakpoints = {}
+        self.stops = 0
+
+    def init(self):
+        gdb_check_and_init()
+
+    def current_file(self):
+        return gdb_current_file()
+
+    def goto_main(self):
+        gdb_goto_main()
+
+    def linked_files(self):
+        return gdb_dyn_linked_files()
+
+    def mmap(self):
+        return get_mmap()
+
+    def get_ip(self):
+        return gdb_get_ip()
+
+    def get_sp(self):
+        return gdb_get_sp()
+
+    def get_reg(self, reg):
+        return gdb_get_reg(reg)
+
+    def read_memory(self, addr, size):
+        return gdb_read_memory(addr, size)
+
+    def step(self):
+        self.stops += 1
+        gdb_execute('stepi')
+
+    def cont(self):
+        self.stops += 1
+        gdb_execute('continue')
+
+    def set_breakpoint(self, addr):
+        if not self._always_inserted:
+            gdb_execute('set breakpoint always-inserted on')
+            self._always_inserted = True
+        gdb_round_trips['breakpoint'] += 1
+        self._breakpoints[addr] = gdb.Breakpoint('*' + format_hex(addr),
+                                                 internal=True)
+
+    def remove_breakpoint(self, addr):
+        gdb_round_trips['breakpoint'] += 1
+        self._breakpoints.pop(addr).delete()
+
+    def exited(self):
+        return gdb.selected_inferior().pid == 0
+
+    def disassemble(self, start, end):
+        return gdb_disassemble(start, end)
 
-def gdb_get_instruction():
-    i = gdb_execute("x/i "+reg_ip())
-    c = (i[i.index(':')+1:]).split()
+    def stats(self, checked):
+        total = sum(gdb_round_trips.values())
+        return ("gdb round-trips: {0} ({1:.2f} per checked instruction; "
+                "{2})".format(total, total / float(max(checked, 1)),
+                              ', '.join('{0} {1}'.format(kind, count)
+                                        for kind, count
+                                        in sorted(gdb_round_trips.items()))))
 
-    if c[0] == 'repz':
-        c.remove('repz')
+    def quit(self, code=0):
+        gdb_execute('quit {0}'.format(code))
 
+# ptrace backend
+#
+# Traces the inferior directly, without gdb: one PTRACE_SINGLESTEP and at
+# most one PTRACE_GETREGS per step.  x86-64 Linux only; instructions are
+# decoded with objdump from the mapped ELF files.
+
+PTRACE_TRACEME = 0
+PTRACE_PEEKDATA = 2
+PTRACE_POKEDATA = 5
+PTRACE_CONT = 7
+PTRACE_SINGLESTEP = 9
+PTRACE_GETREGS = 12
+PTRACE_SETREGS = 13
+
+ADDR_NO_RANDOMIZE = 0x0040000
+
+WORD_MASK = 0xffffffffffffffff
+
+# struct user_regs_struct, from <sys/user.h>
+USER_REGS = ['r15', 'r14', 'r13', 'r12', 'rbp', 'rbx', 'r11', 'r10', 'r9',
+             'r8', 'rax', 'rcx', 'rdx', 'rsi', 'rdi', 'orig_rax', 'rip', 'cs',
+             'eflags', 'rsp', 'ss', 'fs_base', 'gs_base', 'ds', 'es', 'fs',
+             'gs']
+
+class UserRegs(ctypes.Structure):
+    _fields_ = [(reg, ctypes.c_ulong) for reg in USER_REGS]
+
+class InferiorExited(Exception):
+    pass
+
+def elf_alloc_sections(path, base):
+    """ (name, begin, end) of the sections of `path` loaded at `base` """
+    sections = []
+    with open(path, 'rb') as f:
+        elffile = ELFFile(f)
+        for section in elffile.iter_sections():
+            if section['sh_flags'] & 0x2 and section['sh_size'] > 0:  # SHF_ALLOC
+                begin = base + section['sh_addr']
+                sections.append((section.name, begin,
+                                 begin + section['sh_size']))
+    return sections
+
+class PtraceBackend:
+    """ Runs the inferior under ptrace(2) """
+
+    name = 'ptrace'
+
+    def __init__(self, path, args):
+        self._path = os.path.realpath(path)
+        self._args = args
+        self._pid = None
+        self._libc = None
+        self._regs = UserRegs()
+        self._regs_valid = False
+        self._signal = 0
+        # addr -> original byte
+        self._breakpoints = {}
+        # (begin, end, path, base) of the executable mappings
+        self._modules = []
+        self.calls = 0
+        self.stops = 0
+
+    def _ptrace(self, request, addr=0, data=0):
+        self.calls += 1
+        ctypes.set_errno(0)
+        res = self._libc.ptrace(request, self._pid, ctypes.c_void_p(addr),
+                                ctypes.c_void_p(data))
+        if res == -1 and ctypes.get_errno() != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'ptrace({0}): {1}'.format(
+                request, os.strerror(errno)))
+        return res
+
+    def _wait(self):
+        self._regs_valid = False
+        _, wstatus = os.waitpid(self._pid, 0)
+        if os.WIFEXITED(wstatus) or os.WIFSIGNALED(wstatus):
+            self._pid = None
+            raise InferiorExited("inferior exited (status {0})".format(wstatus))
+        sig = os.WSTOPSIG(wstatus)
+        self._signal = 0 if sig == signal.SIGTRAP else sig
+
+    def _regs_now(self):
+        if not self._regs_valid:
+            self._ptrace(PTRACE_GETREGS, 0, ctypes.addressof(self._regs))
+            self._regs_valid = True
+        return self._regs
+
+    def _peek(self, addr):
+        return self._ptrace(PTRACE_PEEKDATA, addr) & WORD_MASK
+
+    def _poke_byte(self, addr, byte):
+        word = self._peek(addr)
+        self._ptrace(PTRACE_POKEDATA, addr, (word & ~0xff & WORD_MASK) | byte)
+
+    def _insert(self, addr):
+        self._poke_byte(addr, 0xcc)  # int3
+
+    def _lift(self, addr):
+        self._poke_byte(addr, self._breakpoints[addr])
+
+    def _maps(self):
+        """ (begin, end, perms, offset, path) of the file-backed mappings """
+        maps = []
+        with open('/proc/{0}/maps'.format(self._pid)) as f:
+            for line in f:
+                words = line.split()
+                if len(words) < 6 or not words[5].startswith('/'):
+                    continue
+                begin, end = [int(x, 16) for x in words[0].split('-')]
+                maps.append((begin, end, words[1], int(words[2], 16),
+                             ' '.join(words[5:])))
+        return maps
+
+    def _bases(self):
+        """ path -> load base of each mapped ELF file """
+        bases = {}
+        for begin, end, perms, offset, path in self._maps():
+            if offset != 0 or path in bases:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    is_dyn = ELFFile(f)['e_type'] == 'ET_DYN'
+            except Exception:
+                continue
+            bases[path] = begin if is_dyn else 0
+        return bases
+
+    def _scan_modules(self):
+        bases = self._bases()
+        self._modules = [(begin, end, path, bases[path])
+                         for begin, end, perms, offset, path in self._maps()
+                         if 'x' in perms and path in bases]
+
+    def _module_for(self, addr):
+        for begin, end, path, base in self._modules:
+            if begin <= addr < end:
+                return path, base
+        return None
+
+    def init(self):
+        if not sys.platform.startswith('linux') or platform.machine() != 'x86_64':
+            error ("the ptrace backend supports x86-64 Linux only")
+        if not os.access(self._path, os.X_OK):
+            error ("cannot execute " + self._path)
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._libc.ptrace.argtypes = [ctypes.c_long, ctypes.c_int,
+                                      ctypes.c_void_p, ctypes.c_void_p]
+        self._libc.ptrace.restype = ctypes.c_long
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self._libc.ptrace(PTRACE_TRACEME, 0, None, None)
+                # same addresses as under gdb
+                self._libc.personality(ADDR_NO_RANDOMIZE)
+                os.execv(self._path, [self._path] + self._args)
+            finally:
+                os._exit(127)
+        self._pid = pid
+        self._wait()
+
+    def current_file(self):
+        return self._path
+
+    def goto_main(self):
+        main_addr = None
+        with open(self._path, 'rb') as f:
+            elffile = ELFFile(f)
+            for section in elffile.iter_sections():
+                if isinstance(section, SymbolTableSection):
+                    for symbol in section.get_symbol_by_name('main') or []:
+                        main_addr = symbol['st_value']
+        if main_addr == None:
+            error ("goto_main, cannot determine the address of main")
+        main_addr += self._bases()[self._path]
+
+        self.set_breakpoint(main_addr)
+        while self.get_ip() != main_addr:
+            self.cont()
+        self._lift(main_addr)
+        del self._breakpoints[main_addr]
+        self._scan_modules()
+
+    def linked_files(self):
+        linked_files = IntervalTree()
+        for path, base in self._bases().items():
+            if path == self._path:
+                continue
+            for name, begin, end in elf_alloc_sections(path, base):
+                linked_files[begin:end] = (path, name)
+        return linked_files
+
+    def mmap(self):
+        entries = Mmap()
+        for path, base in self._bases().items():
+            for name, begin, end in elf_alloc_sections(path, base):
+                entries.append(MmapEntry(begin, end, name,
+                                         'here' if path == self._path else path,
+                                         0))
+        entries.sort(key=lambda x: x.beg)
+        return entries
+
+    def get_ip(self):
+        return self._regs_now().rip
+
+    def get_sp(self):
+        return self._regs_now().rsp
+
+    def get_reg(self, reg):
+        return getattr(self._regs_now(), reg)
+
+    def read_memory(self, addr, size):
+        """ Reads a little-endian integer of `size` bytes, at most 8 """
+        return self._peek(addr) & ((1 << (8 * size)) - 1)
+
+    def step(self):
+        self.stops += 1
+        ip = self.get_ip()
+        lifted = ip in self._breakpoints
+        if lifted:
+            self._lift(ip)
+        self._ptrace(PTRACE_SINGLESTEP, 0, self._signal)
+        self._wait()
+        # a signal stopped the inferior before the instruction executed
+        while self._signal != 0 and self.get_ip() == ip:
+            self._ptrace(PTRACE_SINGLESTEP, 0, self._signal)
+            self._wait()
+        if lifted:
+            self._insert(ip)
+
+    def cont(self):
+        if self.get_ip() in self._breakpoints:
+            self.step()
+            if self.get_ip() in self._breakpoints:
+                return
+        self.stops += 1
+        self._ptrace(PTRACE_CONT, 0, self._signal)
+        self._wait()
+        regs = self._regs_now()
+        if self._signal == 0 and regs.rip - 1 in self._breakpoints:
+            regs.rip -= 1
+            self._ptrace(PTRACE_SETREGS, 0, ctypes.addressof(regs))
+
+    def set_breakpoint(self, addr):
+        if addr not in self._breakpoints:
+            self._breakpoints[addr] = self._peek(addr) & 0xff
+            self._insert(addr)
+
+    def remove_breakpoint(self, addr):
+        self._lift(addr)
+        del self._breakpoints[addr]
+
+    def exited(self):
+        return self._pid == None
+
+    def disassemble(self, start, end):
+        module = self._module_for(start)
+        if module == None:
+            self._scan_modules()  # dlopen
+            module = self._module_for(start)
+            if module == None:
+                return []
+        path, base = module
+
+        text = subprocess.check_output(
+            ['objdump', '-d', '-w',
+             '--start-address=' + format_hex(start - base),
+             '--stop-address=' + format_hex(end - base), path],
+            universal_newlines=True)
+        insns = []
+        for line in text.split('\n'):
+            parsed = parse_disassembly_line(line)
+            if parsed == None:
+                continue
+            addr, length, mnemonic, operand = parsed
+            # direct branch targets are printed relative to the file
+            if mnemonic[:1] == 'j' or mnemonic[:4] in ('call', 'loop'):
+                try:
+                    operand = format_hex(int(operand, 16) + base)
+                except ValueError:
+                    pass
+            insns.append((addr + base, length, mnemonic, operand))
+        return insns
+
+    def stats(self, checked):
+        return "ptrace calls: {0} ({1:.2f} per checked instruction)".format(
+            self.calls, self.calls / float(max(checked, 1)))
+
+    def quit(self, code=0):
+        sys.stdout.flush()
+        if self._pid != None:
+            os.kill(self._pid, signal.SIGKILL)
+            os.waitpid(self._pid, 0)
+        os._exit(code)
+
+
+# instruction decoding
+#
+# Each instruction address is classified once into a compact `Insn`
+# record, so that the main loop does a dict lookup per step instead of a
+# `x/i` round-trip through gdb.
+
+INSN_OTHER = 0
+INSN_CALL = 1
+INSN_RET = 2
+INSN_PUSH = 3
+INSN_POP = 4
+INSN_LEAVE = 5
+INSN_SP_ARITH = 6
+INSN_JUMP = 7
+
+INSN_KIND_NAMES = ['other', 'call', 'ret', 'push', 'pop', 'leave', 'sp-arith',
+                   'jump']
+
+# kind: one of the INSN_* constants
+# reg: register operand (pushed/popped register, or destination register)
+# length: size in bytes of the instruction
+# mnemonic, operand: as printed by the disassembler (for verbose output)
+Insn = namedtuple('Insn', ['kind', 'reg', 'length', 'mnemonic', 'operand'])
+
+# Prefixes printed by the disassembler in front of the mnemonic
+INSN_PREFIXES = ('repz', 'rep', 'repnz', 'bnd', 'notrack', 'lock', 'data16')
+
+# Sections of the main binary that are decoded eagerly
+INSN_PREFILL_SECTIONS = ('.init', '.plt', '.plt.got', '.plt.sec', '.text', '.fini')
+
+# Bytes disassembled at once when an ip falls outside any known function
+INSN_WINDOW = 256
+
+def classify_instruction(mnemonic, operand):
+    """ Return the (kind, reg) pair of an x86 instruction in AT&T syntax
+    """
+    if mnemonic[:4] == 'call':
+        return INSN_CALL, ''
+    elif mnemonic[:3] == 'ret':
+        return INSN_RET, ''
+    elif mnemonic[:4] == 'push':
+        return INSN_PUSH, operand.strip('%')
+    elif mnemonic[:3] == 'pop' and mnemonic != 'popcnt':
+        return INSN_POP, operand.strip('%')
+    elif mnemonic[:5] == 'leave':
+        return INSN_LEAVE, ''
+    elif mnemonic[:1] == 'j' or mnemonic[:4] == 'loop':
+        return INSN_JUMP, ''
+
+    dest = operand[operand.rfind(',')+1:]
+    if dest[:1] != '%':
+        return INSN_OTHER, ''
+    elif dest == '%rsp' or dest == '%esp':
+        return INSN_SP_ARITH, dest[1:]
+    return INSN_OTHER, dest[1:]
+
+def parse_disassembly_line(line):
+    """ Parse a line of `disassemble /r` or `objdump -d -w` output.
+
+    Returns (address, length, mnemonic, operand), or None if the line
+    does not describe an instruction.  The length is 0 if the raw bytes
+    are not part of the line.
+    """
+    sep = line.find(':\t')
+    if sep == -1:
+        return None
+    head = line[:sep].split()
+    if len(head) == 0:
+        return None
+    if head[0] == '=>':
+        head = head[1:]
     try:
-        return c[0],c[1]
-    except IndexError:
-        return c[0], ''
+        addr = int(head[0], 16)
+    except (ValueError, IndexError):
+        return None
 
-def gdb_get_sp():
-    # r = reg_sp()
-    # v = gdb.parse_and_eval(r)
-    # print ("r: {0} , v: {1}".format(r,v))
-    # return v
-    return gdb.parse_and_eval(reg_sp())
+    fields = line[sep+2:].split('\t', 1)
+    if len(fields) == 2:
+        length = len(fields[0].split())
+        text = fields[1]
+    else:
+        length = 0
+        text = fields[0]
 
-def gdb_get_reg_num(regnum):
-    regname = describe_reg_name(regnum)
-    value = gdb.parse_and_eval("$"+regname)
-    return int(value)
+    words = text.split()
+    while len(words) > 1 and words[0] in INSN_PREFIXES:
+        words.pop(0)
+    if len(words) == 0:
+        return None
+    if len(words) == 1:
+        return addr, length, words[0], ''
+    return addr, length, words[0], words[1]
 
-def gdb_get_reg(reg):
-    value = gdb.parse_and_eval("$"+reg)
-    return int(value)
+class InsnCache:
+    """ Decoded instructions, indexed by address.
+
+    The cache is filled one whole section or function at a time, with a
+    single call to the backend disassembler each.
+    """
 
+    def __init__(self):
+        self._insns = {}
+        self._filled = set()
+        self.fills = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._insns)
+
+    def add_instructions(self, insns):
+        """ Add the (address, length, mnemonic, operand) tuples `insns` """
+        x86 = ARCH == 'x64' or ARCH == 'x86'
+        for addr, length, mnemonic, operand in insns:
+            if x86:
+                kind, reg = classify_instruction(mnemonic, operand)
+            else:
+                kind, reg = INSN_OTHER, ''
+            self._insns[addr] = Insn(kind, reg, length, mnemonic, operand)
+
+    def fill_range(self, start, end):
+        if (start, end) in self._filled:
+            return
+        self._filled.add((start, end))
+        self.fills += 1
+        self.add_instructions(backend.disassemble(start, end))
+
+    def fill_sections(self, mmap):
+        """ Decode the text sections of the main binary """
+        for entry in mmap:
+            if entry.path == 'here' and entry.section in INSN_PREFILL_SECTIONS:
+                self.fill_range(entry.beg, entry.end)
+
+    def get(self, ip):
+        return self._insns.get(ip)
+
+    def lookup(self, ip, function_at):
+        """ `function_at(ip)` returns the (begin, end, name) of the
+        function of `ip`, or None """
+        try:
+            return self._insns[ip]
+        except KeyError:
+            pass
+
+        self.misses += 1
+        function = function_at(ip)
+        if function != None:
+            self.fill_range(function[0], function[1])
+        if ip not in self._insns:
+            self.fill_range(ip, ip + INSN_WINDOW)
+        return self._insns[ip]
 
 # interpreter of Dwarf expressions
 def eval_reg(reg):
-    r = gdb.parse_and_eval('$'+describe_reg_name(reg))
+    r = backend.get_reg(describe_reg_name(reg))
     debug_eval (describe_reg_name(reg) + " : " + str(r))
     return r
 
@@ -644,7 +2085,7 @@ class ExprEval(GenericExprVisitor):
 #                s = gdb_execute ("x/g $"+describe_reg_name(regnum)
 #                                 +"+"+str(args[0]))
 #                v = int(s[s.find(':')+1:],16)
-                v = gdb_get_reg_num(regnum) + args[0]
+                v = backend.get_reg(describe_reg_name(regnum)) + args[0]
                 debug_eval (' * debug breg '+(describe_reg_name(regnum))+" : "+format_hex(v))
                 self._stack.append(v)
                 return '(I)%s (%s): %s' % (
@@ -671,6 +2112,9 @@ class ExprEval(GenericExprVisitor):
             return '<unknown %s>' % opcode_name
 
 def eval_CFARule(structs, cfa_rule):
+    if not dbg_eval:
+        return compile_CFARule(structs, cfa_rule)()
+
     debug_eval ("eval CFA: " + repr(cfa_rule))
 
     if cfa_rule.expr == None:
@@ -681,6 +2125,9 @@ def eval_CFARule(structs, cfa_rule):
 def eval_RegisterRule(structs, rule, cfa_rule):
     assert (isinstance(rule, RegisterRule))
 
+    if not dbg_eval:
+        return compile_RegisterRule(structs, rule, cfa_rule)()
+
     debug_eval ("\neval RR: "+repr(rule)+" -- CFA: "+ repr(cfa_rule))
 
     if rule.type == RegisterRule.OFFSET:
@@ -690,6 +2137,277 @@ def eval_RegisterRule(structs, rule, cfa_rule):
     else:
         error ("eval_RegisterRule, unimplemented")
 
+# compiled evaluators
+#
+# Each distinct CFA rule, register rule and Dwarf expression is compiled
+# once into a closure reading the registers (and memory) of the backend.
+# eval_expr above is the reference interpreter, used with `dbg_eval` to
+# trace each operation.
+
+def to_signed(v):
+    return v - (1 << 64) if v & (1 << 63) else v
+
+def read_uleb128(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+def read_sleb128(data, offset):
+    value, end = read_uleb128(data, offset)
+    bits = 7 * (end - offset)
+    if value & (1 << (bits - 1)):
+        value -= 1 << bits
+    return value, end
+
+# DW_OP_* opcodes with fixed size arguments
+DW_OP_FIXED_ARGS = {0x08: 'B', 0x09: 'b', 0x0a: 'H', 0x0b: 'h', 0x0c: 'I',
+                    0x0d: 'i', 0x0e: 'Q', 0x0f: 'q', 0x15: 'B', 0x28: 'h',
+                    0x2f: 'h', 0x94: 'B', 0x95: 'B'}
+DW_OP_ULEB_ARG = (0x10, 0x23, 0x90, 0x93)
+DW_OP_SLEB_ARG = (0x11, 0x91)
+
+def decode_dwarf_expr(expr, address_size):
+    """ Returns the (offset, opcode, args) of the operations of `expr` """
+    data = bytes(expr)
+    ops = []
+    offset = 0
+    while offset < len(data):
+        start = offset
+        opcode = data[offset]
+        offset += 1
+        if opcode in DW_OP_FIXED_ARGS:
+            fmt = '<' + DW_OP_FIXED_ARGS[opcode]
+            args = struct.unpack_from(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+        elif opcode == 0x03:  # DW_OP_addr
+            fmt = '<Q' if address_size == 8 else '<I'
+            args = struct.unpack_from(fmt, data, offset)
+            offset += address_size
+        elif opcode in DW_OP_ULEB_ARG:
+            value, offset = read_uleb128(data, offset)
+            args = (value,)
+        elif opcode in DW_OP_SLEB_ARG or 0x70 <= opcode <= 0x8f:
+            value, offset = read_sleb128(data, offset)
+            args = (value,)
+        elif opcode == 0x92:  # DW_OP_bregx
+            regnum, offset = read_uleb128(data, offset)
+            value, offset = read_sleb128(data, offset)
+            args = (regnum, value)
+        else:
+            args = ()
+        ops.append((start, opcode, args))
+    return ops, len(data)
+
+def _unary(f):
+    def op(stack):
+        stack.append(f(stack.pop()) & WORD_MASK)
+    return op
+
+def _binary(f):
+    def op(stack):
+        b = stack.pop()
+        a = stack.pop()
+        stack.append(f(a, b) & WORD_MASK)
+    return op
+
+def _signed_div(a, b):
+    a, b = to_signed(a), to_signed(b)
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _rot(stack):
+    stack[-3], stack[-2], stack[-1] = stack[-1], stack[-3], stack[-2]
+
+def _swap(stack):
+    stack[-2], stack[-1] = stack[-1], stack[-2]
+
+def _drop(stack):
+    # not `stack.pop() and None`: any value but None is a branch target
+    stack.pop()
+
+DW_OP_STACK_OPS = {
+    0x12: lambda stack: stack.append(stack[-1]),         # dup
+    0x13: _drop,                                         # drop
+    0x14: lambda stack: stack.append(stack[-2]),         # over
+    0x16: _swap,                                         # swap
+    0x17: _rot,                                          # rot
+    0x19: _unary(lambda a: abs(to_signed(a))),           # abs
+    0x1a: _binary(lambda a, b: a & b),                   # and
+    0x1b: _binary(_signed_div),                          # div
+    0x1c: _binary(lambda a, b: a - b),                   # minus
+    0x1d: _binary(lambda a, b: a % b),                   # mod
+    0x1e: _binary(lambda a, b: a * b),                   # mul
+    0x1f: _unary(lambda a: -a),                          # neg
+    0x20: _unary(lambda a: ~a),                          # not
+    0x21: _binary(lambda a, b: a | b),                   # or
+    0x22: _binary(lambda a, b: a + b),                   # plus
+    0x24: _binary(lambda a, b: a << b),                  # shl
+    0x25: _binary(lambda a, b: a >> b),                  # shr
+    0x26: _binary(lambda a, b: to_signed(a) >> b),       # shra
+    0x27: _binary(lambda a, b: a ^ b),                   # xor
+    0x29: _binary(lambda a, b: int(to_signed(a) == to_signed(b))),  # eq
+    0x2a: _binary(lambda a, b: int(to_signed(a) >= to_signed(b))),  # ge
+    0x2b: _binary(lambda a, b: int(to_signed(a) > to_signed(b))),   # gt
+    0x2c: _binary(lambda a, b: int(to_signed(a) <= to_signed(b))),  # le
+    0x2d: _binary(lambda a, b: int(to_signed(a) < to_signed(b))),   # lt
+    0x2e: _binary(lambda a, b: int(to_signed(a) != to_signed(b))),  # ne
+    0x96: lambda stack: None,                            # nop
+    0x9f: lambda stack: None,                            # stack_value
+}
+
+def _compile_op(opcode, args, address_size, targets):
+    """ The closure of one operation: it updates the stack and returns the
+    index of the next operation, or None for the following one """
+    if 0x30 <= opcode <= 0x4f:  # lit
+        value = opcode - 0x30
+        return lambda stack: stack.append(value)
+    elif 0x70 <= opcode <= 0x8f or opcode == 0x92:  # breg, bregx
+        if opcode == 0x92:
+            regnum, offset = args
+        else:
+            regnum, offset = opcode - 0x70, args[0]
+        name = describe_reg_name(regnum)
+        return lambda stack: stack.append(
+            (backend.get_reg(name) + offset) & WORD_MASK)
+    elif 0x08 <= opcode <= 0x11 or opcode == 0x03:  # const, addr
+        value = args[0] & WORD_MASK
+        return lambda stack: stack.append(value)
+    elif opcode == 0x06:  # deref
+        return lambda stack: stack.append(
+            backend.read_memory(stack.pop(), address_size))
+    elif opcode == 0x94:  # deref_size
+        size = args[0]
+        return lambda stack: stack.append(
+            backend.read_memory(stack.pop(), size))
+    elif opcode == 0x15:  # pick
+        index = -1 - args[0]
+        return lambda stack: stack.append(stack[index])
+    elif opcode == 0x23:  # plus_uconst
+        value = args[0]
+        def plus_uconst(stack):
+            stack[-1] = (stack[-1] + value) & WORD_MASK
+        return plus_uconst
+    elif opcode == 0x28:  # bra
+        target = targets[args[0]]
+        return lambda stack: target if stack.pop() != 0 else None
+    elif opcode == 0x2f:  # skip
+        target = targets[args[0]]
+        return lambda stack: target
+    elif opcode in DW_OP_STACK_OPS:
+        return DW_OP_STACK_OPS[opcode]
+    else:
+        error ("unsupported opcode in expr: " + hex(opcode))
+
+def _compile_plt(ops):
+    """ The fast form of the expressions of the PLT entries:
+    breg(sp) a; breg(ip) b; lit m; and; lit n; ge; lit k; shl; plus """
+    shape = [op[1] for op in ops]
+    if (len(ops) != 9 or not 0x70 <= shape[0] <= 0x8f
+            or not 0x70 <= shape[1] <= 0x8f
+            or shape[3:] != [0x1a, shape[4], 0x2a, shape[6], 0x24, 0x22]
+            or not all(0x30 <= shape[i] <= 0x4f for i in (2, 4, 6))):
+        return None
+    sp_name = describe_reg_name(shape[0] - 0x70)
+    sp_offset = ops[0][2][0]
+    ip_name = describe_reg_name(shape[1] - 0x70)
+    ip_offset = ops[1][2][0]
+    mask, threshold, shift = shape[2] - 0x30, shape[4] - 0x30, shape[6] - 0x30
+
+    def plt():
+        sp = backend.get_reg(sp_name) + sp_offset
+        ip = backend.get_reg(ip_name) + ip_offset
+        return (sp + ((((ip & mask) >= threshold)) << shift)) & WORD_MASK
+    return plt
+
+_COMPILED_EXPRS = {}
+
+def compile_expr(structs, expr, push_cfa=False):
+    """ Returns a closure computing `expr`; if `push_cfa`, the closure takes
+    the CFA, pushed on the stack before evaluating `expr` """
+    key = (bytes(expr), structs.address_size, push_cfa)
+    compiled = _COMPILED_EXPRS.get(key)
+    if compiled != None:
+        return compiled
+
+    ops, length = decode_dwarf_expr(expr, structs.address_size)
+    if not push_cfa and len(ops) == 1 and (0x70 <= ops[0][1] <= 0x8f):
+        # reg+offset
+        name = describe_reg_name(ops[0][1] - 0x70)
+        offset = ops[0][2][0]
+        compiled = lambda: (backend.get_reg(name) + offset) & WORD_MASK
+    elif not push_cfa and _compile_plt(ops) != None:
+        compiled = _compile_plt(ops)
+    else:
+        # index of the operation at each offset, for bra and skip
+        targets = {}
+        for i, (offset, opcode, args) in enumerate(ops):
+            targets[offset] = i
+        targets[length] = len(ops)
+        # the branch arguments are relative to the next operation
+        code = []
+        for i, (offset, opcode, args) in enumerate(ops):
+            if opcode in (0x28, 0x2f):
+                args = (offset + 3 + args[0],)
+            code.append(_compile_op(opcode, args, structs.address_size,
+                                    targets))
+        count = len(code)
+
+        def run(*cfa):
+            stack = list(cfa)
+            i = 0
+            while i < count:
+                target = code[i](stack)
+                i = i + 1 if target == None else target
+            return stack[-1]
+        compiled = run
+
+    _COMPILED_EXPRS[key] = compiled
+    return compiled
+
+_COMPILED_CFA_RULES = {}
+
+def compile_CFARule(structs, cfa_rule):
+    """ Returns a closure computing the CFA of `cfa_rule` """
+    key = cfi_rule_key(cfa_rule)
+    compiled = _COMPILED_CFA_RULES.get(key)
+    if compiled == None:
+        if cfa_rule.expr == None:
+            name = describe_reg_name(cfa_rule.reg)
+            offset = cfa_rule.offset
+            compiled = lambda: backend.get_reg(name) + offset
+        else:
+            compiled = compile_expr(structs, cfa_rule.expr)
+        _COMPILED_CFA_RULES[key] = compiled
+    return compiled
+
+_COMPILED_REGISTER_RULES = {}
+
+def compile_RegisterRule(structs, rule, cfa_rule):
+    """ Returns a closure computing the address where `rule` saves its
+    register, or None if the register is undefined """
+    key = (cfi_rule_key(rule), cfi_rule_key(cfa_rule))
+    compiled = _COMPILED_REGISTER_RULES.get(key)
+    if compiled == None:
+        cfa = compile_CFARule(structs, cfa_rule)
+        if rule.type == RegisterRule.OFFSET:
+            offset = rule.arg
+            compiled = lambda: cfa() + offset
+        elif rule.type == RegisterRule.UNDEFINED:
+            compiled = lambda: None
+        elif rule.type == RegisterRule.EXPRESSION:
+            expr = compile_expr(structs, rule.arg, push_cfa=True)
+            compiled = lambda: expr(cfa())
+        else:
+            error ("eval_RegisterRule, unimplemented")
+        _COMPILED_REGISTER_RULES[key] = compiled
+    return compiled
+
 # instruction parsing
 def x86_extract_registers(s):
     try:
@@ -717,7 +2435,7 @@ def power_extract_registers(s):
 # validation (limited to ra for now)
 class X86_Status:
     def __init__(self, sp):
-        self._ra_at = int(str(sp),16)
+        self._ra_at = int(sp)
         self._ra_stack = [-1]
         self._after_push_rip_count = 0
         self._after_push_rip = False
@@ -863,11 +2581,26 @@ class X86_Status:
 
     def push_ra(self, new_sp):
         self._ra_stack.append(self._ra_at)
-        self._ra_at = int(str(new_sp),16)
+        self._ra_at = int(new_sp)
 
     def pop_ra(self):
         self._ra_at = self._ra_stack.pop()
 
+    def relative_state(self, sp):
+        """ The RA slot and the callee-saved slots, relative to `sp` """
+        state = [self.get_ra() - sp]
+        if cs_eval:
+            for regname in self._cs_list:
+                cs = self.get_cs(regname)
+                state.append(cs if cs == 'u' or cs == -1 else cs - sp)
+        return tuple(state)
+
+    def unwind_to(self, ra_at):
+        """ Drop the RA slots below `ra_at`, pushed by code that ran
+        without being checked """
+        while len(self._ra_stack) > 1 and self._ra_at < ra_at:
+            self.pop_ra()
+
     def set_after_push_rip(self):
         self._after_push_rip_count = 1
         self._after_push_rip = True
@@ -889,25 +2622,57 @@ class X86_Status:
     def push_cs(self, regname, new_addr):
         if self._is_save_relevant(regname, new_addr):
             index = self._name_to_index(regname)
-            self._cs_stack[index].append(int(str(new_addr), 16))
-            emitline('PUSH %'+regname+': ')
-        else:
-            emitline('[IGNORED] PUSH %'+regname+': ')
+            self._cs_stack[index].append(int(new_addr))
+            if tracer.enabled:
+                tracer.note('PUSH %'+regname)
+        elif tracer.enabled:
+            tracer.note('[IGNORED] PUSH %'+regname)
 
     @cs_eval_effect
     def pop_cs(self, regname):
-        if self._is_restore_relevant(regname, int(str(gdb_get_sp()), 16)):
+        if self._is_restore_relevant(regname, backend.get_sp()):
             index = self._name_to_index(regname)
             self._cs_stack[index][-1] = 'u'
-            emitline('POP %'+regname+': ')
-        else:
-            emitline('[IGNORED] POP %'+regname+': ')
+            if tracer.enabled:
+                tracer.note('POP %'+regname)
+        elif tracer.enabled:
+            tracer.note('[IGNORED] POP %'+regname)
 
     @cs_eval_effect
     def restore_cs(self, regname):
         index = self._name_to_index(regname)
         self._cs_stack[index][-1] = 'u'
 
+    @cs_eval_effect
+    def resync_cs(self, regname, new_addr):
+        """ Adopt the eh_frame value of a callee-saved register after a
+        mismatch: `new_addr`, or not saved if None """
+        index = self._name_to_index(regname)
+        stack = self._cs_stack[index]
+        if new_addr == None:
+            if len(stack) > 1:
+                stack.pop()
+        elif len(stack) > 1:
+            stack[-1] = int(new_addr)
+        else:
+            stack.append(int(new_addr))
+            self._cs_tracking[-1][regname] = (True, int(new_addr), False)
+
+    def depth(self):
+        return len(self._ra_stack)
+
+    def call_stack(self):
+        """ The (return address slot, return address) of the frames,
+        innermost first """
+        frames = []
+        for ra_at in [self._ra_at] + self._ra_stack[:0:-1]:
+            try:
+                ra = backend.read_memory(ra_at, 8)
+            except Exception:
+                ra = None
+            frames.append((ra_at, ra))
+        return frames
+
     @cs_eval_effect
     def purge_restored_cs(self):
         for i in range(len(self._cs_list)):
@@ -930,6 +2695,12 @@ class Power_Status:
     def update_ra_addr(self,addr):
         self._ra_at = addr
 
+    def depth(self):
+        return 1
+
+    def call_stack(self):
+        return [(self._ra_at, None)]
+
 @cs_eval_func(True)
 def validate_cs_register(structs, entry, status, regnum, regname):
     cs_eh_frame = eval_RegisterRule(structs, entry[regnum], entry['cfa'])
@@ -1009,19 +2780,130 @@ def validate(structs, entry, regs_info, status):
 
     return ra_validation and cs_validation
 
+def describe_mismatch(structs, entry, regs_info, status):
+    """ The expected (eh_frame) and computed (status) values of the RA and
+    of the callee-saved registers, for the ones that disagree """
+    reg_order, ra_regnum = regs_info
+    try:
+        ra_eh_frame = eval_RegisterRule(structs, entry[ra_regnum], entry['cfa'])
+    except:
+        ra_eh_frame = None
+    ra_status = status.get_ra()
+    ra = None
+    if ra_eh_frame != None and ra_eh_frame != ra_status:
+        ra = {'eh_frame': ra_eh_frame, 'status': ra_status}
+
+    cs = {}
+    if cs_eval:
+        for regnum in reg_order:
+            regname = describe_reg_name(regnum)
+            if not status.is_cs_reg(regname):
+                continue
+            try:
+                cs_eh_frame = eval_RegisterRule(structs, entry[regnum],
+                                                entry['cfa'])
+            except Exception:
+                continue
+            cs_status = status.get_cs(regname)
+            if status.is_reg_restored(regname) and cs_status == 'u':
+                continue
+            if cs_eh_frame != cs_status:
+                cs[regname] = {'eh_frame': cs_eh_frame, 'status': cs_status}
+    return ra, cs
+
+def insn_to_json(insn):
+    if insn == None:
+        return None
+    return {'kind': INSN_KIND_NAMES[insn.kind], 'mnemonic': insn.mnemonic,
+            'operand': insn.operand}
+
+class MismatchReport:
+    """ The mismatches of a run, one JSON object per line.  A row of the
+    eh_frame table is reported once. """
+
+    def __init__(self, path, limit):
+        self._file = open(path, 'w') if path != None else None
+        self.limit = limit
+        self.reported = 0
+        self.repeated = 0
+        self._rows = set()
+
+    def seen(self, row_begin):
+        if row_begin in self._rows:
+            self.repeated += 1
+            return True
+        self._rows.add(row_begin)
+        return False
+
+    def add(self, record):
+        self.reported += 1
+        if self._file != None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def full(self):
+        return self.reported >= self.limit
+
+    def close(self):
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return ("mismatches: {0} reported, {1} repeated in reported rows"
+                .format(self.reported, self.repeated))
+
 def process_push(status, regname):
     if regname == 'rip':
-        status.push_ra(gdb_get_sp()-8)
+        status.push_ra(backend.get_sp()-8)
         status.set_after_push_rip()
-        emitline("PUSH %rip: "+ str(status))
+        if tracer.enabled:
+            tracer.stack("PUSH %rip", status)
     elif status.is_cs_reg(regname):
-        status.push_cs(regname, gdb_get_sp()-8)
-        emitline(str(status))
+        status.push_cs(regname, backend.get_sp()-8)
+        if tracer.enabled:
+            tracer.stack("PUSH %"+regname, status)
 
 def process_pop(status, regname):
     if status.is_cs_reg(regname):
         status.pop_cs(regname)
-        emitline(str(status))
+        if tracer.enabled:
+            tracer.stack("POP %"+regname, status)
+
+def process_x86_insn(status, kind, reg):
+    """ Update `status` with an instruction about to be executed.
+    Returns True when returning from the outermost frame.
+    """
+    outermost = False
+    if kind == INSN_CALL:
+        status.push_ra(backend.get_sp()-8)
+        status.reset_cs_tracking()
+        increase_indent()
+        if tracer.enabled:
+            tracer.stack("CALL", status)
+
+    elif kind == INSN_RET:
+        status.pop_ra()
+        status.purge_restored_cs()
+        status.restore_cs_tracking()
+        decrease_indent()
+        if tracer.enabled:
+            tracer.stack("RET", status)
+        outermost = status.get_ra() == -1
+
+    elif kind == INSN_PUSH:
+        process_push(status, reg)
+
+    elif kind == INSN_POP:
+        process_pop(status, reg)
+
+    elif kind == INSN_LEAVE:
+        status.restore_cs('rbp')
+        if tracer.enabled:
+            tracer.stack("LEAVEQ")
+
+    status.reset_after_push_rip()
+    return outermost
 
 class MmapEntry:
     """ A line in the memory map of the process (where does the data at each
@@ -1069,7 +2951,7 @@ def get_mmap():
         assert(x[:2] == '0x')
         return int(x[2:], 16)
 
-    infos = gdb.execute('info files', to_string=True)
+    infos = gdb_execute('info files')
 
     entries = Mmap()
     lines =  infos.split('\n')
@@ -1101,139 +2983,1179 @@ def get_mmap():
 
     return entries
 
-# main
-def main():
-    global ARCH
+# execution traces
+#
+# In record mode the checker validates nothing: for each instruction it
+# records the ip, the sp, the registers the rules of its row refer to and
+# the stack event it performs.  `verify_trace.py` validates the
+# trace offline, outside gdb.
+#
+# Layout: TRACE_MAGIC, u32 length of a JSON header, then one record per
+# instruction: TRACE_RECORD followed by `nregs` times TRACE_REG.
 
-    try:
-        gdb_check_and_init()
+TRACE_MAGIC = b'EHTRACE1'
+TRACE_HEADER_SIZE = struct.Struct('<I')
+TRACE_RECORD = struct.Struct('<QQBBB')  # ip, sp, kind, reg, nregs
+TRACE_REG = struct.Struct('<BQ')        # regnum, value
+TRACE_NO_REG = 0xff
 
-        current_file = gdb_current_file()
+class ExprRegisters(GenericExprVisitor):
+    """ Collects the registers a DWARF expression refers to """
 
-        symbol_table = { 'table': IntervalTree(), 'files': [] }
-        eh_frame_table = IntervalTree()
-        
-        with open(current_file, 'rb') as f:
-            elffile = ELFFile(f)
-            ARCH = elffile.get_machine_arch()
-            memorize_symbol_table(elffile, symbol_table, current_file)
-            dump_symbol_table(symbol_table)
-            dwarfinfo = read_eh_frame_table(elffile)
-            memorize_eh_frame_table(dwarfinfo, eh_frame_table)
+    def __init__(self, structs):
+        super(ExprRegisters, self).__init__(structs)
+        self.regs = set()
 
-        pyelftools_init()
+    def _after_visit(self, opcode, opcode_name, args):
+        if opcode_name == 'DW_OP_bregx':
+            self.regs.add(args[0])
+        elif opcode_name.startswith('DW_OP_breg'):
+            self.regs.add(int(opcode_name[10:]))
+
+_RULE_REGISTERS_CACHE = {}
+
+def rule_registers(structs, cfa_rule):
+    """ DWARF numbers of the registers `cfa_rule` refers to, other than
+    the ip and sp that are always recorded """
+    key = (cfa_rule.reg, None if cfa_rule.expr is None else tuple(cfa_rule.expr))
+    if key not in _RULE_REGISTERS_CACHE:
+        if cfa_rule.expr is None:
+            regs = set([cfa_rule.reg])
+        else:
+            visitor = ExprRegisters(structs)
+            visitor.process_expr(cfa_rule.expr)
+            regs = visitor.regs
+        _RULE_REGISTERS_CACHE[key] = sorted(
+            r for r in regs
+            if describe_reg_name(r) not in (reg_ip()[1:], reg_sp()[1:]))
+    return _RULE_REGISTERS_CACHE[key]
+
+def row_registers(structs, entry, regs_info):
+    """ DWARF numbers of the registers the rules of an eh_frame row refer
+    to: its CFA rule, and the expressions of the rule of the return address
+    (and of the callee-saved registers, if `cs_eval`) """
+    regs = rule_registers(structs, entry['cfa'])
+    reg_order, ra_regnum = regs_info
+    regnums = list(reg_order) + [ra_regnum] if cs_eval else [ra_regnum]
+    for regnum in regnums:
+        rule = entry.get(regnum)
+        if rule != None and rule.type == RegisterRule.EXPRESSION:
+            # the CFA is pushed before evaluating these
+            expr_regs = rule_registers(structs, CFARule(expr=rule.arg))
+            regs = sorted(set(regs).union(expr_regs))
+    return regs
+
+class TraceWriter:
+    def __init__(self, path, header):
+        self._f = open(path, 'wb')
+        blob = json.dumps(header).encode('utf-8')
+        self._f.write(TRACE_MAGIC + TRACE_HEADER_SIZE.pack(len(blob)) + blob)
+        self._regnums = dict((describe_reg_name(n), n) for n in range(17))
+        self.records = 0
+
+    def record(self, ip, sp, insn, regs):
+        """ `regs` is a list of (regnum, value) """
+        reg = TRACE_NO_REG
+        if insn.kind == INSN_PUSH or insn.kind == INSN_POP:
+            reg = self._regnums.get(insn.reg, TRACE_NO_REG)
+        self._f.write(TRACE_RECORD.pack(ip, sp, insn.kind, reg, len(regs)))
+        for regnum, value in regs:
+            self._f.write(TRACE_REG.pack(regnum, value))
+        self.records += 1
+
+    def close(self):
+        self._f.close()
+
+def read_trace_header(f):
+    """ Returns the header of the trace open in `f`, and leaves `f` at
+    its first record """
+    if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("not an eh_frame_check trace")
+    size, = TRACE_HEADER_SIZE.unpack(f.read(TRACE_HEADER_SIZE.size))
+    return json.loads(f.read(size).decode('utf-8'))
+
+def read_trace_record(f):
+    """ Returns (ip, sp, kind, reg, regs) or None at the end of the trace;
+    `regs` maps regnums to values """
+    data = f.read(TRACE_RECORD.size)
+    if len(data) < TRACE_RECORD.size:
+        return None
+    ip, sp, kind, reg, nregs = TRACE_RECORD.unpack(data)
+    regs = {}
+    for i in range(nregs):
+        data = f.read(TRACE_REG.size)
+        if len(data) < TRACE_REG.size:
+            return None
+        regnum, value = TRACE_REG.unpack(data)
+        regs[regnum] = value
+    return ip, sp, kind, reg, regs
+
+class Monitor:
+    """ The budgets and heartbeats of a run.
+
+    `tick()` is invoked by the checker every `TICK` checked instructions,
+    or sooner to stop right at the budgets (the inferior stops at least
+    once per checked instruction): it ends the run once
+    the inferior stopped `max_steps` times (stepi or continue, as executed
+    instructions are not counted when continuing) or `max_checked`
+    instructions were checked, and appends a heartbeat to `path` every
+    `interval` seconds, so that a harness can tell a slow run from a hung
+    one.  No instruction is checked while the inferior runs at full speed
+    (continue), so `continuing()` marks the heartbeats as such before each
+    continue, and the next tick writes one without the mark.
+    """
 
-        # dump_eh_frame_table(dwarfinfo)
+    TICK = 1024
+
+    def __init__(self, checker, max_steps, max_checked, path, interval):
+        self._checker = checker
+        self.max_steps = max_steps
+        self.max_checked = max_checked
+        self.interval = interval
+        self._file = None
+        if path != None:
+            self._file = open(path, 'a')
+        self.start = time.time()
+        self._last_time = self.start
+        self._last_steps = 0
+        self._continuing = False
+        self.beats = 0
+
+    def next_tick(self, checked):
+        """ The checked count at which to call `tick` next """
+        tick = checked + self.TICK
+        if self.max_checked != None:
+            tick = min(tick, self.max_checked)
+        if self.max_steps != None:
+            tick = min(tick, checked + max(self.max_steps - backend.stops, 1))
+        return tick
+
+    def tick(self):
+        checker = self._checker
+        if self.max_checked != None and checker.checked >= self.max_checked:
+            checker.stop("checked budget of {0} instructions reached"
+                         .format(self.max_checked))
+        elif self.max_steps != None and backend.stops >= self.max_steps:
+            checker.stop("step budget of {0} stops reached"
+                         .format(self.max_steps))
+        if self._file != None:
+            now = time.time()
+            if self._continuing or now - self._last_time >= self.interval:
+                self.beat(now)
+
+    def continuing(self):
+        """ Invoked before continuing the inferior """
+        if self._file != None and not self._continuing:
+            self.beat(time.time(), continuing=True)
+
+    def snapshot(self, now):
+        """ The progress of the run, as a dict """
+        checker = self._checker
+        elapsed = now - self._last_time
+        return {
+            'time': round(now - self.start, 3),
+            'steps': backend.stops,
+            'checked': checker.checked,
+            'steps_per_s': round((backend.stops - self._last_steps)
+                                 / max(elapsed, 1e-9), 1),
+            'depth': checker.status.depth(),
+            'modules': sum(m.cfi_loaded
+                           for m in checker.modules.modules.values()),
+            'cache_hits': {
+                'cfi': None if cfi_cache == None else cfi_cache.hits,
+                'eh_frame_row': checker.eh_frame_table.last_hits,
+            },
+            'mismatches': checker.report.reported,
+        }
 
-        # go to main
-        gdb_goto_main()
+    def beat(self, now, continuing=False):
+        snapshot = self.snapshot(now)
+        snapshot['continuing'] = continuing
+        self._file.write(json.dumps(snapshot) + "\n")
+        self._file.flush()
+        self._continuing = continuing
+        self.beats += 1
+        self._last_time = now
+        self._last_steps = backend.stops
+
+    def progress(self):
+        """ One line of the progress of the run """
+        now = time.time()
+        return ("progress: {0} steps, {1} instructions checked in {2:.1f}s, "
+                "call depth {3}".format(backend.stops, self._checker.checked,
+                                        now - self.start,
+                                        self._checker.status.depth()))
+
+    def close(self):
+        if self._file != None:
+            self.beat(time.time())
+            self._file.close()
+            self._file = None
+
+class Profiler:
+    """ Where the time of a run goes, by phase, and where its checked
+    instructions are, by function and module.
+
+    `install()` wraps the entry points of each phase (the backend methods,
+    the table lookups, the evaluators, the sinks) with timers; the time is
+    exclusive, the time of nested phases (a lazy table load during a
+    lookup, a register read during an evaluation) being charged to them,
+    and the time outside every phase to 'checker'.  Nothing is wrapped
+    unless profiling is on.  `close()` prints a summary and writes `path`,
+    as a speedscope profile, or as pstats of the whole run under cProfile.
+
+    The checked instructions are counted by ip, and only resolved to their
+    module and function by `histogram()`, which can query the backend and
+    load symbol tables: the signal handlers leave them unresolved.
+    """
 
-        linked_files = gdb_dyn_linked_files()
-        print ("linked files")
-        for f in linked_files:
-            print("{0}-{1}: {2} ({3})".format(hex(f.begin), hex(f.end), f.data[0], f.data[1]))
-        print ("end linked files")
+    PHASES = ['stepping', 'registers', 'disassembly', 'cfi lookup',
+              'symbol lookup', 'expression evaluation', 'table loading',
+              'output', 'checker']
+
+    # the functions and methods timed in each phase
+    ENTRY_POINTS = [
+        ('stepping', 'backend', ['init', 'goto_main', 'step', 'cont',
+                                 'set_breakpoint', 'remove_breakpoint']),
+        ('registers', 'backend', ['get_ip', 'get_sp', 'get_reg',
+                                  'read_memory']),
+        ('disassembly', 'InsnCache', ['fill_range']),
+        ('cfi lookup', 'globals', ['search_eh_frame_table']),
+        ('cfi lookup', 'CFITable', ['lookup', 'row_bounds']),
+        ('symbol lookup', 'globals', ['find_function']),
+        ('expression evaluation', 'globals', ['validate',
+                                              'describe_mismatch']),
+        ('table loading', 'globals', ['load_eh_frame_table',
+                                      'memorize_symbol_table']),
+        ('table loading', 'globals', ['memorize_eh_frame_table_entry']),
+        ('output', 'Tracer', ['step', 'result', 'stack', 'note']),
+        ('output', 'MismatchReport', ['add']),
+        ('output', 'TraceWriter', ['record']),
+    ]
+
+    TOP_FUNCTIONS = 20
+
+    def __init__(self, path, output_format):
+        self.path = path
+        self.format = output_format
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self._stack = ['checker']
+        self.start = time.perf_counter()
+        self._last = self.start
+        # checked instructions by ip
+        self.ips = {}
+        self._checker = None
+        self._profile = None
+        if output_format == 'pstats':
+            self._profile = cProfile.Profile()
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        top = self._stack[-1]
+        self.seconds[top] += now - self._last
+        self._last = now
+        self._stack.append(phase)
+        # entries into the phase, not calls nested in it
+        if phase != top:
+            self.calls[phase] += 1
+
+    def leave(self):
+        now = time.perf_counter()
+        self.seconds[self._stack.pop()] += now - self._last
+        self._last = now
+
+    def _wrap(self, owner, name, phase):
+        if isinstance(owner, dict):
+            func = owner[name]
+        else:
+            func = getattr(owner, name)
+        enter = self.enter
+        leave = self.leave
 
-        if ARCH=='x64' or ARCH=='x86':
-            status = X86_Status(gdb_get_sp())
-        elif ARCH=='power':
-            status = Power_Status()
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                leave()
+        if isinstance(owner, dict):
+            owner[name] = timed
         else:
-            error ("ARCH not specified: supported arch are x64, x86, and power")
+            setattr(owner, name, timed)
+
+    def install(self):
+        """ Time the phases from now on """
+        module = globals()
+        for phase, owner, names in self.ENTRY_POINTS:
+            if owner == 'globals':
+                owner = module
+            elif owner == 'backend':
+                owner = backend
+            else:
+                owner = module[owner]
+            for name in names:
+                self._wrap(owner, name, phase)
+        if self._profile != None:
+            self._profile.enable()
+
+    def watch(self, checker):
+        """ Count the instructions checked by `checker`, by ip """
+        self._checker = checker
+        check = checker.check
+        ips = self.ips
+
+        def counted(ip):
+            ips[ip] = ips.get(ip, 0) + 1
+            return check(ip)
+        checker.check = counted
+
+    def histogram(self, resolve=True):
+        """ The checked instructions by (module, function), most first;
+        unless `resolve`, by ('[unresolved]', ip) """
+        counts = {}
+        checker = self._checker
+        if not resolve or checker == None:
+            return sorted(((('[unresolved]', format_hex(ip)), count)
+                           for ip, count in self.ips.items()),
+                          key=lambda item: (-item[1], item[0]))
+        for ip, count in self.ips.items():
+            try:
+                module = checker.mmap.entry_for(ip).path
+            except KeyError:
+                module = '[unmapped]'
+            if module == 'here':
+                module = backend.current_file()
+            key = (module, get_function_name(checker.symbol_table,
+                                             checker.modules, ip))
+            counts[key] = counts.get(key, 0) + count
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def summary(self, histogram=None):
+        """ The phases and the busiest modules and functions, as lines;
+        without `histogram`, only the counts of checked instructions """
+        total = max(sum(self.seconds.values()), 1e-9)
+        lines = ["profile: {0:.3f}s".format(total),
+                 "  {0:<22} {1:>10} {2:>7} {3:>10}".format('phase', 'seconds',
+                                                           '%', 'calls')]
+        for phase in self.PHASES:
+            lines.append("  {0:<22} {1:>10.3f} {2:>6.1f}% {3:>10}".format(
+                phase, self.seconds[phase], 100 * self.seconds[phase] / total,
+                self.calls[phase] if phase != 'checker' else ''))
+        if histogram == None:
+            lines.append("  {0} instructions checked at {1} ips".format(
+                sum(self.ips.values()), len(self.ips)))
+            return lines
+        checked = max(sum(count for key, count in histogram), 1)
+        modules = {}
+        for (module, function), count in histogram:
+            modules[module] = modules.get(module, 0) + count
+        lines.append("  checked instructions by module:")
+        for module, count in sorted(modules.items(),
+                                    key=lambda item: (-item[1], item[0])):
+            lines.append("  {0:>10} {1:>6.1f}%  {2}".format(
+                count, 100. * count / checked, module))
+        lines.append("  checked instructions by function (top {0}):".format(
+            self.TOP_FUNCTIONS))
+        for (module, function), count in histogram[:self.TOP_FUNCTIONS]:
+            lines.append("  {0:>10} {1:>6.1f}%  {2}".format(
+                count, 100. * count / checked, function))
+        return lines
+
+    def speedscope(self, histogram):
+        """ The phases and the histogram as a speedscope profile, two
+        'sampled' profiles whose samples are weighted by seconds and by
+        checked instructions """
+        frames = []
+        index = {}
+
+        def frame(name):
+            if name not in index:
+                index[name] = len(frames)
+                frames.append({'name': name})
+            return index[name]
+
+        phases = [phase for phase in self.PHASES if self.seconds[phase] > 0]
+        profiles = [{
+            'type': 'sampled',
+            'name': 'phases',
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(self.seconds.values()),
+            'samples': [[frame(phase)] for phase in phases],
+            'weights': [self.seconds[phase] for phase in phases],
+        }, {
+            'type': 'sampled',
+            'name': 'checked instructions',
+            'unit': 'none',
+            'startValue': 0,
+            'endValue': sum(count for key, count in histogram),
+            'samples': [[frame(module), frame(function)]
+                        for (module, function), count in histogram],
+            'weights': [count for key, count in histogram],
+        }]
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': profiles,
+            'name': 'eh_frame_check',
+            'exporter': 'eh_frame_check.py',
+        }
 
-        emitline ("INIT: "+ str(status))
+    def close(self, resolve=True):
+        """ Stop timing, print the summary and write the profile, with the
+        checked instructions resolved to functions if `resolve` """
+        if self._profile != None:
+            self._profile.disable()
+        now = time.perf_counter()
+        self.seconds[self._stack[-1]] += now - self._last
+        self._last = now
+        # when aborting, the wrappers of the phases still open leave them
+        # later on; neither they nor the histogram count any more
+        self._stack = ['checker'] * len(self._stack)
+        seconds, calls = dict(self.seconds), dict(self.calls)
+        histogram = self.histogram(resolve)
+        self.seconds, self.calls = seconds, calls
+        for line in self.summary(histogram):
+            print (line)
+        if self._profile != None:
+            self._profile.dump_stats(self.path)
+        else:
+            with open(self.path, 'w') as f:
+                json.dump(self.speedscope(histogram), f)
+        print ("Profile written to " + self.path)
 
-        mmap = get_mmap()
+class Checker:
+    """ The state of a run: tables, shadow status and decode cache.
 
-        # work
-        while True:
+    `check(ip)` validates the eh_frame entry at `ip` and then updates the
+    shadow status with the instruction about to be executed there.  The
+    engines below decide at which ips it is invoked.
+    """
 
-            current_ip = gdb_get_ip()
-            current_function = get_function_name(symbol_table, linked_files,
-                                                 current_ip)
-            current_instruction = gdb_get_instruction()
+    def __init__(self, symbol_table, eh_frame_table, linked_files,
+                 structs, status, mmap, insn_cache):
+        self.symbol_table = symbol_table
+        self.eh_frame_table = eh_frame_table
+        self.linked_files = linked_files
+        self.modules = ModuleRegistry(linked_files)
+        self.structs = structs
+        self.status = status
+        self.mmap = mmap
+        self.insn_cache = insn_cache
+        self.finished = False
+        self.checked = 0
+        self.trace = None
+        self.report = MismatchReport(report_path, max_reports)
+        self.step_over = None
+        self._mmap_entry = None
+        # the Insn checked before the current one, reported with mismatches
+        self._previous_insn = None
+        # why the run ended before the program, if it did
+        self.stopped = None
+        self.monitor = Monitor(self, max_steps, max_checked, heartbeat_path,
+                               heartbeat_interval)
+        self._next_tick = self.monitor.next_tick(0)
+
+    def stop(self, reason):
+        """ End the run before the end of the program """
+        print ("Stopping: " + reason)
+        self.stopped = reason
+        self.finished = True
+
+    def _record(self, current_ip, current_insn, current_eh):
+        regs = []
+        if current_eh != None:
+            for regnum in row_registers(self.structs, *current_eh):
+                regs.append((regnum, backend.get_reg(describe_reg_name(regnum))))
+        self.trace.record(current_ip, backend.get_sp(), current_insn, regs)
+
+    def function_at(self, ip):
+        return find_function(self.symbol_table, self.modules, ip)
+
+    def _mismatch(self, current_ip, current_insn, current_eh):
+        """ Reports the mismatch at `current_ip`, then aborts or resyncs the
+        status with the eh_frame entry """
+        status = self.status
+        entry, regs_info = current_eh
+        row_begin, row_end = self.eh_frame_table.row_bounds(current_ip)
+        print (" +----------------------------------------------")
+        print (" | Table Mismatch at IP: "+format_hex(current_ip))
+        print (" | eh_frame entry from : "+format_hex(row_begin) + ' : ' + repr(current_eh))
+
+        if not self.report.seen(row_begin):
+            ra, cs = describe_mismatch(self.structs, entry, regs_info, status)
+            try:
+                module = self.mmap.entry_for(current_ip).path
+            except KeyError:
+                module = None
+            if module == 'here':
+                module = backend.current_file()
+            self.report.add({
+                'ip': current_ip,
+                'module': module,
+                'function': get_function_name(self.symbol_table,
+                                              self.modules, current_ip),
+                'row': {'begin': row_begin, 'end': row_end,
+                        'cfa': repr(entry['cfa']),
+                        'rules': {describe_reg_name(regnum): repr(entry[regnum])
+                                  for regnum in regs_info[0]
+                                  if regnum in entry}},
+                'ra': ra,
+                'cs': cs,
+                'stack': [{'ra_at': ra_at, 'ra': ra_value,
+                           'function': None if ra_value == None else
+                           get_function_name(self.symbol_table, self.modules,
+                                             ra_value)}
+                          for ra_at, ra_value in status.call_stack()],
+                'checked': self.checked,
+                'insn': insn_to_json(current_insn),
+                'previous': insn_to_json(self._previous_insn),
+            })
+            for regname, values in cs.items():
+                status.resync_cs(regname, values['eh_frame'])
+
+        if not keep_going:
+            abort()
+        if self.report.full():
+            print ("Reached {0} mismatch reports".format(self.report.limit))
+            abort()
+
+    def check(self, current_ip):
+        """ Returns the Insn record at `current_ip` """
+        status = self.status
+        self.checked += 1
+        if self.checked >= self._next_tick:
+            self.monitor.tick()
+            self._next_tick = self.monitor.next_tick(self.checked)
+
+        current_insn = self.insn_cache.lookup(current_ip, self.function_at)
+
+        # the mapping and the function name are only traced
+        if tracer.enabled:
             try:
-                mmap_entry = mmap.entry_for(current_ip)
+                self._mmap_entry = self.mmap.entry_for(current_ip)
             except KeyError:
-                emitline("@@ Cannot get mapped region for {}"
-                         .format(format_hex(current_ip)))
+                tracer.note("@@ Cannot get mapped region for {}"
+                            .format(format_hex(current_ip)))
+            tracer.step(current_ip,
+                        self._mmap_entry.translate(current_ip),
+                        get_function_name(self.symbol_table, self.modules,
+                                          current_ip),
+                        current_insn.mnemonic, current_insn.operand)
+
+        current_eh = search_eh_frame_table(self.eh_frame_table,
+                                           self.modules, current_ip)
+
+        if self.trace != None:
+            self._record(current_ip, current_insn, current_eh)
+            if tracer.enabled:
+                tracer.result("RECORDED")
+        elif current_eh != None:
+            current_eh_frame_entry, regs_info = current_eh
+
+            if not(validate(self.structs, current_eh_frame_entry,
+                            regs_info, status)):
+                if tracer.enabled:
+                    tracer.result("MISMATCH")
+                self._mismatch(current_ip, current_insn, current_eh)
+            elif tracer.enabled:
+                tracer.result()
+        elif tracer.enabled:
+            tracer.result("SKIPPED")
+
+        if ARCH == 'x64' or ARCH == 'x86':
+            if process_x86_insn(status, current_insn.kind, current_insn.reg):
+                self.finished = True
+
+        elif ARCH == 'power':
+            if current_insn.mnemonic == "mflr":
+                regs = power_extract_registers(current_insn.operand)
+                status.update_ra_reg(regs['r1'])
+                if tracer.enabled:
+                    tracer.stack("MFLR", status)
+
+            elif current_insn.mnemonic == "stw":
+                regs = power_extract_registers(current_insn.operand)
+                if (regs['r2'] == 'r1') and (regs['r1'] == status.get_ra()):
+                    status.update_ra_addr(backend.get_reg(regs['r2'])+regs['off'])
+                    if tracer.enabled:
+                        tracer.stack("STW", status)
+
+        self._previous_insn = current_insn
+        return current_insn
+
+# engines
+
+def parse_step_over_spec(spec):
+    """ The (kind, pattern) of an allow or deny spec: 'build-id:HEX',
+    'symbol:GLOB', or a glob on the path of a module """
+    kind, sep, pattern = spec.partition(':')
+    if sep and kind in ('module', 'build-id', 'symbol'):
+        return kind, pattern
+    return 'module', spec
+
+class StepOver:
+    """ The calls run at full speed instead of being checked.
+
+    A call into a function that matches a `deny` spec, or that matches no
+    `allow` spec when some are given (the program itself is always
+    allowed), is stepped over: a temporary breakpoint is set at the return
+    address found in the status, the inferior continues up to it, and the
+    status is updated as if the callee had returned.  The lazy binding
+    trampoline (`_dl_runtime_resolve*`, entered from the first PLT entry)
+    is stepped over in the same way, up to the return address of the PLT
+    call.
+    """
 
-            emit ("=> %s (%s) [%s] (%s %s)"
-                  % (format_hex(current_ip),
-                     format_hex(mmap_entry.translate(current_ip)) or '',
-                     current_function,
-                     current_instruction[0],
-                     current_instruction[1]))
+    TRAMPOLINE = 'trampoline'
+    DENIED = 'denied'
+
+    def __init__(self, checker, main_file, allow, deny):
+        self._checker = checker
+        self._main_file = main_file
+        self._allow = [parse_step_over_spec(spec) for spec in allow]
+        self._deny = [parse_step_over_spec(spec) for spec in deny]
+        # the indirect jump of PLT0 enters the trampoline; it follows the
+        # 6-byte push of the link map
+        self._plt0_jumps = set(entry.beg + 6 for entry in checker.mmap
+                               if entry.section == '.plt')
+        self._verdicts = {}
+        self._build_ids = {}
+        self._last_ip = None
+        self.calls = 0
+        self.trampolines = 0
+        self.functions = set()
+
+    def _build_id(self, path):
+        if path not in self._build_ids:
+            try:
+                with open(path, 'rb') as f:
+                    self._build_ids[path] = elf_build_id(ELFFile(f))
+            except (IOError, OSError):
+                self._build_ids[path] = None
+        return self._build_ids[path]
+
+    def _matches(self, spec, path, name):
+        kind, pattern = spec
+        if kind == 'symbol':
+            return name != None and fnmatch.fnmatchcase(name, pattern)
+        if path == None:
+            return False
+        if kind == 'build-id':
+            build_id = self._build_id(path)
+            return build_id != None and build_id.startswith(pattern.lower())
+        return (fnmatch.fnmatchcase(path, pattern)
+                or fnmatch.fnmatchcase(os.path.basename(path), pattern))
+
+    def _verdict(self, ip):
+        checker = self._checker
+        try:
+            path = checker.mmap.entry_for(ip).path
+        except KeyError:
+            path = None
+        if path == 'here':
+            path = self._main_file
+        function = checker.function_at(ip)
+        name = None
+        if function != None:
+            name = function[2][:function[2].rfind('@')]
+        if name != None and fnmatch.fnmatchcase(name, '_dl_runtime_resolve*'):
+            return self.TRAMPOLINE
+        if any(self._matches(spec, path, name) for spec in self._deny):
+            return self.DENIED
+        if (self._allow and path != self._main_file
+                and not any(self._matches(spec, path, name)
+                            for spec in self._allow)):
+            return self.DENIED
+        return None
+
+    def skip(self, ip, breakpoints):
+        """ Steps over the call entered at `ip`, if it must be.  Returns
+        True if it did; the inferior is then at the return address.
+        `breakpoints` are placed by the engine and must stay. """
+        last_ip, self._last_ip = self._last_ip, ip
+        try:
+            verdict = self._verdicts[ip]
+        except KeyError:
+            verdict = self._verdicts[ip] = self._verdict(ip)
+        if last_ip in self._plt0_jumps:
+            verdict = self.TRAMPOLINE
+        if verdict == None:
+            return False
 
-            current_eh = search_eh_frame_table(eh_frame_table, linked_files, symbol_table,
-                                               current_ip)
+        status = self._checker.status
+        sp = backend.get_sp()
+        if verdict == self.TRAMPOLINE:
+            # the PLT pushed the relocation index and the link map
+            ra_at = sp + 16
+        else:
+            ra_at = status.get_ra()
+            if ra_at != sp:
+                return False  # not at the entry of the callee
+        ra = backend.read_memory(ra_at, 8)
+        if tracer.enabled:
+            tracer.note("STEP OVER {0} ({1}), up to {2}".format(
+                get_function_name(self._checker.symbol_table,
+                                  self._checker.modules, ip),
+                verdict, format_hex(ra)))
+
+        temporary = ra not in breakpoints
+        if temporary:
+            backend.set_breakpoint(ra)
+        while not backend.exited():
+            self._checker.monitor.continuing()
+            try:
+                backend.cont()
+            except InferiorExited:
+                break
+            if (not backend.exited() and backend.get_ip() == ra
+                    and backend.get_sp() == ra_at + 8):
+                break
+        if backend.exited():
+            print ("The program exited in a call stepped over at "
+                   + format_hex(ip))
+            self._checker.finished = True
+            return True
+        if temporary:
+            backend.remove_breakpoint(ra)
+
+        self.calls += 1
+        self.functions.add(ip)
+        if verdict == self.TRAMPOLINE:
+            self.trampolines += 1
+        status.unwind_to(ra_at)
+        if process_x86_insn(status, INSN_RET, ''):
+            self._checker.finished = True
+        return True
 
-            if current_eh != None:
-                current_eh_frame_entry, regs_info = current_eh
+    def stats(self):
+        return ("step over: {0} calls to {1} functions run at full speed "
+                "({2} lazy binding trampolines)".format(
+                    self.calls, len(self.functions), self.trampolines))
+
+def run_stepping(checker):
+    """ Single-step the inferior, checking every instruction """
+    step_over = checker.step_over
+    while True:
+        ip = backend.get_ip()
+        if step_over != None and step_over.skip(ip, ()):
+            if checker.finished:
+                break
+            continue
+        checker.check(ip)
+        if checker.finished:
+            break
+        backend.step()
+
+    return "step engine: {0} instructions checked".format(checker.checked)
+
+def x86_full_reg(reg):
+    """ The name of the widest register `reg` is part of ('ebp' -> 'rbp') """
+    if reg[:1] == 'r' and reg[1:-1].isdigit() and reg[-1:] in 'dwb':
+        return reg[:-1]
+    if len(reg) == 3 and reg[0] == 'e':
+        return 'r' + reg[1:]
+    if reg in ('sp', 'bp', 'si', 'di', 'spl', 'bpl', 'sil', 'dil'):
+        return 'r' + reg[:2]
+    return reg
+
+class EventEngine:
+    """ Continue between stack events instead of single-stepping.
+
+    The instructions of each function are decoded when execution first
+    enters it, and breakpoints are placed only at its stack events
+    (call/ret/push/pop/leave/sp-arith, jumps leaving the function,
+    writes to the CFA register of the current row) and at the start of
+    each of its eh_frame rows.  After an event the engine single-steps
+    once, so that the state it produces is validated too; everywhere
+    else neither the shadow status nor the eh_frame row can change, and
+    the engine continues to the next breakpoint.  Rows whose CFA is a
+    DWARF expression (e.g. PLT entries) are stepped through.
+    """
+
+    def __init__(self, checker):
+        self._checker = checker
+        self._step_at = set()
+        self._breakpoints = set()
+        # functions whose breakpoints are placed (data: True), or that
+        # cannot be decoded (data: False) and are always stepped
+        self._regions = IntervalTree()
+        # ips outside any function, always stepped
+        self._unarmed = set()
+        self.stepis = 0
+        self.continues = 0
+
+    def _row_at(self, addr):
+        return self._checker.eh_frame_table.lookup(addr)
+
+    def _cfa_reg(self, row):
+        cfa = row[0]['cfa']
+        if cfa.expr != None:
+            return None
+        return x86_full_reg(describe_reg_name(cfa.reg))
+
+    def _add_breakpoint(self, addr):
+        if addr not in self._breakpoints:
+            backend.set_breakpoint(addr)
+            self._breakpoints.add(addr)
+
+    def _is_event(self, addr, insn, begin, end, row):
+        if insn.kind == INSN_JUMP:
+            try:
+                target = int(insn.operand, 16)
+            except ValueError:
+                return True  # indirect jump
+            return not (begin <= target < end)
+        elif insn.kind != INSN_OTHER:
+            return True
+        elif insn.reg != '' and row != None:
+            return x86_full_reg(insn.reg) == self._cfa_reg(row)
+        return False
+
+    def _arm(self, ip):
+        """ Place the breakpoints of the function containing `ip`.
+        Returns False if the code at `ip` must be single-stepped.
+        """
+        regions = self._regions[ip]
+        if regions:
+            return regions.pop().data
+        if ip in self._unarmed:
+            return False
+
+        checker = self._checker
+        function = checker.function_at(ip)
+        if function == None:
+            self._unarmed.add(ip)
+            return False
+        begin, end = function[0], function[1]
+
+        checker.insn_cache.fill_range(begin, end)
+        events = []
+        addr = begin
+        while addr < end:
+            insn = checker.insn_cache.get(addr)
+            if insn == None or insn.length == 0:
+                self._regions[begin:end] = False
+                return False
+            row = self._row_at(addr)
+            if row != None and self._cfa_reg(row) == None:
+                events.append(addr)
+            elif self._is_event(addr, insn, begin, end, row):
+                events.append(addr)
+            addr += insn.length
+
+        for addr in events:
+            self._step_at.add(addr)
+            self._add_breakpoint(addr)
+        for row_begin, row_end, row in checker.eh_frame_table.rows(begin, end):
+            self._add_breakpoint(row_begin)
+
+        self._regions[begin:end] = True
+        return True
+
+    def run(self):
+        checker = self._checker
+        step_over = checker.step_over
+        while True:
+            ip = backend.get_ip()
+            if step_over != None and step_over.skip(ip, self._breakpoints):
+                if checker.finished:
+                    break
+                continue
+            checker.check(ip)
+            if checker.finished:
+                break
+            if self._arm(ip) and ip not in self._step_at:
+                self.continues += 1
+                checker.monitor.continuing()
+                backend.cont()
+            else:
+                self.stepis += 1
+                backend.step()
+
+        return ("events engine: {0} instructions checked, {1} stepi, "
+                "{2} continue, {3} breakpoints".format(
+                    checker.checked, self.stepis, self.continues,
+                    len(self._breakpoints)))
+
+def run_events(checker):
+    return EventEngine(checker).run()
+
+class SaturationEngine(EventEngine):
+    """ Single-step, but stop re-checking the addresses validated often
+    enough.
+
+    The validations of each address are counted together with the stack
+    state they were done in: the RA and callee-saved slots, and the
+    registers of the CFA rule, relative to the stack pointer.  A change of
+    state restarts the count.  Once an address has been validated
+    `threshold` times in the same state it is saturated; when execution is
+    at a saturated address, the breakpoints of its function are placed at
+    its stack events (as in EventEngine) and at its addresses not saturated
+    yet, and the engine continues between them.  Reaching an unsaturated
+    address, i.e. new code, falls back to single-stepping until a
+    saturated one; its breakpoint is lifted once it saturates.
+    """
 
-                # emit ("\n  => from %s\n" % format_hex(current_eh_frame_entry['pc']))
-                # print (repr(current_eh))
+    def __init__(self, checker, threshold):
+        EventEngine.__init__(self, checker)
+        self.threshold = threshold
+        # ip -> [validations, state]
+        self._counts = {}
+        self._saturated = set()
+
+    def _remove_breakpoint(self, addr):
+        if addr in self._breakpoints:
+            backend.remove_breakpoint(addr)
+            self._breakpoints.discard(addr)
+
+    def _state(self, ip):
+        sp = backend.get_sp()
+        state = self._checker.status.relative_state(sp)
+        row = self._row_at(ip)
+        if row != None:
+            state += tuple(backend.get_reg(describe_reg_name(regnum)) - sp
+                           for regnum in rule_registers(self._checker.structs,
+                                                        row[0]['cfa']))
+        return state
+
+    def _count(self, ip):
+        state = self._state(ip)
+        count = self._counts.get(ip)
+        if count == None or count[1] != state:
+            self._counts[ip] = [1, state]
+            return
+        count[0] += 1
+        if count[0] == self.threshold:
+            self._saturated.add(ip)
+            if ip not in self._step_at:
+                self._remove_breakpoint(ip)
+
+    def _arm(self, ip):
+        """ Place the breakpoints of the function containing `ip`.
+        Returns False if the code at `ip` must be single-stepped.
+        """
+        regions = self._regions[ip]
+        if regions:
+            return regions.pop().data
+        if ip in self._unarmed:
+            return False
 
-                if not(validate(dwarfinfo.structs, current_eh_frame_entry,
-                                regs_info, status)):
-                    print (" +----------------------------------------------")
-                    print (" | Table Mismatch at IP: "+format_hex(current_ip))
-                    print (" | eh_frame entry from : "+format_hex(current_eh_frame_entry['pc']) + ' : ' + repr(current_eh))
-                    abort()
+        checker = self._checker
+        function = checker.function_at(ip)
+        if function == None:
+            self._unarmed.add(ip)
+            return False
+        begin, end = function[0], function[1]
+
+        checker.insn_cache.fill_range(begin, end)
+        events = []
+        unsaturated = []
+        addr = begin
+        while addr < end:
+            insn = checker.insn_cache.get(addr)
+            if insn == None or insn.length == 0:
+                self._regions[begin:end] = False
+                return False
+            if self._is_event(addr, insn, begin, end, None):
+                events.append(addr)
+            elif addr not in self._saturated:
+                unsaturated.append(addr)
+            addr += insn.length
+
+        for addr in events:
+            self._step_at.add(addr)
+            self._add_breakpoint(addr)
+        for addr in unsaturated:
+            self._add_breakpoint(addr)
+
+        self._regions[begin:end] = True
+        return True
 
-                emit_no_prefix ("\n")
+    def run(self):
+        checker = self._checker
+        step_over = checker.step_over
+        start = time.time()
+        while True:
+            ip = backend.get_ip()
+            if step_over != None and step_over.skip(ip, self._breakpoints):
+                if checker.finished:
+                    break
+                continue
+            checker.check(ip)
+            if checker.finished:
+                break
+            if ip not in self._saturated:
+                self._count(ip)
+            if (ip in self._saturated and ip not in self._step_at
+                    and self._arm(ip)):
+                self.continues += 1
+                checker.monitor.continuing()
+                backend.cont()
             else:
-                emit_no_prefix ("  [SKIPPED]\n")
+                self.stepis += 1
+                backend.step()
+        elapsed = time.time() - start
+
+        rows = set()
+        for ip in self._counts:
+            bounds = checker.eh_frame_table.row_bounds(ip)
+            if bounds != None:
+                rows.add(bounds[0])
+        return ("saturate engine: {0} instructions checked, {1} stepi, "
+                "{2} continue, {3} breakpoints in {4:.2f}s "
+                "({5:.0f} stops/s)\n"
+                "coverage: {6} addresses in {7} eh_frame rows, "
+                "{8} saturated after {9} validations".format(
+                    checker.checked, self.stepis, self.continues,
+                    len(self._breakpoints), elapsed,
+                    (self.stepis + self.continues) / max(elapsed, 1e-9),
+                    len(self._counts), len(rows), len(self._saturated),
+                    self.threshold))
+
+def run_saturation(checker):
+    return SaturationEngine(checker, saturation).run()
+
+def run_stats(checker):
+    """ The statistics of the run of `checker`, but the engine's, as lines """
+    lines = []
+    if checker.step_over != None:
+        lines.append(checker.step_over.stats())
+    lines.append(backend.stats(checker.checked))
+    lines.append(checker.eh_frame_table.stats())
+    lines.append(checker.modules.stats())
+    if cfi_cache != None:
+        lines.append(cfi_cache.stats())
+    lines.append("insn cache: {0} instructions, {1} fills, {2} misses".format(
+        len(checker.insn_cache), checker.insn_cache.fills,
+        checker.insn_cache.misses))
+    return lines
 
-            current_opcode = current_instruction[0]
+# main
+def main():
+    global ARCH
+    global cfi_cache
+    global profiler
 
-            if ARCH == 'x64' or ARCH == 'x86':
-                if current_opcode[:4] == "call":
-                    status.push_ra(gdb_get_sp()-8)
-                    status.reset_cs_tracking()
-                    increase_indent()
-                    emitline ("CALL: ")
-                    emitline (str(status))
+    try:
+        if profile_path != None:
+            profiler = Profiler(profile_path, profile_format)
+            profiler.install()
 
-                elif current_opcode[:3] == "ret":
-                    status.pop_ra()
-                    status.purge_restored_cs()
-                    status.restore_cs_tracking()
-                    decrease_indent()
-                    emitline ("RET: ")
-                    emitline (str(status))
-                    if status.get_ra() == -1:
-                        break
+        if cfi_cache_dir:
+            cfi_cache = CFICache(cfi_cache_dir, cfi_cache_size)
 
-                elif current_opcode[:4] == "push":
-                    process_push(status, current_instruction[1].strip('%'))
+        backend.init()
 
-                elif current_opcode[:3] == "pop":
-                    process_pop(status, current_instruction[1].strip('%'))
+        current_file = backend.current_file()
 
-                elif current_opcode[:6] == "leaveq":
-                    status.restore_cs('rbp')
-                    emitline("LEAVEQ")
+        symbol_table = SymbolTable()
+        eh_frame_table = CFITable()
 
-                status.reset_after_push_rip()
+        with open(current_file, 'rb') as f:
+            elffile = ELFFile(f)
+            ARCH = elffile.get_machine_arch()
+            memorize_symbol_table(elffile, symbol_table, current_file)
+            if dbg_eval:
+                dump_symbol_table(symbol_table)
+            dwarfinfo = read_eh_frame_table(elffile)
+            load_eh_frame_table(elffile, current_file, eh_frame_table,
+                                dwarfinfo=dwarfinfo)
 
-            elif ARCH == 'power':
-                if current_opcode == "mflr":
-                    regs = power_extract_registers(current_instruction[1])
-                    status.update_ra_reg(regs['r1'])
-                    emitline ("MFLR: "+ str(status))
+        pyelftools_init()
 
-                elif current_opcode == "stw":
-                    regs = power_extract_registers(current_instruction[1])
-                    if (regs['r2'] == 'r1') and (regs['r1'] == status.get_ra()):
-                        status.update_ra_addr(gdb_get_reg(regs['r2'])+regs['off'])
-                        emitline ("STW: "+ str(status))
+        # dump_eh_frame_table(dwarfinfo)
 
+        # go to main
+        backend.goto_main()
 
-            gdb_execute("stepi")
+        linked_files = backend.linked_files()
+        print ("linked files")
+        for f in linked_files:
+            print("{0}-{1}: {2} ({3})".format(hex(f.begin), hex(f.end), f.data[0], f.data[1]))
+        print ("end linked files")
 
-        print ("Completed: "+current_file)
-        gdb_execute('quit')
+        if ARCH=='x64' or ARCH=='x86':
+            status = X86_Status(backend.get_sp())
+        elif ARCH=='power':
+            status = Power_Status()
+        else:
+            error ("ARCH not specified: supported arch are x64, x86, and power")
+
+        if verbose:
+            tracer.add_sink(TextSink())
+        if events_ndjson_path != None:
+            tracer.add_sink(NdjsonSink(events_ndjson_path))
+        if events_binary_path != None:
+            tracer.add_sink(BinarySink(events_binary_path))
+        if tracer.enabled:
+            tracer.stack("INIT", status)
+
+        mmap = backend.mmap()
+
+        insn_cache = InsnCache()
+        insn_cache.fill_sections(mmap)
+
+        checker = Checker(symbol_table, eh_frame_table, linked_files,
+                          dwarfinfo.structs, status, mmap, insn_cache)
+        if killer != None:
+            killer.checker = checker
+        if profiler != None:
+            profiler.watch(checker)
+
+        if allow_specs or deny_specs:
+            if not (ARCH == 'x64' or ARCH == 'x86'):
+                error ("calls can be stepped over on x64 and x86 only")
+            if record_path != None:
+                error ("calls cannot be stepped over in a recorded trace")
+            checker.step_over = StepOver(checker, current_file, allow_specs,
+                                         deny_specs)
+
+        if record_path != None:
+            if not (ARCH == 'x64' or ARCH == 'x86'):
+                error ("traces can be recorded on x64 and x86 only")
+            checker.trace = TraceWriter(record_path, {
+                'arch': ARCH,
+                'file': current_file,
+                'sp': backend.get_sp(),
+                'check_cs': cs_eval,
+                'linked_files': sorted([f.begin, f.end, f.data[0], f.data[1]]
+                                       for f in linked_files),
+            })
+
+        # work
+        if engine != 'step' and not (ARCH == 'x64' or ARCH == 'x86'):
+            error ("the {0} engine supports x64 and x86 only".format(engine))
+        if engine == 'events':
+            engine_stats = run_events(checker)
+        elif engine == 'saturate':
+            engine_stats = run_saturation(checker)
+        else:
+            engine_stats = run_stepping(checker)
+
+        if checker.trace != None:
+            checker.trace.close()
+            print ("Recorded {0} instructions in {1}".format(
+                checker.trace.records, record_path))
+
+        tracer.close()
+        checker.report.close()
+        checker.monitor.close()
+        if checker.stopped != None:
+            print ("Stopped: {0} ({1})".format(current_file, checker.stopped))
+        else:
+            print ("Completed: "+current_file)
+        print (engine_stats)
+        for line in run_stats(checker):
+            print (line)
+        if profiler != None:
+            profiler.close()
+        if checker.report.reported:
+            print (checker.report.stats())
+            backend.quit(1)
+        backend.quit()
     except:
         error ("Unexpected error\n\n" + traceback.format_exc())
 
@@ -1241,14 +4163,60 @@ def main():
 def print_usage():
     print("\n#### Usage ####")
     print("gdb -q -batch -ex 'py arg_verbose = True' -x eh_frame_check.py <testfile>")
+    print("python3 eh_frame_check.py [options] <testfile> [args]  (ptrace backend)")
     print("\n# Options:")
     print("#arg_verbose (False), arg_debug (False), arg_check_cs (True)")
+    print("#arg_engine ('step'): 'step' checks every instruction, 'events'")
+    print("#  continues between stack events and eh_frame row boundaries,")
+    print("#  'saturate' steps but continues over the addresses validated")
+    print("#  arg_saturation (100) times in the same stack state")
+    print("#arg_record (None): record a trace in this file instead of checking;")
+    print("#  verify it with verify_trace.py")
+    print("#arg_events_ndjson, arg_events_binary (None): trace the checked")
+    print("#  instructions and stack events in this file; decode the binary")
+    print("#  format with decode_events.py")
+    print("#arg_cfi_cache ($EH_FRAME_CHECK_CFI_CACHE): cache the eh_frame rows")
+    print("#  in this directory, see cfi_cache.py")
+    print("#arg_cfi_cache_size (512): size cap of the cfi cache, in MiB")
+    print("#arg_report (None): report the mismatches in this file, as NDJSON")
+    print("#arg_keep_going (False): resync and go on after a mismatch")
+    print("#arg_max_reports (100): abort after this many mismatch reports")
+    print("#arg_allow, arg_deny ([]): step over the calls into the code not")
+    print("#  allowed or denied; specs are module path globs, 'build-id:HEX'")
+    print("#  or 'symbol:GLOB'")
+    print("#arg_max_steps, arg_max_checked (None): stop the run after this")
+    print("#  many stops of the inferior, or checked instructions")
+    print("#arg_heartbeat (None): append the progress of the run to this file,")
+    print("#  as NDJSON, every arg_heartbeat_interval (10) seconds")
+    print("#arg_profile (None): time the phases of the run, count the checked")
+    print("#  instructions by function and module, and write them to this file")
+    print("#  as arg_profile_format ('speedscope'), or 'pstats' of cProfile")
+    print("# SIGUSR1 prints the statistics of the run so far, SIGTERM too")
+    print("#  before quitting")
 
 
 def parse_options():
     global verbose
     global dbg_eval
     global cs_eval
+    global engine
+    global saturation
+    global record_path
+    global events_ndjson_path
+    global events_binary_path
+    global cfi_cache_dir
+    global cfi_cache_size
+    global keep_going
+    global report_path
+    global max_reports
+    global allow_specs
+    global deny_specs
+    global max_steps
+    global max_checked
+    global heartbeat_path
+    global heartbeat_interval
+    global profile_path
+    global profile_format
 
     # FZN: if anybody knows of an alternative way to do this...
     try:
@@ -1275,28 +4243,268 @@ def parse_options():
     except NameError:
         cs_eval = False
 
-    # for arg in sys.argv:
-    #     if arg == "--check-cs":
-    #         cs_eval = True
-    #     elif arg == '--debug' or arg == '-d':
-    #         dbg_eval = True
-    #     elif arg =='--verbose' or arg == '-v':
-    #         verbose = True
-    #     elif arg == '--help' or arg == '-h':
-    #         print_usage()
-    #         quit()
-    #     else:
-    #         print ("Unknown option %s" % arg)
+    try:
+        engine = arg_engine
+    except NameError:
+        engine = 'step'
+    if engine not in ('step', 'events', 'saturate'):
+        print ("Unknown engine %s, using step" % engine)
+        engine = 'step'
+
+    try:
+        saturation = int(arg_saturation)
+    except NameError:
+        saturation = 100
+
+    try:
+        record_path = arg_record
+    except NameError:
+        record_path = None
+
+    try:
+        events_ndjson_path = arg_events_ndjson
+    except NameError:
+        events_ndjson_path = None
+
+    try:
+        events_binary_path = arg_events_binary
+    except NameError:
+        events_binary_path = None
+
+    try:
+        cfi_cache_dir = arg_cfi_cache
+    except NameError:
+        pass
+
+    try:
+        cfi_cache_size = int(arg_cfi_cache_size) << 20
+    except NameError:
+        pass
+
+    try:
+        report_path = arg_report
+    except NameError:
+        report_path = None
+
+    try:
+        if arg_keep_going:
+            keep_going = True
+        else:
+            keep_going = False
+    except NameError:
+        keep_going = False
+
+    try:
+        max_reports = int(arg_max_reports)
+    except NameError:
+        max_reports = 100
+
+    try:
+        allow_specs = arg_allow
+    except NameError:
+        allow_specs = []
+    if isinstance(allow_specs, str):
+        allow_specs = allow_specs.split(',')
+
+    try:
+        deny_specs = arg_deny
+    except NameError:
+        deny_specs = []
+    if isinstance(deny_specs, str):
+        deny_specs = deny_specs.split(',')
+
+    try:
+        max_steps = None if arg_max_steps == None else int(arg_max_steps)
+    except NameError:
+        max_steps = None
+
+    try:
+        max_checked = (None if arg_max_checked == None
+                       else int(arg_max_checked))
+    except NameError:
+        max_checked = None
+
+    try:
+        heartbeat_path = arg_heartbeat
+    except NameError:
+        heartbeat_path = None
+
+    try:
+        heartbeat_interval = float(arg_heartbeat_interval)
+    except NameError:
+        heartbeat_interval = 10
+
+    try:
+        profile_path = arg_profile
+    except NameError:
+        profile_path = None
+
+    try:
+        profile_format = arg_profile_format
+    except NameError:
+        profile_format = 'speedscope'
+    if profile_format not in ('speedscope', 'pstats'):
+        print ("Unknown profile format %s, using speedscope" % profile_format)
+        profile_format = 'speedscope'
+
+def parse_command_line():
+    """ Options of the ptrace backend, when run outside gdb.
+    Returns the test file and its arguments.
+    """
+    global verbose
+    global dbg_eval
+    global cs_eval
+    global engine
+    global saturation
+    global record_path
+    global events_ndjson_path
+    global events_binary_path
+    global cfi_cache_dir
+    global cfi_cache_size
+    global keep_going
+    global report_path
+    global max_reports
+    global allow_specs
+    global deny_specs
+    global max_steps
+    global max_checked
+    global heartbeat_path
+    global heartbeat_interval
+    global profile_path
+    global profile_format
+
+    parser = argparse.ArgumentParser(
+        description="Check the eh_frame tables of a program, tracing it "
+                    "with ptrace (x86-64 Linux only)")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="Trace the analysed instructions")
+    parser.add_argument('--debug', '-d', action='store_true',
+                        help="Trace the dwarf expression evaluator")
+    parser.add_argument('--check-cs', action='store_true',
+                        help="Check also the callee-saved registers")
+    parser.add_argument('--engine', choices=['step', 'events', 'saturate'],
+                        default='step',
+                        help="Check every instruction, continue between "
+                             "stack events, or continue over the saturated "
+                             "addresses (default: step)")
+    parser.add_argument('--saturation', metavar='N', type=int, default=100,
+                        help="Validations of an address in the same stack "
+                             "state after which the saturate engine stops "
+                             "checking it (default: 100)")
+    parser.add_argument('--record', metavar='TRACE',
+                        help="Record a trace instead of checking; verify it "
+                             "with verify_trace.py")
+    parser.add_argument('--events-ndjson', metavar='FILE',
+                        help="Trace the checked instructions and stack events "
+                             "in this file, as NDJSON")
+    parser.add_argument('--events-binary', metavar='FILE',
+                        help="Same, in a compact binary format decoded by "
+                             "decode_events.py")
+    parser.add_argument('--cfi-cache', metavar='DIR', default=cfi_cache_dir,
+                        help="Cache the eh_frame rows in this directory "
+                             "(default: $EH_FRAME_CHECK_CFI_CACHE)")
+    parser.add_argument('--cfi-cache-size', metavar='MiB', type=int,
+                        default=cfi_cache_size >> 20,
+                        help="Size cap of the cfi cache (default: 512)")
+    parser.add_argument('--report', metavar='FILE',
+                        help="Report the mismatches in this file, as NDJSON")
+    parser.add_argument('--keep-going', '-k', action='store_true',
+                        help="Resync and go on after a mismatch")
+    parser.add_argument('--max-reports', metavar='N', type=int, default=100,
+                        help="Abort after N mismatch reports (default: 100)")
+    parser.add_argument('--allow', metavar='SPEC', action='append', default=[],
+                        help="Check only the calls into the program and the "
+                             "code matching SPEC (a module path glob, "
+                             "build-id:HEX or symbol:GLOB), step over the "
+                             "others; repeatable")
+    parser.add_argument('--deny', metavar='SPEC', action='append', default=[],
+                        help="Step over the calls into the code matching "
+                             "SPEC; repeatable")
+    parser.add_argument('--max-steps', metavar='N', type=int,
+                        help="Stop the run after N stops (stepi or continue) "
+                             "of the program")
+    parser.add_argument('--max-checked', metavar='N', type=int,
+                        help="Stop the run after N checked instructions")
+    parser.add_argument('--heartbeat', metavar='FILE',
+                        help="Append the progress of the run to this file, "
+                             "as NDJSON, periodically")
+    parser.add_argument('--heartbeat-interval', metavar='SECONDS',
+                        type=float, default=10,
+                        help="Seconds between two heartbeats (default: 10)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Time the phases of the run, count the checked "
+                             "instructions by function and module, print a "
+                             "summary and write them to this file")
+    parser.add_argument('--profile-format', choices=['speedscope', 'pstats'],
+                        default='speedscope',
+                        help="A speedscope profile of the phases and the "
+                             "instructions, or the pstats of cProfile "
+                             "(default: speedscope)")
+    parser.add_argument('test_file', help="The program to check")
+    parser.add_argument('test_args', nargs=argparse.REMAINDER,
+                        help="Arguments passed to the program")
+    args = parser.parse_args()
+
+    verbose = args.verbose
+    dbg_eval = args.debug
+    cs_eval = args.check_cs
+    engine = args.engine
+    saturation = args.saturation
+    record_path = args.record
+    events_ndjson_path = args.events_ndjson
+    events_binary_path = args.events_binary
+    cfi_cache_dir = args.cfi_cache
+    cfi_cache_size = args.cfi_cache_size << 20
+    keep_going = args.keep_going
+    report_path = args.report
+    max_reports = args.max_reports
+    allow_specs = args.allow
+    deny_specs = args.deny
+    max_steps = args.max_steps
+    max_checked = args.max_checked
+    heartbeat_path = args.heartbeat
+    heartbeat_interval = args.heartbeat_interval
+    profile_path = args.profile
+    profile_format = args.profile_format
+    return args.test_file, args.test_args
 
 
 class Killer:
+    """ SIGUSR1 prints the statistics of the run so far, SIGTERM prints them
+    and quits, SIGINT quits """
     def __init__(self):
+        # the Checker of the run, once started
+        self.checker = None
         signal.signal(signal.SIGINT, self.do_quit)
         signal.signal(signal.SIGTERM, self.do_quit)
+        signal.signal(signal.SIGUSR1, self.do_stats)
+
+    def print_stats(self):
+        if self.checker == None:
+            print("Not checking yet")
+        else:
+            print(self.checker.monitor.progress())
+            for line in run_stats(self.checker):
+                print(line)
+            print(self.checker.report.stats())
+            if profiler != None:
+                # the counters only: resolving the functions could reenter
+                # the backend or a table load this signal interrupted
+                for line in profiler.summary():
+                    print(line)
+        sys.stdout.flush()
+
+    def do_stats(self, sig, frame):
+        print("Got stats signal {}".format(sig))
+        self.print_stats()
 
     def do_quit(self, sig, frame):
         print("Got kill signal {}".format(sig))
-        abort()
+        if sig == signal.SIGTERM:
+            self.print_stats()
+        if self.checker != None:
+            self.checker.monitor.close()
+        abort(from_handler=True)
 
 
 if __name__ == '__main__':
@@ -1304,9 +4512,10 @@ if __name__ == '__main__':
     try:
         gdb
     except NameError:
-        print_usage()
-        sys.exit("")
+        test_file, test_args = parse_command_line()
+        backend = PtraceBackend(test_file, test_args)
+    else:
+        parse_options()
+        backend = GdbBackend()
 
-    parse_options()
     main()
-   # cProfile.run('main()','profile.log')
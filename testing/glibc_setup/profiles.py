@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+""" Sum up the profiles of a run of the glibc testsuite.
+
+With `--profile`, the checker writes `<test>.profile.json` next to the log
+of each test: a speedscope file of the time spent in each phase of the
+check, and of the instructions checked in each function and module.  This
+adds them up over an output directory, to tell where the budget of the
+testsuite goes, and which modules are worth stepping over.
+
+Open a single profile in https://www.speedscope.app to browse it.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+PROFILE_SUFFIX = '.profile.json'
+
+
+def find_profiles(output_dir):
+    ''' The profiles of `output_dir`, recursively '''
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if name.endswith(PROFILE_SUFFIX):
+                yield os.path.join(dir_path, name)
+
+
+def read_profile(path):
+    ''' The ({phase: seconds}, {(module, function): instructions}) of the
+    profile at `path` '''
+    with open(path) as handle:
+        data = json.load(handle)
+    frames = [frame['name'] for frame in data['shared']['frames']]
+    phases = {}
+    functions = {}
+    for profile in data['profiles']:
+        samples = zip(profile['samples'], profile['weights'])
+        if profile['name'] == 'phases':
+            for (phase,), seconds in samples:
+                phases[frames[phase]] = seconds
+        elif profile['name'] == 'checked instructions':
+            for (module, function), count in samples:
+                functions[frames[module], frames[function]] = count
+    return phases, functions
+
+
+def add_to(totals, counts):
+    for key, count in counts.items():
+        totals[key] = totals.get(key, 0) + count
+
+
+def by_count(counts):
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sum up the profiles of a run of the glibc testsuite")
+    parser.add_argument('output_dir',
+                        help="The output directory of a run with --profile")
+    parser.add_argument('--top', type=int, default=20,
+                        help="Number of functions and tests shown (default: "
+                             "20)")
+    args = parser.parse_args()
+
+    phases = {}
+    modules = {}
+    module_tests = {}
+    functions = {}
+    test_seconds = {}
+    for path in find_profiles(args.output_dir):
+        try:
+            test_phases, test_functions = read_profile(path)
+        except (OSError, ValueError, KeyError) as exn:
+            print("Cannot read {}: {}".format(path, exn), file=sys.stderr)
+            continue
+        test = os.path.relpath(path, args.output_dir)[:-len(PROFILE_SUFFIX)]
+        test_seconds[test] = sum(test_phases.values())
+        add_to(phases, test_phases)
+        add_to(functions, test_functions)
+        for (module, function), count in test_functions.items():
+            modules[module] = modules.get(module, 0) + count
+            module_tests.setdefault(module, set()).add(test)
+
+    if not test_seconds:
+        print("No profile in {}".format(args.output_dir), file=sys.stderr)
+        sys.exit(1)
+
+    total = max(sum(phases.values()), 1e-9)
+    checked = max(sum(modules.values()), 1)
+    print("{} profiles, {:.1f}s".format(len(test_seconds), total))
+    print("{:<24} {:>10} {:>7}".format('phase', 'seconds', '%'))
+    for phase, seconds in by_count(phases):
+        print("{:<24} {:>10.1f} {:>6.1f}%".format(phase, seconds,
+                                                  100 * seconds / total))
+
+    print("\n{:>12} {:>7} {:>7}  {}".format('instructions', '%', 'tests',
+                                            'module'))
+    for module, count in by_count(modules):
+        print("{:>12} {:>6.1f}% {:>7}  {}".format(
+            count, 100 * count / checked, len(module_tests[module]), module))
+
+    print("\n{:>12} {:>7}  {}".format('instructions', '%', 'function'))
+    for (module, function), count in by_count(functions)[:args.top]:
+        print("{:>12} {:>6.1f}%  {}".format(count, 100 * count / checked,
+                                            function))
+
+    print("\n{:>10}  {}".format('seconds', 'test'))
+    for test, seconds in by_count(test_seconds)[:args.top]:
+        print("{:>10.1f}  {}".format(seconds, test))
+
+
+if __name__ == '__main__':
+    main()
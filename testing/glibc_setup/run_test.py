@@ -4,24 +4,28 @@ import subprocess
 import os
 import sys
 import gzip
+import hashlib
+import json
+import queue
+import tempfile
 import threading
+import time
+from collections import deque
 
 
-class KeepPolicy:
-    """ Carries what log files are kept after a run """
-    def __init__(self, on_success=False, on_timeout=False):
-        self.on_success = on_success
-        self.on_timeout = on_timeout
-
-
-def get_env():
-    glibc_base = "glibc/build"
+def venv_site_packages():
     python_base = None
     for pdir in os.scandir('../venv/lib/'):
         if pdir.name.startswith('python'):
             python_base = '{}/site-packages'.format(pdir.path)
     if not python_base:
         raise Exception("No virtualenv found in venv")
+    return python_base
+
+
+def get_env():
+    glibc_base = "glibc/build"
+    python_base = venv_site_packages()
 
     lib_path_list = [
         "{glibc}",
@@ -48,27 +52,658 @@ def get_env():
         'PYTHONPATH': '{}:{}'.format(os.getenv('PYTHON_PATH', ''),
                                      python_base),
     }
+    if os.getenv('EH_FRAME_CHECK_CFI_CACHE'):
+        out['EH_FRAME_CHECK_CFI_CACHE'] = os.getenv('EH_FRAME_CHECK_CFI_CACHE')
     return out
 
 
+# How a run ended up, and the file of the output directory listing the tests
+# that ended up so
+SUCCESS, FAILURE, TIMEOUT, GDB_FAILURE = 0, 1, 2, 3
+OUTCOMES = {
+    SUCCESS: '_SUCCESS',
+    FAILURE: '_FAILURES',
+    TIMEOUT: '_TIMEOUTS',
+    GDB_FAILURE: '_GDB_FAILURES',
+}
+
+# How much of the log of a run is kept: nothing, its tail (and the context
+# of the mismatches), or all of it
+LOG_NONE, LOG_TAIL, LOG_FULL = 'none', 'tail', 'full'
+LOG_LEVELS = (LOG_NONE, LOG_TAIL, LOG_FULL)
+
+
+class KeepPolicy:
+    """ Carries what log files are kept after a run: the log level of each
+    outcome, and the bounds of the tail """
+    def __init__(self, on_success=False, on_timeout=False, tail_lines=None,
+                 tail_bytes=None, levels=None):
+        self.tail_lines = tail_lines
+        self.tail_bytes = tail_bytes
+        # with a bounded tail, failures and timeouts keep it rather than the
+        # full log
+        kept = LOG_TAIL if self.bounded() else LOG_FULL
+        self.levels = {
+            SUCCESS: kept if on_success else LOG_NONE,
+            FAILURE: kept,
+            TIMEOUT: kept if on_timeout or self.bounded() else LOG_NONE,
+            GDB_FAILURE: kept,
+        }
+        self.levels.update(levels or {})
+        if LOG_TAIL in self.levels.values() and not self.bounded():
+            self.tail_lines = 10000
+
+    def bounded(self):
+        return self.tail_lines is not None or self.tail_bytes is not None
+
+    def level(self, outcome):
+        return self.levels[outcome]
+
+    def streamed(self):
+        """ Whether the full log may be kept, and must be written as it
+        goes """
+        return LOG_FULL in self.levels.values()
+
+
+# The file of the output directory with the duration of each run, as
+# `seconds<TAB>test` lines
+TIMINGS = '_TIMINGS'
+# The files of the output directory listing the tests whose verdict was, or
+# was not, found in the result cache
+CACHE_HITS = '_CACHE_HITS'
+CACHE_MISSES = '_CACHE_MISSES'
+
+
+def discover_tests(tests_dir):
+    """ The executable `test-*` and `tst-*` files under `tests_dir`, as the
+    Makefile finds them """
+    tests = []
+    for dir_path, dir_names, file_names in os.walk(tests_dir):
+        for name in file_names:
+            if not (name.startswith('test-') or name.startswith('tst-')):
+                continue
+            path = os.path.join(dir_path, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                tests.append(path)
+    return sorted(tests)
+
+
+def gdb_command(test_file, report_path, keep_going=False, max_reports=100,
+                heartbeat_path=None, heartbeat_interval=10, max_steps=None,
+                max_checked=None, profile_path=None):
+    """ The command line checking `test_file` """
+    # The options must be defined before gdb_instr sources the checker
+    options = [
+        'arg_report = {!r}'.format(os.path.abspath(report_path)),
+        'arg_keep_going = {}'.format(keep_going),
+        'arg_max_reports = {}'.format(max_reports),
+    ]
+    if heartbeat_path is not None:
+        options += [
+            'arg_heartbeat = {!r}'.format(os.path.abspath(heartbeat_path)),
+            'arg_heartbeat_interval = {}'.format(heartbeat_interval),
+        ]
+    if max_steps is not None:
+        options.append('arg_max_steps = {}'.format(max_steps))
+    if max_checked is not None:
+        options.append('arg_max_checked = {}'.format(max_checked))
+    if profile_path is not None:
+        options.append('arg_profile = {!r}'.format(
+            os.path.abspath(profile_path)))
+    command = ['gdb', '-q']
+    for option in options:
+        command += ['-ex', 'py ' + option]
+    return command + ['-x', 'gdb_instr', test_file]
+
+
+def last_heartbeat(path):
+    """ The last heartbeat of a file written by eh_frame_check.py, or None """
+    heartbeat = None
+    try:
+        with open(path, 'rb') as handle:
+            # the heartbeats are much shorter than this
+            handle.seek(max(os.fstat(handle.fileno()).st_size - 4096, 0))
+            for line in handle:
+                try:
+                    heartbeat = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    pass  # Truncated first or last line
+    except FileNotFoundError:
+        pass
+    return heartbeat
+
+
+def heartbeat_age(path, start):
+    """ Seconds since the last heartbeat written to `path`, or since `start`
+    (a `time.time()`) if none was """
+    try:
+        last = max(os.stat(path).st_mtime, start)
+    except FileNotFoundError:
+        last = start
+    return time.time() - last
+
+
+def is_hung(path, start, hang_timeout):
+    """ Whether the run writing its heartbeats to `path` has made no progress
+    for `hang_timeout` seconds; a run continuing the inferior checks nothing
+    and writes no heartbeat, but makes progress """
+    if heartbeat_age(path, start) <= hang_timeout:
+        return False
+    heartbeat = last_heartbeat(path)
+    return heartbeat is None or not heartbeat.get('continuing', False)
+
+
+def describe_heartbeat(path, start):
+    """ Whether the run writing its heartbeats to `path` is slow or hung """
+    heartbeat = last_heartbeat(path)
+    if heartbeat is None:
+        return "no heartbeat in {:.0f}s".format(time.time() - start)
+    return ("last heartbeat {:.0f}s ago: {} steps, {} checked, {} steps/s, "
+            "call depth {}{}".format(heartbeat_age(path, start),
+                                     heartbeat['steps'], heartbeat['checked'],
+                                     heartbeat['steps_per_s'],
+                                     heartbeat['depth'],
+                                     ", continuing"
+                                     if heartbeat.get('continuing') else ""))
+
+
+def classify(had_timeout, mismatches, returncode):
+    """ The outcome of a run """
+    if had_timeout:
+        return TIMEOUT
+    elif mismatches:
+        return FAILURE
+    elif returncode != 0:
+        return GDB_FAILURE
+    return SUCCESS
+
+
+def replication_command(args, env):
+    """ Generates the exact command line to input to replicate a run of
+    `args` in `env` """
+    def escape_arg(arg):
+        if ' ' in arg:
+            arg = "'{}'".format(arg.replace("'", r"\'"))
+        return arg
+    command = ' '.join(list(map(escape_arg, args)))
+
+    env_list = []
+    for env_var in env:
+        env_list.append('{}={}'.format(env_var, env[env_var]))
+
+    return '{} {}'.format(' '.join(env_list), command)
+
+
+def log_test_result(output_dir, test_file, outcome, seconds=None):
+    """ Append a line to `output_dir/OUTCOMES[outcome]` containing
+    `test_file`, to keep a short record of how each test ended up, and its
+    duration to `output_dir/TIMINGS` """
+    if output_dir is not None:
+        with open(os.path.join(output_dir, OUTCOMES[outcome]), 'a') as handle:
+            handle.write(test_file.strip() + '\n')
+        if seconds is not None:
+            with open(os.path.join(output_dir, TIMINGS), 'a') as handle:
+                handle.write('{:.3f}\t{}\n'.format(seconds, test_file.strip()))
+
+
+def read_timings(path):
+    """ The durations of a TIMINGS file, by test; the last one counts """
+    timings = {}
+    with open(path) as handle:
+        for line in handle:
+            seconds, _, test_file = line.rstrip('\n').partition('\t')
+            if test_file:
+                timings[test_file] = float(seconds)
+    return timings
+
+
+class LogWriter:
+    """ The background thread writing, and gzipping, the streamed logs of
+    all the runs.  Its queue is unbounded: the reading loops (the event
+    loop of the supervisor) never wait for it but when closing a log. """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            handle, item = self._queue.get()
+            try:
+                if isinstance(item, threading.Event):
+                    handle.close()
+                else:
+                    handle.write(b''.join(item))
+            except OSError as exn:
+                print("Cannot write {}: {}".format(handle.name, exn),
+                      file=sys.stderr)
+            finally:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def write(self, handle, batch):
+        self._start()
+        self._queue.put_nowait((handle, batch))
+
+    def close(self, handle):
+        """ Close `handle` once its batches are written; returns an Event
+        set then """
+        done = threading.Event()
+        self._start()
+        self._queue.put_nowait((handle, done))
+        return done
+
+
+LOG_WRITER = LogWriter()
+
+
+class RunLog:
+    """ The log of a run, written line by line.
+
+    If the policy may keep the full log, the lines are streamed to `path`
+    by LOG_WRITER, which also gzips them, so that the reading loop only
+    queues them.  If it may keep a tail, the last lines are kept in
+    memory, within the bounds of the policy, as well as `context` lines
+    around each mismatch; only these are written if the outcome keeps a
+    tail.  The header lines (the command) are always kept.
+    """
+
+    MISMATCH_MARK = 'Table Mismatch at IP'
+    BATCH = 256
+
+    def __init__(self, path, compress, keep_policy, context=20,
+                 max_contexts=100):
+        self.path = path
+        self.compress = compress
+        self.policy = keep_policy
+        self.context = context
+        self.max_contexts = max_contexts
+        self.head = []
+        self.lineno = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.contexts = {}  # lineno -> line, around the mismatches
+        self.recent = deque(maxlen=context)
+        self.context_left = 0
+        self.mismatches = 0
+
+        self._batch = []
+        self._handle = None
+        if keep_policy.streamed():
+            self._handle = self._open(path)
+
+    def _open(self, path):
+        if self.compress:
+            return gzip.open(path, 'wb')
+        return open(path, 'wb')
+
+    def _stream(self, data):
+        self._batch.append(data)
+        if len(self._batch) >= self.BATCH:
+            LOG_WRITER.write(self._handle, self._batch)
+            self._batch = []
+
+    def header(self, line):
+        data = line.strip().encode('utf-8') + b'\n'
+        self.head.append(data)
+        if self._handle is not None:
+            self._stream(data)
+
+    def write(self, line):
+        data = line.strip().encode('utf-8') + b'\n'
+        if self._handle is not None:
+            self._stream(data)
+        if not self.policy.bounded():
+            return
+
+        self.lineno += 1
+        if self.MISMATCH_MARK in line and self.mismatches < self.max_contexts:
+            self.mismatches += 1
+            for lineno, previous in self.recent:
+                self.contexts[lineno] = previous
+            self.context_left = self.context + 1
+        if self.context_left:
+            self.context_left -= 1
+            self.contexts[self.lineno] = data
+        self.recent.append((self.lineno, data))
+
+        self.tail.append((self.lineno, data))
+        self.tail_size += len(data)
+        while ((self.policy.tail_lines is not None
+                and len(self.tail) > self.policy.tail_lines)
+               or (self.policy.tail_bytes is not None
+                   and self.tail_size > self.policy.tail_bytes
+                   and len(self.tail) > 1)):
+            self.tail_size -= len(self.tail.popleft()[1])
+
+    def _write_tail(self, path):
+        lines = dict(self.contexts)
+        lines.update(self.tail)
+        with self._open(path) as handle:
+            handle.writelines(self.head)
+            expected = 1
+            for lineno in sorted(lines):
+                if lineno != expected:
+                    handle.write('## [{} lines dropped]\n'.format(
+                        lineno - expected).encode('utf-8'))
+                handle.write(lines[lineno])
+                expected = lineno + 1
+
+    def close(self, level, path):
+        """ Keep `level` of the log in `path`, or nothing; waits for
+        LOG_WRITER to write the streamed lines """
+        if self._handle is not None:
+            if self._batch:
+                LOG_WRITER.write(self._handle, self._batch)
+            LOG_WRITER.close(self._handle).wait()
+            if level == LOG_FULL:
+                if path != self.path:
+                    os.rename(self.path, path)
+                return
+            os.remove(self.path)
+        if level == LOG_TAIL:
+            self._write_tail(path)
+
+
+def settle_log(run_log, outfile, outcome, keep_policy, compress):
+    """ Close the log `run_log` of `outfile`, keeping what `keep_policy`
+    says for `outcome` """
+    path = outfile + ('.timeout' if outcome == TIMEOUT else '')
+    run_log.close(keep_policy.level(outcome),
+                  path + ('.gz' if compress else ''))
+
+
+def read_report(path):
+    """ The mismatch records of a report written by eh_frame_check.py """
+    records = []
+    try:
+        with open(path) as handle:
+            for line in handle:
+                if line.strip():
+                    records.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        pass  # Truncated last line: the checker was killed while writing
+    return records
+
+
+def file_digest(path):
+    """ The sha1 of the content of `path`, in hex """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_elf(path):
+    """ The pyelftools ELFFile of the open file `path`; pyelftools is taken
+    from the virtualenv if the running python does not have it """
+    try:
+        from elftools.elf.elffile import ELFFile
+    except ImportError:
+        sys.path.append(venv_site_packages())
+        from elftools.elf.elffile import ELFFile
+    return ELFFile(open(path, 'rb'))
+
+
+def system_libraries():
+    """ The paths of the libraries of the loader cache, by soname """
+    libraries = {}
+    try:
+        listing = subprocess.run(['ldconfig', '-p'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL,
+                                 universal_newlines=True).stdout
+    except OSError:
+        listing = ''
+    for line in listing.splitlines():
+        name, arrow, path = line.strip().partition(' => ')
+        if arrow:
+            libraries.setdefault(name.split(' ')[0], []).append(path)
+    return libraries
+
+
+class ResultCache:
+    """ The verdicts of past runs, in a directory of JSON files keyed by
+    the content of everything a verdict depends on: the test binary, the
+    objects the loader maps for it (by build-id, or content if they have
+    none), the checker source and the run options.
+
+    Only successes and mismatch failures are stored: timeouts and gdb
+    failures depend on the load of the host as much as on the test.
+    """
+
+    CACHED_OUTCOMES = (SUCCESS, FAILURE)
+
+    def __init__(self, directory, options):
+        self.directory = directory
+        self.options = options
+        os.makedirs(directory, exist_ok=True)
+        self._identities = {}
+        self._system_libraries = None
+        self._checker = None
+
+    def _identity(self, path):
+        """ The build-id of the ELF object `path`, or its content hash """
+        st = os.stat(path)
+        stamp = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        if stamp not in self._identities:
+            identity = None
+            elffile = open_elf(path)
+            try:
+                section = elffile.get_section_by_name('.note.gnu.build-id')
+                if section is not None:
+                    for note in section.iter_notes():
+                        if note['n_type'] == 'NT_GNU_BUILD_ID':
+                            identity = 'build-id:' + note['n_desc']
+            finally:
+                elffile.stream.close()
+            self._identities[stamp] = (identity
+                                       or 'sha1:' + file_digest(path))
+        return self._identities[stamp]
+
+    def _resolve(self, name, search_path, elfclass, machine):
+        """ The path the loader maps for the DT_NEEDED `name`, or None """
+        if '/' in name:
+            return name if os.path.exists(name) else None
+        candidates = [os.path.join(directory, name)
+                      for directory in search_path]
+        if self._system_libraries is None:
+            self._system_libraries = system_libraries()
+        candidates += self._system_libraries.get(name, [])
+        candidates += [os.path.join(directory, name)
+                       for directory in ('/lib', '/usr/lib')]
+        for candidate in candidates:
+            if not os.path.isfile(candidate):
+                continue
+            try:
+                elffile = open_elf(candidate)
+            except Exception:
+                continue
+            try:
+                if (elffile.elfclass == elfclass
+                        and elffile['e_machine'] == machine):
+                    return candidate
+            finally:
+                elffile.stream.close()
+        return None
+
+    def loaded_objects(self, test_file, env):
+        """ The identity of the objects mapped for `test_file` (its
+        interpreter and transitive DT_NEEDED), by name """
+        objects = {}
+        library_path = [d for d in env.get('LD_LIBRARY_PATH', '').split(':')
+                        if d]
+        pending = [(test_file, None)]
+        elfclass = machine = None
+        while pending:
+            path, name = pending.pop()
+            if name is not None:
+                if name in objects:
+                    continue
+                objects[name] = None
+            elffile = open_elf(path)
+            try:
+                if elfclass is None:
+                    elfclass, machine = elffile.elfclass, elffile['e_machine']
+                needed = []
+                search_path = []
+                for segment in elffile.iter_segments():
+                    if segment['p_type'] == 'PT_INTERP':
+                        interp = segment.get_interp_name()
+                        pending.append((interp, interp))
+                    elif segment['p_type'] == 'PT_DYNAMIC':
+                        for tag in segment.iter_tags():
+                            if tag.entry.d_tag == 'DT_NEEDED':
+                                needed.append(tag.needed)
+                            elif tag.entry.d_tag in ('DT_RPATH',
+                                                     'DT_RUNPATH'):
+                                rpath = (tag.rpath if tag.entry.d_tag
+                                         == 'DT_RPATH' else tag.runpath)
+                                search_path += rpath.replace(
+                                    '$ORIGIN',
+                                    os.path.dirname(os.path.abspath(path))
+                                ).split(':')
+            finally:
+                elffile.stream.close()
+            if name is not None:
+                objects[name] = self._identity(path)
+            for lib in needed:
+                if lib in objects:
+                    continue
+                lib_path = self._resolve(lib, search_path + library_path,
+                                         elfclass, machine)
+                if lib_path is None:
+                    objects[lib] = 'missing'
+                else:
+                    pending.append((lib_path, lib))
+        return objects
+
+    def checker_digest(self):
+        """ The hash of the checker sources """
+        if self._checker is None:
+            digest = hashlib.sha1()
+            for path in ('../eh_frame_check.py', 'gdb_instr'):
+                digest.update(file_digest(path).encode('ascii'))
+            self._checker = digest.hexdigest()
+        return self._checker
+
+    def key(self, test_file, env):
+        """ The key of the verdict of `test_file` run in `env` """
+        content = {
+            'test': file_digest(test_file),
+            'objects': sorted(self.loaded_objects(test_file, env).items()),
+            'checker': self.checker_digest(),
+            'options': sorted(self.options.items()),
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True)
+                            .encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def load(self, key):
+        """ The cached entry of `key`, or None """
+        try:
+            with open(self._path(key)) as handle:
+                entry = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if entry.get('outcome') not in self.CACHED_OUTCOMES:
+            return None
+        return entry
+
+    def store(self, key, test_file, outcome, mismatches, seconds):
+        """ Cache the verdict of a run, if it is one worth caching """
+        if outcome not in self.CACHED_OUTCOMES:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several runners share the cache: make the entry appear at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as handle:
+            json.dump({'test': test_file, 'outcome': outcome,
+                       'mismatches': mismatches, 'seconds': seconds},
+                      handle)
+        os.replace(tmp_path, path)
+
+
+def cache_options(timeout, keep_going, max_reports, max_steps=None,
+                  max_checked=None):
+    """ The run options a verdict depends on """
+    return {'timeout': timeout, 'keep_going': keep_going,
+            'max_reports': max_reports, 'max_steps': max_steps,
+            'max_checked': max_checked}
+
+
+def write_report(path, mismatches):
+    """ Write back the mismatch records of a report """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as handle:
+        for record in mismatches:
+            handle.write(json.dumps(record) + '\n')
+
+
+def log_cache_result(output_dir, test_file, hit):
+    """ Append `test_file` to `output_dir/CACHE_HITS` or `CACHE_MISSES` """
+    if output_dir is not None:
+        name = CACHE_HITS if hit else CACHE_MISSES
+        with open(os.path.join(output_dir, name), 'a') as handle:
+            handle.write(test_file.strip() + '\n')
+
+
 def run_single(test_file,
                output_dir=None,
                output_file=None,
                timeout=600,  # seconds = 10min
                compress=False,
-               keep_policy=None):
+               keep_policy=None,
+               keep_going=False,
+               max_reports=100,
+               cache=None,
+               force=False,
+               only_changed=False,
+               max_steps=None,
+               max_checked=None,
+               heartbeat_interval=10,
+               hang_timeout=0,
+               profile=False):
     """ Run a single test file.
 
     If `output_file` is None, the output of the program are printed directly;
     else, it is redirected to the given file.
 
     If `timeout` is not 0, the program is killed after `timeout` seconds and
-    the run is considered failed.
+    the run is considered failed.  The checker writes a heartbeat every
+    `heartbeat_interval` seconds, kept in `output_file.heartbeat.ndjson` on
+    timeout; if `hang_timeout` is not 0, the program is also killed, as
+    timed out, when it has not written any for `hang_timeout` seconds.
+    `max_steps` and `max_checked` are the budgets of the checker.
 
-    If `compress` is True, the output file is gzipped after the run.
+    If `compress` is True, the output file is gzipped.
 
-    If `keep_on_success` is False, the output file is deleted if the run ends
-    up successfully.
+    `keep_policy` tells how much of the output file is kept, depending on
+    the outcome; by default, only the full log of failures.
+
+    The mismatches are reported in `output_file.mismatches.ndjson`, kept if
+    there are any.  If `keep_going`, the checker goes on after a mismatch, up
+    to `max_reports` reports; else it stops at the first one.
+
+    If `cache`, a ResultCache, has the verdict of an identical run, it is
+    returned without running gdb, unless `force`; if `only_changed`, such a
+    test is not even logged in `output_dir`.
+
+    If `profile`, the checker profiles the run into
+    `output_file.profile.json` (a speedscope file, see profiles.py), and the
+    test is run even if its verdict is cached.
     """
 
     def last_line(s):
@@ -83,43 +718,13 @@ def run_single(test_file,
                                                        output_file_descr),
               file=sys.stderr)
 
-    def log_test_result(outcome_type):
-        ''' Append a line to `output_dir/outcome_type` containing
-        `test_file`, to keep a short record of how each test ended up '''
-
-        if output_dir is not None:
-            with open(os.path.join(output_dir, outcome_type), 'a') as handle:
-                handle.write(test_file.strip() + '\n')
-
     def run_with_outfile(outfile):
-        def suffix_gz_path(path):
-            return path + ('.gz' if compress else '')
-
-        def open_file(path, compress):
-            if compress:
-                return gzip.open(path, 'w')
-            return open(path, 'bw')
-
         if not os.path.isdir(os.path.dirname(outfile)):
             os.makedirs(os.path.dirname(outfile), exist_ok=True)
-        output_path = suffix_gz_path(outfile)
-        result = -1
-        with open_file(output_path, compress) as handle:
-            result = do_run(lambda line:
-                            handle.write(line.strip().encode('utf-8') + b'\n'))
-
-        do_remove = False
-        if result == 0 and not keep_policy.on_success:
-            do_remove = True
-        elif result == 2:  # Timeout
-            if keep_policy.on_timeout:
-                os.rename(output_path, suffix_gz_path(outfile + '.timeout'))
-            else:
-                do_remove = True
-
-        if do_remove:
-            os.remove(output_path)
-
+        output_path = outfile + ('.gz' if compress else '')
+        run_log = RunLog(output_path, compress, keep_policy)
+        result = do_run(run_log.write, run_log.header)
+        settle_log(run_log, outfile, result, keep_policy, compress)
         return result
 
     def run_without_outfile():
@@ -135,10 +740,56 @@ def run_single(test_file,
                                               '.gz' if compress else ''))
 
 
-    args = ['gdb', '-q', '-x', 'gdb_instr', test_file]
     env = get_env()
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.key(test_file, env)
+        except Exception as exn:
+            print("Cannot compute the cache key of {}, running it: {}".format(
+                test_file, exn), file=sys.stderr)
+    entry = None
+    if cache_key is not None and not (force or profile):
+        entry = cache.load(cache_key)
+    if entry is not None:
+        outcome = entry['outcome']
+        if only_changed:
+            return outcome
+        print("CACHED ({}) test {}".format(OUTCOMES[outcome].strip('_'),
+                                           test_file), file=sys.stderr)
+        if output_file and outcome == FAILURE:
+            write_report(output_file + '.mismatches.ndjson',
+                         entry['mismatches'])
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        log_test_result(output_dir, test_file, outcome, entry['seconds'])
+        log_cache_result(output_dir, test_file, True)
+        return outcome
+
+    if output_file:
+        report_path = output_file + '.mismatches.ndjson'
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        if os.path.exists(report_path):
+            os.remove(report_path)
+    else:
+        report_fd, report_path = tempfile.mkstemp(suffix='.mismatches.ndjson')
+        os.close(report_fd)
+    heartbeat_path = report_path[:-len('.mismatches.ndjson')] + \
+        '.heartbeat.ndjson'
+    if os.path.exists(heartbeat_path):
+        os.remove(heartbeat_path)
+    profile_path = None
+    if profile:
+        profile_path = report_path[:-len('.mismatches.ndjson')] + \
+            '.profile.json'
+
+    args = gdb_command(test_file, report_path, keep_going, max_reports,
+                       heartbeat_path, heartbeat_interval, max_steps,
+                       max_checked, profile_path)
 
     had_timeout = False
+    hung = False
+    wall_start = time.time()
 
     def upon_timeout(process):
         nonlocal had_timeout
@@ -149,26 +800,25 @@ def run_single(test_file,
             except:
                 pass  # Terminated in-between (race condition)
 
-    def gen_replication_command():
-        ''' Generates the exact command line to input to replicate this run '''
-        def escape_arg(arg):
-            if ' ' in arg:
-                arg = "'{}'".format(arg.replace("'", r"\'"))
-            return arg
-        command = ' '.join(list(map(escape_arg, args)))
-
-        env_list = []
-        for env_var in env:
-            env_list.append('{}={}'.format(env_var, env[env_var]))
+    def watch_heartbeat(process):
+        nonlocal hung
+        while process.poll() is None:
+            if is_hung(heartbeat_path, wall_start, hang_timeout):
+                hung = True
+                upon_timeout(process)
+                return
+            time.sleep(1)
 
-        return '{} {}'.format(' '.join(env_list), command)
+    def gen_replication_command():
+        return replication_command(args, env)
 
-    def do_run(line_action):
+    def do_run(line_action, header_action=None):
         nonlocal had_timeout
+        header_action = header_action or line_action
         try:
-            line_action("## Running command:")
-            line_action("##    {}".format(gen_replication_command()))
-            line_action("")
+            header_action("## Running command:")
+            header_action("##    {}".format(gen_replication_command()))
+            header_action("")
 
             process = subprocess.Popen(
                 args,
@@ -184,61 +834,91 @@ def run_single(test_file,
                 timer.start()
             else:
                 timer = None
+            if hang_timeout != 0:
+                threading.Thread(target=watch_heartbeat, args=[process],
+                                 daemon=True).start()
 
-            has_failed = False
             for out_line in iter(process.stdout.readline, ''):
                 line_action(out_line)
-                if out_line.find('Aborting') != -1:
-                    has_failed = True
 
             process.stdout.close()
             rc = process.wait()
             if timer:
                 timer.cancel()
 
-            if had_timeout:
-                print("TIMEOUT ({}s) test {}{}".format(timeout,
-                                                       test_file,
-                                                       output_file_descr),
-                      file=sys.stderr)
-                return 2
-            elif has_failed:
-                upon_failure(process)
-                return 1
-            elif rc != 0:
+            mismatches = read_report(report_path)
+            if mismatches:
+                line_action("## {} mismatches reported in {}".format(
+                    len(mismatches), report_path))
+
+            outcome = classify(had_timeout, mismatches, rc)
+            if outcome == TIMEOUT:
+                print("{} test {}{}: {}".format(
+                    "HUNG" if hung else "TIMEOUT ({}s)".format(timeout),
+                    test_file, output_file_descr,
+                    describe_heartbeat(heartbeat_path, wall_start)),
+                    file=sys.stderr)
+            elif outcome != SUCCESS:
                 upon_failure(process)
-                return 3
-            return 0
+            return outcome
 
         except subprocess.CalledProcessError as exn:
             upon_failure(exn)
-            return 3
+            return GDB_FAILURE
 
+    start = time.monotonic()
     if output_file:
         outcome = run_with_outfile(output_file)
     else:
         outcome = run_without_outfile()
+    seconds = time.monotonic() - start
 
-    log_test_result(
-        {
-            0: '_SUCCESS',
-            1: '_FAILURES',
-            2: '_TIMEOUTS',
-            3: '_GDB_FAILURES',
-        }[outcome])
+    if cache_key is not None:
+        cache.store(cache_key, test_file, outcome,
+                    read_report(report_path) if outcome == FAILURE else [],
+                    seconds)
 
-    return outcome
+    if outcome != FAILURE:
+        try:
+            os.remove(report_path)
+        except FileNotFoundError:
+            pass
+    if outcome != TIMEOUT or not output_file:
+        try:
+            os.remove(heartbeat_path)
+        except FileNotFoundError:
+            pass
 
+    log_test_result(output_dir, test_file, outcome, seconds)
+    if cache is not None:
+        log_cache_result(output_dir, test_file, False)
+
+    return outcome
 
-def parse_args():
-    ''' parse command-line arguments '''
-    parser = argparse.ArgumentParser(
-        description="Painlessly run a test case from the glibc test suite",
-    )
 
+def add_run_arguments(parser):
+    ''' The command-line arguments of how tests are run '''
     parser.add_argument('--timeout', default='600',
                         help=("Timeout duration, in seconds, before the "
                               "process gets killed. 0 for no timeout."))
+    parser.add_argument('--hang-timeout', type=int, default=0,
+                        help=("Kill the process, as timed out, when the "
+                              "checker did not report any progress for this "
+                              "many seconds. 0 (default) to wait for the "
+                              "timeout."))
+    parser.add_argument('--heartbeat', type=float, default=10,
+                        metavar='SECONDS',
+                        help=("Seconds between two progress reports of the "
+                              "checker (default: 10)"))
+    parser.add_argument('--max-steps', type=int, metavar='N',
+                        help="Stop the check after N steps of the test")
+    parser.add_argument('--max-checked', type=int, metavar='N',
+                        help="Stop the check after N checked instructions")
+    parser.add_argument('--profile', action='store_true',
+                        help=("Profile the checker, in <test>.profile.json: "
+                              "time per phase and checked instructions per "
+                              "function; sum them up with profiles.py. "
+                              "Implies --force."))
     parser.add_argument('--keep-on-success', action='store_true',
                         help=("Keep the log file of runs that exited "
                               "successfully."))
@@ -250,14 +930,108 @@ def parse_args():
                               "error, success). By default, only errors are "
                               "kept."))
 
+    parser.add_argument('--tail', type=int, metavar='LINES',
+                        help=("Only keep the last LINES lines of the logs in "
+                              "memory, and write them (with the context of "
+                              "the mismatches) on failure or timeout, instead "
+                              "of writing the full log"))
+    parser.add_argument('--tail-mb', type=float, metavar='MB',
+                        help=("Only keep the last MB megabytes of the logs, "
+                              "as --tail"))
+    parser.add_argument('--log-level', type=parse_log_level, action='append',
+                        default=[], metavar='OUTCOME=LEVEL',
+                        help=("Keep this much of the logs of the runs ending "
+                              "up so: none, tail or full; OUTCOME is "
+                              "success, failure, timeout or gdb-failure. "
+                              "Overrides the options above."))
+
+    parser.add_argument('--keep-going', action='store_true',
+                        help=("Report each mismatch and go on, instead of "
+                              "stopping the check at the first one"))
+    parser.add_argument('--max-reports', type=int, default=100,
+                        help=("With --keep-going, stop the check after this "
+                              "many mismatch reports (default: 100)"))
+
     parser.add_argument('--no-compress', '-Z', action='store_false',
                         dest='compress',
                         help=("Do not gzip the log files (default: gzip)"))
 
+    parser.add_argument('--cache', default='result_cache', metavar='DIR',
+                        help=("Directory of the cached verdicts, keyed by the "
+                              "test, the libraries it loads, the checker and "
+                              "the options (default: result_cache)"))
+    parser.add_argument('--no-cache', action='store_const', const=None,
+                        dest='cache',
+                        help="Neither use nor store cached verdicts")
+    parser.add_argument('--force', action='store_true',
+                        help=("Run the tests even if their verdict is cached, "
+                              "and cache the new one"))
+    parser.add_argument('--only-changed', action='store_true',
+                        help=("Skip the tests whose verdict is cached "
+                              "altogether, instead of reporting it"))
+
     parser.add_argument('--output', '-o', default=None,
                         help=("Output directory for the log file. If omitted, "
                               "the output is directly printed on the standard "
                               "output."))
+
+
+def result_cache_of(args):
+    ''' The ResultCache of the parsed `args`, or None '''
+    if args.cache is None:
+        return None
+    return ResultCache(args.cache, cache_options(
+        int(args.timeout), args.keep_going, args.max_reports, args.max_steps,
+        args.max_checked))
+
+
+def parse_log_level(spec):
+    ''' The (outcome, level) of an `outcome=level` spec '''
+    names = {'success': SUCCESS, 'failure': FAILURE, 'timeout': TIMEOUT,
+             'gdb-failure': GDB_FAILURE}
+    name, _, level = spec.partition('=')
+    if name not in names or level not in LOG_LEVELS:
+        raise argparse.ArgumentTypeError(
+            "expected {{{}}}={{{}}}, got {}".format(
+                ','.join(names), ','.join(LOG_LEVELS), spec))
+    return names[name], level
+
+
+def keep_policy_of(args):
+    ''' The KeepPolicy of the parsed `args` '''
+    return KeepPolicy(
+        on_success=args.keep_on_success or args.keep_all,
+        on_timeout=args.keep_on_timeout or args.keep_all,
+        tail_lines=args.tail,
+        tail_bytes=(None if args.tail_mb is None
+                    else int(args.tail_mb * (1 << 20))),
+        levels=dict(args.log_level),
+    )
+
+
+def test_path(test_file):
+    ''' `test_file`, with the prefix `glibc/build` if omitted '''
+    if not test_file.startswith('glibc'):
+        test_file = 'glibc/build/{}'.format(test_file)
+    return test_file
+
+
+def output_path_for(output_dir, test_file):
+    ''' The log file of `test_file` in `output_dir`, or None '''
+    if not output_dir:
+        return None
+    return os.path.join(
+        output_dir,
+        test_file[len('glibc/build/'):],  # FIXME Not robust at all…
+    )
+
+
+def parse_args():
+    ''' parse command-line arguments '''
+    parser = argparse.ArgumentParser(
+        description="Painlessly run a test case from the glibc test suite",
+    )
+    add_run_arguments(parser)
     parser.add_argument('test_file', metavar='test path',
                         help=("The file to be run. The prefix `glibc/build` "
                               "can be safely omitted."))
@@ -269,23 +1043,10 @@ def main():
     ''' Main function, called upon script invocation '''
     args = parse_args()
 
-    test_file = args.test_file
+    test_file = test_path(args.test_file)
     output_dir = args.output
-    if not test_file.startswith('glibc'):
-        test_file = 'glibc/build/{}'.format(test_file)
-
-    if output_dir:
-        output_path = os.path.join(
-            output_dir,
-            test_file[len('glibc/build/'):],  # FIXME Not robust at all…
-        )
-    else:
-        output_path = None
-
-    keep = KeepPolicy(
-        on_success=args.keep_on_success or args.keep_all,
-        on_timeout=args.keep_on_timeout or args.keep_all,
-    )
+    output_path = output_path_for(output_dir, test_file)
+    keep = keep_policy_of(args)
 
     sys.exit(
         run_single(test_file,
@@ -293,7 +1054,17 @@ def main():
                    output_file=output_path,
                    timeout=int(args.timeout),
                    keep_policy=keep,
-                   compress=args.compress)
+                   compress=args.compress,
+                   keep_going=args.keep_going,
+                   max_reports=args.max_reports,
+                   cache=result_cache_of(args),
+                   force=args.force,
+                   only_changed=args.only_changed,
+                   max_steps=args.max_steps,
+                   max_checked=args.max_checked,
+                   heartbeat_interval=args.heartbeat,
+                   hang_timeout=args.hang_timeout,
+                   profile=args.profile)
     )
 
 
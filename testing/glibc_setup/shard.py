@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+""" Split the glibc testsuite into shards run on several hosts, and merge
+their output directories.
+
+The partition only depends on the test list, the shard count and, if
+given, a `_TIMINGS` file of a previous campaign: every host computes the
+same one without coordination.  Without timings, a test goes to the shard
+given by a hash of its path; with timings, the tests are dealt out
+longest first to the least loaded shard, so that the shards take about
+the same time.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+
+import run_test
+
+# The file of a shard output directory recording which shard it is
+SHARD = '_SHARD'
+
+
+def parse_shard(spec):
+    ''' The (index, count) of a `i/N` spec, 0 <= i < N '''
+    try:
+        index, count = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, got {}".format(spec))
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("expected 0 <= i < N, got {}"
+                                         .format(spec))
+    return index, count
+
+
+def stable_hash(test_file):
+    return int(hashlib.sha1(test_file.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def partition(tests, count, timings=None):
+    ''' The shard of each test, as a dict '''
+    if not timings:
+        return {test: stable_hash(test) % count for test in tests}
+
+    # the tests that never ran weigh as much as the median one
+    known = sorted(timings.values())
+    default = known[len(known) // 2]
+    weights = {test: timings.get(test, default) for test in tests}
+
+    loads = [0.0] * count
+    shards = {}
+    for test in sorted(tests, key=lambda test: (-weights[test],
+                                                stable_hash(test), test)):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        shards[test] = shard
+        loads[shard] += weights[test]
+    return shards
+
+
+def select(tests, shard, timings=None):
+    ''' The tests of `shard`, an (index, count) pair, in order '''
+    index, count = shard
+    shards = partition(tests, count, timings)
+    return [test for test in tests if shards[test] == index]
+
+
+def list_tests(paths):
+    ''' The tests of `paths`, test files or directories '''
+    tests = []
+    for path in paths:
+        path = run_test.test_path(path)
+        if os.path.isdir(path):
+            tests.extend(run_test.discover_tests(path))
+        else:
+            tests.append(path)
+    return tests
+
+
+def mark_shard(output_dir, shard):
+    ''' Record in `output_dir` which shard it holds '''
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, SHARD), 'w') as handle:
+        handle.write('{}/{}\n'.format(*shard))
+
+
+def do_list(args):
+    timings = run_test.read_timings(args.timings) if args.timings else None
+    for test in select(list_tests(args.tests), args.shard, timings):
+        print(test)
+
+
+def merge_tree(source, target):
+    ''' Copy the logs and reports of `source` into `target` '''
+    for dir_path, dir_names, file_names in os.walk(source):
+        relative = os.path.relpath(dir_path, source)
+        for name in file_names:
+            if relative == '.' and name.startswith('_'):
+                continue  # outcome lists, timings, shard marker
+            target_dir = os.path.join(target, relative)
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.copy2(os.path.join(dir_path, name),
+                         os.path.join(target_dir, name))
+
+
+def do_merge(args):
+    # a test found in several shards keeps the outcome of the last one
+    outcome_of = {}
+    timings = {}
+    shard_times = []
+    shards_seen = {}
+    for source in args.shard_dirs:
+        shard_file = os.path.join(source, SHARD)
+        if os.path.exists(shard_file):
+            with open(shard_file) as handle:
+                index, count = parse_shard(handle.read().strip())
+            shards_seen.setdefault(count, set()).add(index)
+        for name in run_test.OUTCOMES.values():
+            path = os.path.join(source, name)
+            if os.path.exists(path):
+                with open(path) as handle:
+                    for line in handle:
+                        if line.strip():
+                            outcome_of[line.strip()] = name
+        timings_path = os.path.join(source, run_test.TIMINGS)
+        shard_timings = {}
+        if os.path.exists(timings_path):
+            shard_timings = run_test.read_timings(timings_path)
+            timings.update(shard_timings)
+        shard_times.append((source, len(shard_timings),
+                            sum(shard_timings.values())))
+        merge_tree(source, args.output)
+
+    outcomes = {name: [] for name in run_test.OUTCOMES.values()}
+    for test, name in sorted(outcome_of.items()):
+        outcomes[name].append(test)
+
+    os.makedirs(args.output, exist_ok=True)
+    for name, tests in outcomes.items():
+        if tests:
+            with open(os.path.join(args.output, name), 'w') as handle:
+                handle.writelines(test + '\n' for test in tests)
+    with open(os.path.join(args.output, run_test.TIMINGS), 'w') as handle:
+        for test, seconds in sorted(timings.items()):
+            handle.write('{:.3f}\t{}\n'.format(seconds, test))
+
+    print("{:<40} {:>7} {:>10}".format('shard', 'tests', 'seconds'))
+    for source, tests, seconds in shard_times:
+        print("{:<40} {:>7} {:>10.1f}".format(source, tests, seconds))
+    for count, indexes in sorted(shards_seen.items()):
+        missing = sorted(set(range(count)) - indexes)
+        if missing:
+            print("Missing shards of {}: {}".format(
+                count, ', '.join('{}/{}'.format(i, count) for i in missing)),
+                file=sys.stderr)
+    print(', '.join('{} {}'.format(len(outcomes[name]), name.strip('_'))
+                    for outcome, name in sorted(run_test.OUTCOMES.items())))
+    print("Merged into {}".format(args.output))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Shard the glibc testsuite, and merge shard outputs")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    list_parser = commands.add_parser(
+        'list', help="Print the tests of a shard")
+    list_parser.add_argument('--shard', type=parse_shard, required=True,
+                             metavar='i/N')
+    list_parser.add_argument('--timings', metavar='FILE',
+                             help="A _TIMINGS file, to balance the shards by "
+                                  "runtime")
+    list_parser.add_argument('tests', nargs='*', default=['glibc/build'],
+                             metavar='path',
+                             help="Test files, or directories searched for "
+                                  "tests (default: glibc/build)")
+    list_parser.set_defaults(func=do_list)
+
+    merge_parser = commands.add_parser(
+        'merge', help="Merge the output directories of the shards")
+    merge_parser.add_argument('--output', '-o', required=True,
+                              help="The merged output directory")
+    merge_parser.add_argument('shard_dirs', nargs='+', metavar='DIR')
+    merge_parser.set_defaults(func=do_merge)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+""" Run the glibc testsuite under eh_frame_check.py from a single process.
+
+The tests are found as the Makefile does, and run by N concurrent gdb
+workers, which are asyncio subprocesses: their output is streamed to their
+logs and classified from the event loop, which also enforces the timeouts.
+The outcome files and logs are the ones of `run_test.py`.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+
+import run_test
+import shard
+
+INSTRUCTIONS_RE = re.compile(r'(\d+) instructions checked')
+
+
+class Progress:
+    ''' Counts of the finished tests, and throughput since the start '''
+
+    def __init__(self, total):
+        self.total = total
+        self.start = time.monotonic()
+        self.instructions = 0
+        self.outcomes = dict.fromkeys(run_test.OUTCOMES, 0)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, outcome, instructions):
+        self.outcomes[outcome] += 1
+        self.instructions += instructions or 0
+
+    def line(self):
+        done = sum(self.outcomes.values())
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        line = "[{}/{}] {:.1f} tests/min, {:.0f} insn/s; {}".format(
+            done, self.total, 60 * done / elapsed,
+            self.instructions / elapsed,
+            ', '.join('{} {}'.format(self.outcomes[outcome], name.strip('_'))
+                      for outcome, name in sorted(run_test.OUTCOMES.items())))
+        if self.cache_hits or self.cache_misses:
+            line += "; cache: {} hits, {} misses".format(self.cache_hits,
+                                                        self.cache_misses)
+        return line
+
+
+async def cached_outcome(test_file, args, env, cache, progress):
+    ''' The cache key of `test_file` and its cached outcome, if any, or
+    None; handles the cache hits '''
+    try:
+        # hashing the test and its libraries would stall the event loop
+        key = await asyncio.get_running_loop().run_in_executor(
+            None, cache.key, test_file, env)
+    except Exception as exn:
+        print("Cannot compute the cache key of {}, running it: {}".format(
+            test_file, exn), file=sys.stderr)
+        return None, None
+    entry = None if args.force or args.profile else cache.load(key)
+    if entry is None:
+        progress.cache_misses += 1
+        run_test.log_cache_result(args.output, test_file, False)
+        return key, None
+
+    progress.cache_hits += 1
+    outcome = entry['outcome']
+    if args.only_changed:
+        progress.total -= 1
+        return key, outcome
+    if outcome != run_test.SUCCESS:
+        print("CACHED ({}) test {}".format(
+            run_test.OUTCOMES[outcome].strip('_'), test_file), file=sys.stderr)
+    if outcome == run_test.FAILURE:
+        output_file = run_test.output_path_for(args.output, test_file)
+        run_test.write_report(output_file + '.mismatches.ndjson',
+                              entry['mismatches'])
+    run_test.log_test_result(args.output, test_file, outcome,
+                             entry['seconds'])
+    run_test.log_cache_result(args.output, test_file, True)
+    progress.add(outcome, None)
+    return key, outcome
+
+
+async def run_one(test_file, args, env, cache, progress):
+    ''' Run one test; returns its outcome '''
+    key = None
+    if cache is not None:
+        key, outcome = await cached_outcome(test_file, args, env, cache,
+                                            progress)
+        if outcome is not None:
+            return outcome
+
+    output_file = run_test.output_path_for(args.output, test_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    output_path = output_file + ('.gz' if args.compress else '')
+    report_path = output_file + '.mismatches.ndjson'
+    heartbeat_path = output_file + '.heartbeat.ndjson'
+    profile_path = output_file + '.profile.json' if args.profile else None
+    for path in (report_path, heartbeat_path):
+        if os.path.exists(path):
+            os.remove(path)
+    command = run_test.gdb_command(test_file, report_path, args.keep_going,
+                                   args.max_reports, heartbeat_path,
+                                   args.heartbeat, args.max_steps,
+                                   args.max_checked, profile_path)
+    instructions = None
+    start = time.monotonic()
+    wall_start = time.time()
+    keep_policy = run_test.keep_policy_of(args)
+    run_log = run_test.RunLog(output_path, args.compress, keep_policy)
+
+    run_log.header("## Running command:")
+    run_log.header("##    {}".format(run_test.replication_command(command,
+                                                                    env)))
+    run_log.header("")
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,  # Force non-interactive mode
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=env,
+        limit=1 << 20,
+    )
+
+    async def pump():
+        nonlocal instructions
+        while True:
+            out_line = await process.stdout.readline()
+            if not out_line:
+                break
+            out_line = out_line.decode('utf-8', errors='replace')
+            run_log.write(out_line)
+            checked = INSTRUCTIONS_RE.search(out_line)
+            if checked:
+                instructions = int(checked.group(1))
+        return await process.wait()
+
+    async def watch_heartbeat():
+        while not run_test.is_hung(heartbeat_path, wall_start,
+                                   args.hang_timeout):
+            await asyncio.sleep(1)
+
+    had_timeout = False
+    hung = False
+    rc = None
+    pumping = asyncio.ensure_future(pump())
+    waiting = {pumping}
+    watcher = None
+    if args.hang_timeout:
+        watcher = asyncio.ensure_future(watch_heartbeat())
+        waiting.add(watcher)
+    try:
+        await asyncio.wait(waiting, timeout=args.timeout or None,
+                           return_when=asyncio.FIRST_COMPLETED)
+        if pumping.done():
+            rc = pumping.result()
+        else:
+            had_timeout = True
+            hung = watcher is not None and watcher.done()
+    finally:
+        for task in waiting:
+            task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    mismatches = run_test.read_report(report_path)
+    outcome = run_test.classify(had_timeout, mismatches, rc)
+    if outcome == run_test.TIMEOUT:
+        print("{} test {}: {}".format(
+            "HUNG" if hung else "TIMEOUT ({}s)".format(args.timeout),
+            test_file, run_test.describe_heartbeat(heartbeat_path,
+                                                   wall_start)),
+            file=sys.stderr)
+    elif outcome == run_test.FAILURE:
+        print("FAILED ({} mismatches) test {} (results saved in {})".format(
+            len(mismatches), test_file, output_path), file=sys.stderr)
+    elif outcome == run_test.GDB_FAILURE:
+        print("FAILED (exit code {}) test {} (results saved in {})".format(
+            rc, test_file, output_path), file=sys.stderr)
+
+    if key is not None:
+        cache.store(key, test_file, outcome,
+                    mismatches if outcome == run_test.FAILURE else [],
+                    time.monotonic() - start)
+    # waits for the log writer, which gzips the whole log
+    await asyncio.get_running_loop().run_in_executor(
+        None, run_test.settle_log, run_log, output_file, outcome,
+        keep_policy, args.compress)
+    if outcome != run_test.FAILURE and os.path.exists(report_path):
+        os.remove(report_path)
+    if outcome != run_test.TIMEOUT and os.path.exists(heartbeat_path):
+        os.remove(heartbeat_path)
+    run_test.log_test_result(args.output, test_file, outcome,
+                             time.monotonic() - start)
+    progress.add(outcome, instructions)
+    return outcome
+
+
+async def supervise(tests, args):
+    env = run_test.get_env()
+    cache = run_test.result_cache_of(args)
+    progress = Progress(len(tests))
+    queue = asyncio.Queue()
+    for test_file in tests:
+        queue.put_nowait(test_file)
+
+    async def worker():
+        while True:
+            try:
+                test_file = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await run_one(test_file, args, env, cache, progress)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(args.progress)
+            print(progress.line(), file=sys.stderr)
+
+    reporter = asyncio.ensure_future(report_progress())
+    try:
+        await asyncio.gather(*[worker() for _ in range(args.jobs)])
+    finally:
+        reporter.cancel()
+    return progress
+
+
+def parse_args():
+    ''' parse command-line arguments '''
+    parser = argparse.ArgumentParser(
+        description="Run the glibc test suite under eh_frame_check.py, with "
+                    "concurrent gdb workers",
+    )
+    run_test.add_run_arguments(parser)
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help="Number of concurrent gdb workers (default: all "
+                             "cores)")
+    parser.add_argument('--progress', type=float, default=10,
+                        help="Seconds between two progress lines (default: "
+                             "10)")
+    parser.add_argument('--shard', type=shard.parse_shard, metavar='i/N',
+                        help="Only run the i-th of N shards of the tests, "
+                             "see shard.py")
+    parser.add_argument('--timings', metavar='FILE',
+                        help="A _TIMINGS file of a previous run, to balance "
+                             "the shards by runtime")
+    parser.add_argument('tests', nargs='*', default=['glibc/build'],
+                        metavar='path',
+                        help="Test files, or directories searched for tests "
+                             "(default: glibc/build)")
+    args = parser.parse_args()
+    args.timeout = int(args.timeout)
+    if args.output is None:
+        args.output = time.strftime('outputs/%Y-%m-%d_%H-%M-%S')
+    return args
+
+
+def main():
+    ''' Main function, called upon script invocation '''
+    args = parse_args()
+
+    tests = shard.list_tests(args.tests)
+    os.makedirs(args.output, exist_ok=True)
+    if args.shard:
+        timings = (run_test.read_timings(args.timings) if args.timings
+                   else None)
+        tests = shard.select(tests, args.shard, timings)
+        shard.mark_shard(args.output, args.shard)
+
+    progress = asyncio.run(supervise(tests, args))
+    print(progress.line())
+    print("Outputs in {}".format(args.output))
+    sys.exit(0 if progress.outcomes[run_test.SUCCESS] == progress.total
+             else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+""" Verify offline a trace recorded by `eh_frame_check.py` in record mode.
+
+The trace is split in chunks, verified in parallel by a pool of processes.
+The shadow status at the start of each chunk is rebuilt by a sequential
+prefix pass over the stack events of the trace.  Return addresses given by
+`reg+offset` rules are compared in batches, with NumPy when available.
+
+A trace holds the registers the rules of each row refer to, but no
+memory: the rows whose rules dereference memory cannot be verified
+offline, and are reported as such.
+"""
+
+import argparse
+import copy
+import os
+import sys
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import eh_frame_check as efc
+from eh_frame_check import ELFFile, IntervalTree, RegisterRule
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Unverifiable(Exception):
+    """ The rules of a row need more than the trace records """
+
+
+class TraceRegisters:
+    """ Stands in for the backend of eh_frame_check: the registers of the
+    record being verified """
+
+    def __init__(self):
+        self.ip = 0
+        self.sp = 0
+        self.regs = {}
+        self._ip_name = efc.reg_ip()[1:]
+        self._sp_name = efc.reg_sp()[1:]
+        self._regnums = dict((efc.describe_reg_name(n), n) for n in range(17))
+
+    def set(self, ip, sp, regs):
+        self.ip = ip
+        self.sp = sp
+        self.regs = regs
+
+    def get_ip(self):
+        return self.ip
+
+    def get_sp(self):
+        return self.sp
+
+    def get_reg(self, reg):
+        if reg == self._sp_name:
+            return self.sp
+        elif reg == self._ip_name:
+            return self.ip
+        try:
+            return self.regs[self._regnums[reg]]
+        except KeyError:
+            raise Unverifiable("{0} is not recorded".format(reg))
+
+    def read_memory(self, addr, size):
+        raise Unverifiable("traces do not record memory, cannot dereference "
+                           + efc.format_hex(addr))
+
+    def quit(self, code=0):
+        # efc.error aborts on the rules the evaluators do not support
+        raise Unverifiable("the evaluation aborted")
+
+
+class Tables:
+    """ The eh_frame tables of the traced program and of its libraries """
+
+    def __init__(self, header):
+        self.eh_frame_table = efc.CFITable()
+        linked_files = IntervalTree()
+        for begin, end, path, section in header['linked_files']:
+            linked_files[begin:end] = (path, section)
+        self.modules = efc.ModuleRegistry(linked_files)
+
+        with open(header['file'], 'rb') as f:
+            elffile = ELFFile(f)
+            dwarfinfo = efc.read_eh_frame_table(elffile)
+            efc.load_eh_frame_table(elffile, header['file'],
+                                    self.eh_frame_table, dwarfinfo=dwarfinfo)
+            self.structs = dwarfinfo.structs
+
+    def lookup(self, ip):
+        return efc.search_eh_frame_table(self.eh_frame_table, self.modules,
+                                         ip)
+
+
+def setup(header):
+    efc.ARCH = header['arch']
+    efc.verbose = False
+    efc.cs_eval = header['check_cs']
+    efc.pyelftools_init()
+    efc.backend = TraceRegisters()
+    if efc.cfi_cache_dir:
+        efc.cfi_cache = efc.CFICache(efc.cfi_cache_dir, efc.cfi_cache_size)
+
+
+def reg_name(regnum):
+    if regnum == efc.TRACE_NO_REG:
+        return ''
+    return efc.describe_reg_name(regnum)
+
+
+def prefix_pass(path, chunk_size):
+    """ Returns the header and the (offset, count, status) of each chunk,
+    where status is the shadow status at the start of the chunk """
+    chunks = []
+    with open(path, 'rb') as f:
+        header = efc.read_trace_header(f)
+        setup(header)
+        status = efc.X86_Status(header['sp'])
+
+        index = 0
+        while True:
+            offset = f.tell()
+            record = efc.read_trace_record(f)
+            if record is None:
+                break
+            if index % chunk_size == 0:
+                chunks.append([offset, 0, copy.deepcopy(status)])
+            chunks[-1][1] += 1
+
+            ip, sp, kind, reg, regs = record
+            efc.backend.set(ip, sp, regs)
+            efc.process_x86_insn(status, kind, reg_name(reg))
+            index += 1
+
+    return header, chunks
+
+
+_tables = None
+
+
+def init_worker(header):
+    global _tables
+    setup(header)
+    _tables = Tables(header)
+
+
+def ra_fast_path(entry, regs_info):
+    """ (cfa register, offset of the return address from it), if the rule
+    giving the return address in `entry` is reg+offset """
+    ra_regnum = regs_info[1]
+    cfa = entry['cfa']
+    rule = entry.get(ra_regnum)
+    if (cfa.expr is None and rule is not None
+            and rule.type == RegisterRule.OFFSET):
+        return cfa.reg, cfa.offset + rule.arg
+    return None
+
+
+def verifiable(entry, regs_info):
+    """ Whether the rules of `entry` checked by efc.validate can be
+    evaluated from the record; efc.validate takes the rules it cannot
+    evaluate for valid """
+    reg_order, ra_regnum = regs_info
+    regnums = [ra_regnum] + (list(reg_order) if efc.cs_eval else [])
+    try:
+        for regnum in regnums:
+            if regnum in entry:
+                efc.eval_RegisterRule(_tables.structs, entry[regnum],
+                                      entry['cfa'])
+    except Unverifiable:
+        return False
+    return True
+
+
+def verify_chunk(job):
+    """ Returns the mismatches of a chunk, as (index, ip, eh_frame ra,
+    status ra), and its unverifiable instructions, as (index, ip) """
+    path, first, offset, count, status = job
+    mismatches = []
+    unverifiable = []
+    # batch of reg+offset rules: index, ip, register value, offset, expected
+    batch = ([], [], [], [], [])
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for index in range(first, first + count):
+            record = efc.read_trace_record(f)
+            if record is None:
+                break
+            ip, sp, kind, reg, regs = record
+            efc.backend.set(ip, sp, regs)
+
+            current_eh = _tables.lookup(ip)
+            if current_eh is not None:
+                entry, regs_info = current_eh
+                fast = None if efc.cs_eval else ra_fast_path(entry, regs_info)
+                if fast is not None:
+                    regnum, ra_offset = fast
+                    for column, value in zip(batch, (
+                            index, ip, efc.backend.get_reg(
+                                efc.describe_reg_name(regnum)),
+                            ra_offset, status.get_ra())):
+                        column.append(value)
+                elif not verifiable(entry, regs_info):
+                    unverifiable.append((index, ip))
+                elif not efc.validate(_tables.structs, entry, regs_info,
+                                      status):
+                    mismatches.append((index, ip, None, status.get_ra()))
+
+            efc.process_x86_insn(status, kind, reg_name(reg))
+
+    indexes, ips, values, offsets, expected = batch
+    if numpy is not None and indexes:
+        computed = (numpy.array(values, dtype=numpy.int64)
+                    + numpy.array(offsets, dtype=numpy.int64))
+        bad = numpy.nonzero(computed != numpy.array(expected,
+                                                    dtype=numpy.int64))[0]
+        bad = [(i, int(computed[i])) for i in bad]
+    else:
+        bad = [(i, values[i] + offsets[i]) for i in range(len(indexes))
+               if values[i] + offsets[i] != expected[i]]
+    for i, ra in bad:
+        mismatches.append((indexes[i], ips[i], ra, expected[i]))
+
+    return sorted(mismatches), unverifiable
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Verify a trace recorded by eh_frame_check.py")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=200000,
+                        help="Number of instructions per chunk")
+    parser.add_argument('trace', help="The trace file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    header, chunks = prefix_pass(args.trace, args.chunk_size)
+
+    jobs = []
+    first = 0
+    for offset, count, status in chunks:
+        jobs.append((args.trace, first, offset, count, status))
+        first += count
+    print("{0}: {1} instructions, {2} chunks".format(header['file'], first,
+                                                     len(jobs)))
+
+    with Pool(args.jobs, initializer=init_worker,
+              initargs=(header,)) as pool:
+        mismatches = []
+        unverifiable = []
+        for chunk_mismatches, chunk_unverifiable in pool.map(verify_chunk,
+                                                             jobs):
+            mismatches.extend(chunk_mismatches)
+            unverifiable.extend(chunk_unverifiable)
+
+    for index, ip, ra_eh_frame, ra_status in mismatches:
+        print(" +----------------------------------------------")
+        print(" | Table Mismatch at IP: {0} (instruction {1})".format(
+            efc.format_hex(ip), index))
+        if ra_eh_frame is not None:
+            print(" | RA: eh_frame = " + efc.format_hex(ra_eh_frame))
+        print(" | RA: status   = " + efc.format_hex(ra_status))
+
+    if unverifiable:
+        ips = sorted(set(ip for index, ip in unverifiable))
+        print("{0} instructions at {1} IPs not verifiable offline, their "
+              "rules read memory or unrecorded registers: {2}{3}".format(
+                  len(unverifiable), len(ips),
+                  ' '.join(efc.format_hex(ip) for ip in ips[:10]),
+                  ' ...' if len(ips) > 10 else ''))
+
+    if mismatches:
+        print("{0} mismatches".format(len(mismatches)))
+        sys.exit(1)
+    print("Completed: " + header['file'])
+
+
+if __name__ == '__main__':
+    main()
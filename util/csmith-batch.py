@@ -4,8 +4,16 @@ import argparse
 import hashlib
 import os
 import random
+import resource
 import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import csmith_buckets
 
 cflags_choices = [
     ('-O0', '-O1', '-O2', '-O3'),
@@ -58,10 +66,10 @@ csmithflags_choices = [
     # --max-union-fields <num>: limit the number of union fields to <num> (default 5).
 ]
 
-def choose_flags(choices, defaults=''):
+def choose_flags(choices, rng, defaults=''):
     flags = defaults.split(' ')
     for choice in choices:
-        flags.append(random.choice(choice))
+        flags.append(rng.choice(choice))
     return list(filter(lambda flag: flag != '', flags))
 
 def file_slug(filename):
@@ -70,34 +78,249 @@ def file_slug(filename):
         hasher.update(f.read())
     return hasher.hexdigest()[:12]
 
-parser = argparse.ArgumentParser(description='Run a test executable on programs generated by csmith')
-parser.add_argument('testexec', help='The test executable, takes the C source file as first argument, returns 0 if test succeeds')
+def program_seed(seed, index):
+    """ The seed of the `index`-th program of the campaign of `seed`: the
+    same whatever the number of workers """
+    digest = hashlib.sha1(('%d:%d' % (seed, index)).encode()).digest()
+    return int.from_bytes(digest[:4], 'little')
 
-args = parser.parse_args()
-csmith = os.environ.get('CSMITH', 'csmith')
-csmith_filename = 'csmith.c'
-test_exec = args.testexec
+# the mismatches reported by testing/csmith-test.sh, in the working directory
+REPORT_FILENAME = 'csmith.mismatches.ndjson'
 
-print("To investigate a failing test, run: env $(cat <env-file>) %s <source-file>" % test_exec)
+def write_atomically(filename, data):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_filename, filename)
+
+class Campaign:
+    """ The programs handed out to the workers, and the counts of their
+    outcomes """
+
+    OUTCOMES = ['pass', 'fail', 'timeout', 'error']
+
+    def __init__(self, seed, count, duration, buckets):
+        self.seed = seed
+        # the BucketIndex of the failures, updated under `_lock`
+        self.buckets = buckets
+        self.count = count
+        self.start = time.monotonic()
+        self.deadline = None if duration is None else self.start + duration
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._next = 0
+        self.counts = dict.fromkeys(self.OUTCOMES, 0)
+        # the test processes running, killed when stopping
+        self.processes = set()
+
+    def next_program(self):
+        """ The index of the next program to test, or None when the budget
+        is spent """
+        with self._lock:
+            if self.stopping.is_set():
+                return None
+            if self.count is not None and self._next >= self.count:
+                return None
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                return None
+            index = self._next
+            self._next += 1
+            return index
+
+    def add(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def add_failure(self, signature, case):
+        ''' Record a failure in its bucket; returns its key, and whether
+        `case` is to be saved '''
+        with self._lock:
+            key, keep = self.buckets.add(signature, case)
+            self.buckets.save()
+            return key, keep
+
+    def stop(self):
+        self.stopping.set()
+        for p in list(self.processes):
+            kill_group(p)
 
-while True:
-    cflags = choose_flags(cflags_choices, os.environ.get('CFLAGS', ''))
-    csmithflags = choose_flags(csmithflags_choices, os.environ.get('CSMITHFLAGS', ''))
+    def summary(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        done = sum(self.counts.values())
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = usage.ru_utime + usage.ru_stime
+        return ("%d programs in %.0fs (%.1f/min): %s (%d buckets); "
+                "CPU %.1fs (%.1f cores)"
+                % (done, elapsed, 60 * done / elapsed,
+                   ', '.join('%d %s' % (self.counts[outcome], outcome)
+                             for outcome in self.OUTCOMES),
+                   len(self.buckets.buckets), cpu, cpu / elapsed))
 
-    subprocess.run([csmith, '-o', csmith_filename] + csmithflags, check=True)
+def kill_group(p):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def run_in_group(campaign, cmd, timeout, **kwargs):
+    """ Run `cmd` in its own process group, killed with its children on
+    timeout; returns its exit code, or None on timeout """
+    p = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    campaign.processes.add(p)
+    try:
+        return p.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_group(p)
+        p.wait()
+        return None
+    finally:
+        campaign.processes.discard(p)
+
+def save_failing_case(work_dir, output_dir, csmith_filename, seed, cflags,
+                      csmithflags):
+    """ Copy the failing case of `work_dir` to `output_dir`; a source file
+    is only ever seen complete, with its env file, its log and its mismatch
+    report (if the test wrote one) """
+    slug = file_slug(csmith_filename)
+    prefix = os.path.join(output_dir, "csmith-%s" % slug)
+
+    env = 'CFLAGS=%s\nCSMITHFLAGS=%s\nCSMITH_SEED=%d\n' % (
+        ' '.join(cflags), ' '.join(csmithflags), seed)
+    write_atomically(prefix + '.env', env.encode())
+    for name, suffix in (('test.log', '.log'),
+                         (REPORT_FILENAME, '.mismatches.ndjson')):
+        if os.path.exists(os.path.join(work_dir, name)):
+            with open(os.path.join(work_dir, name), 'rb') as f:
+                write_atomically(prefix + suffix, f.read())
+    with open(csmith_filename, 'rb') as f:
+        write_atomically(prefix + '.c', f.read())
+    return prefix + '.c'
+
+def test_program(campaign, args, work_dir, index):
+    """ Generate the `index`-th program in `work_dir` and test it; returns
+    its outcome """
+    seed = program_seed(campaign.seed, index)
+    rng = random.Random(seed)
+    cflags = choose_flags(cflags_choices, rng, os.environ.get('CFLAGS', ''))
+    csmithflags = choose_flags(csmithflags_choices, rng,
+                               os.environ.get('CSMITHFLAGS', ''))
+    csmith_filename = os.path.join(work_dir, 'csmith.c')
+
+    rc = run_in_group(campaign,
+                      [csmith, '--seed', str(seed), '-o', csmith_filename]
+                      + csmithflags,
+                      args.timeout, stdout=subprocess.DEVNULL)
+    if campaign.stopping.is_set():
+        return None
+    if rc != 0:
+        print("csmith failed (seed %d, flags %s)"
+              % (seed, ' '.join(csmithflags)), file=sys.stderr)
+        return 'error'
 
     env = os.environ.copy()
     env['CFLAGS'] = ' '.join(cflags)
-    p = subprocess.run([test_exec, csmith_filename], env=env)
-    if p.returncode != 0:
-        slug = file_slug(csmith_filename)
-        source_filename = "csmith-%s.c" % slug
-        env_filename = "csmith-%s.env" % slug
+    report_filename = os.path.join(work_dir, REPORT_FILENAME)
+    if os.path.exists(report_filename):
+        os.remove(report_filename)
+    with open(os.path.join(work_dir, 'test.log'), 'wb') as log:
+        rc = run_in_group(campaign, [test_exec, csmith_filename], args.timeout,
+                          cwd=work_dir, env=env, stdout=log,
+                          stderr=subprocess.STDOUT)
+    if campaign.stopping.is_set():
+        return None
+    if rc is None:
+        return 'timeout'
+    if rc == 0:
+        return 'pass'
+
+    with open(os.path.join(work_dir, 'test.log'), errors='replace') as f:
+        signature = csmith_buckets.signature_of(
+            f.read(), csmith_buckets.read_mismatches(report_filename),
+            ' '.join(cflags))
+    case = 'csmith-%s' % file_slug(csmith_filename)
+    key, keep = campaign.add_failure(signature, case)
+    if keep:
+        source_filename = save_failing_case(work_dir, args.output,
+                                            csmith_filename, seed, cflags,
+                                            csmithflags)
+        print("Got a failing test case in bucket %s, saving to %s"
+              % (key, source_filename))
+    else:
+        print("Got a failing test case in bucket %s, already kept %d times"
+              % (key, args.keep_per_bucket))
+    return 'fail'
+
+def worker(campaign, args, work_dir):
+    os.makedirs(work_dir, exist_ok=True)
+    while True:
+        index = campaign.next_program()
+        if index is None:
+            return
+        try:
+            outcome = test_program(campaign, args, work_dir, index)
+        except Exception as e:
+            print("Program %d: %s" % (index, e), file=sys.stderr)
+            outcome = 'error'
+        if outcome is not None:
+            campaign.add(outcome)
 
-        print("Got a failing test case, saving to %s" % source_filename)
+parser = argparse.ArgumentParser(description='Run a test executable on programs generated by csmith')
+parser.add_argument('testexec', help='The test executable, takes the C source file as first argument, returns 0 if test succeeds')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of concurrent workers, each in its own scratch directory (default: 1)')
+parser.add_argument('--seed', type=int, default=None,
+                    help='Seed of the campaign, from which the seed of each program derives (default: random)')
+parser.add_argument('-n', '--count', type=int, default=None,
+                    help='Stop after testing this many programs (default: no limit)')
+parser.add_argument('--duration', type=float, default=None, metavar='SECONDS',
+                    help='Stop handing out programs after this many seconds (default: no limit)')
+parser.add_argument('--timeout', type=float, default=300, metavar='SECONDS',
+                    help='Kill csmith or the test executable after this many seconds (default: 300)')
+parser.add_argument('--progress', type=float, default=60, metavar='SECONDS',
+                    help='Seconds between two summaries (default: 60)')
+parser.add_argument('-o', '--output', default='.',
+                    help='Directory where the failing cases are saved (default: current directory)')
+parser.add_argument('-k', '--keep-per-bucket', type=int, default=3,
+                    help='Only save the first K failing cases of each bucket of failures with the same signature, 0 for all (default: 3); see csmith_buckets.py')
+parser.add_argument('--work-dir', default=None,
+                    help='Directory of the scratch directories of the workers (default: a temporary directory, removed at the end)')
 
-        shutil.copyfile(csmith_filename, source_filename)
+args = parser.parse_args()
+csmith = os.environ.get('CSMITH', 'csmith')
+# the test executable runs in the scratch directory of its worker
+test_exec = args.testexec
+if os.sep in test_exec:
+    test_exec = os.path.abspath(test_exec)
+seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+os.makedirs(args.output, exist_ok=True)
+work_root = args.work_dir or tempfile.mkdtemp(prefix='csmith-batch-')
+
+print("To investigate a failing test, run: env $(cat <env-file>) %s <source-file>" % test_exec)
+print("Campaign seed %d, %d workers in %s" % (seed, args.jobs, work_root))
 
-        with open(env_filename, 'w+') as f:
-            f.write('CFLAGS=%s\n' % ' '.join(cflags))
-            f.write('CSMITHFLAGS=%s\n' % ' '.join(csmithflags))
+campaign = Campaign(seed, args.count, args.duration,
+                    csmith_buckets.BucketIndex(args.output,
+                                               args.keep_per_bucket))
+workers = [threading.Thread(target=worker,
+                            args=(campaign, args,
+                                  os.path.join(work_root, 'worker-%d' % i)),
+                            daemon=True)
+           for i in range(args.jobs)]
+for t in workers:
+    t.start()
+try:
+    last_summary = time.monotonic()
+    while any(t.is_alive() for t in workers):
+        time.sleep(0.5)
+        if time.monotonic() - last_summary >= args.progress:
+            last_summary = time.monotonic()
+            print(campaign.summary())
+except KeyboardInterrupt:
+    print("Interrupted, stopping the workers")
+    campaign.stop()
+    for t in workers:
+        t.join()
+finally:
+    if args.work_dir is None:
+        shutil.rmtree(work_root, ignore_errors=True)
+print(campaign.summary())
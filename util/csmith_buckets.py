@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+""" Bucket the failing cases of csmith campaigns by signature.
+
+The signature of a failure is made of the first mismatch it hits:
+
+- pattern: the kinds of the instruction at the mismatching IP and of the
+  one checked before it (eg. 'pop -> ret'), from the report of
+  eh_frame_check.py;
+- row: the shape of the eh_frame row there, with the offsets left out
+  (eg. 'cfa=r7+N rbp=OFFSET rip=OFFSET');
+- cflags: the optimization and code generation flags of the compiler;
+- rules: the pair of rules that dwarfcmp.py found to differ between the
+  DWARF and ORC tables (eg. 'Register: c-N vs u').
+
+The buckets are kept in `buckets.json` in the directory of the saved
+cases, with the first cases of each one; csmith-batch.py only saves the
+first `--keep-per-bucket` cases of each bucket.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+INDEX = 'buckets.json'
+SIGNATURE_FIELDS = ['pattern', 'row', 'cflags', 'rules']
+
+CFA_RULE_RE = re.compile(r'CFARule\(reg=(\w+), offset=(-?\d+), expr=(.*)\)$')
+REGISTER_RULE_RE = re.compile(r'RegisterRule\((\w+)')
+DWARFCMP_RE = re.compile(r'(Register|CFA) rule mismatch at pc=0x[0-9a-f]+: '
+                         r'(.*) \(in .*\) vs (.*) \(in .*\)$')
+NUMBER_RE = re.compile(r'\d+')
+
+
+def insn_pattern(record):
+    ''' The instruction pattern of a mismatch record, or None '''
+    if record.get('insn') is None:
+        return None
+    previous = record.get('previous')
+    return '{} -> {}'.format(previous['kind'] if previous else '?',
+                             record['insn']['kind'])
+
+
+def row_shape(row):
+    ''' The shape of the eh_frame row of a mismatch record '''
+    match = CFA_RULE_RE.match(row['cfa'])
+    if match is None:
+        cfa = 'cfa=?'
+    elif match.group(3) != 'None':
+        cfa = 'cfa=expr'
+    else:
+        cfa = 'cfa=r{}+N'.format(match.group(1))
+    rules = []
+    for name, rule in sorted(row['rules'].items()):
+        match = REGISTER_RULE_RE.match(rule)
+        rules.append('{}={}'.format(name, match.group(1) if match else '?'))
+    return ' '.join([cfa] + rules)
+
+
+def rule_pair(log):
+    ''' The first pair of rules dwarfcmp.py found to differ in `log`, or
+    None '''
+    for line in log.splitlines():
+        match = DWARFCMP_RE.search(line)
+        if match:
+            return '{}: {} vs {}'.format(match.group(1),
+                                         NUMBER_RE.sub('N', match.group(2)),
+                                         NUMBER_RE.sub('N', match.group(3)))
+    return None
+
+
+def cflags_combo(cflags):
+    ''' The flags of `cflags` chosen by csmith-batch.py (-O and -f ones) '''
+    return ' '.join(flag for flag in cflags.split()
+                    if flag.startswith('-O') or flag.startswith('-f'))
+
+
+def signature_of(log, mismatches, cflags):
+    ''' The signature of a failure, as a dict, from the output of the test,
+    the mismatches reported by the checker and the CFLAGS '''
+    signature = dict.fromkeys(SIGNATURE_FIELDS)
+    if mismatches:
+        signature['pattern'] = insn_pattern(mismatches[0])
+        signature['row'] = row_shape(mismatches[0]['row'])
+    signature['cflags'] = cflags_combo(cflags)
+    signature['rules'] = rule_pair(log)
+    return signature
+
+
+def bucket_key(signature):
+    text = json.dumps(signature, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def read_mismatches(path):
+    ''' The records of a mismatch report, [] if there is none '''
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # Truncated last line
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def read_env(path):
+    ''' The variables of an env file of csmith-batch.py '''
+    env = {}
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.rstrip('\n').partition('=')
+            env[name] = value
+    return env
+
+
+def case_signature(source_filename):
+    ''' The signature of a case saved by csmith-batch.py '''
+    prefix = source_filename[:-len('.c')]
+    try:
+        with open(prefix + '.log', errors='replace') as f:
+            log = f.read()
+    except FileNotFoundError:
+        log = ''
+    env = read_env(prefix + '.env')
+    return signature_of(log, read_mismatches(prefix + '.mismatches.ndjson'),
+                        env.get('CFLAGS', ''))
+
+
+class BucketIndex:
+    """ The buckets of the failures saved in a directory, with their
+    signature, number of failures, and first cases kept """
+
+    def __init__(self, directory, keep):
+        self.path = os.path.join(directory, INDEX)
+        # the cases kept in each bucket; 0 to keep them all
+        self.keep = keep
+        self.buckets = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.buckets = json.load(f)['buckets']
+
+    def add(self, signature, case):
+        ''' Count a failure of `signature`; returns its bucket key, and
+        whether `case` is to be kept, in which case it is recorded '''
+        key = bucket_key(signature)
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        bucket = self.buckets.setdefault(key, {'signature': signature,
+                                               'count': 0, 'cases': [],
+                                               'first': now})
+        bucket['count'] += 1
+        bucket['last'] = now
+        keep = not self.keep or len(bucket['cases']) < self.keep
+        if keep:
+            bucket['cases'].append(case)
+        return key, keep
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'buckets': self.buckets}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def sorted(self):
+        ''' The (key, bucket) pairs, most failures first '''
+        return sorted(self.buckets.items(),
+                      key=lambda item: (-item[1]['count'], item[0]))
+
+
+def saved_cases(directory):
+    ''' The source files saved in `directory`, oldest first '''
+    names = [name for name in os.listdir(directory)
+             if name.startswith('csmith-') and name.endswith('.c')]
+    return sorted(names, key=lambda name: (
+        os.stat(os.path.join(directory, name)).st_mtime, name))
+
+
+def do_index(args):
+    if os.path.exists(os.path.join(args.dir, INDEX)):
+        os.remove(os.path.join(args.dir, INDEX))
+    index = BucketIndex(args.dir, args.keep)
+    duplicates_dir = os.path.join(args.dir, 'duplicates')
+    pruned = 0
+    for name in saved_cases(args.dir):
+        try:
+            signature = case_signature(os.path.join(args.dir, name))
+        except OSError as e:
+            print("Cannot read {}: {}".format(name, e), file=sys.stderr)
+            continue
+        key, keep = index.add(signature, name[:-len('.c')])
+        if not keep and args.prune:
+            os.makedirs(duplicates_dir, exist_ok=True)
+            prefix = name[:-len('.c')]
+            for other in os.listdir(args.dir):
+                if other.startswith(prefix + '.'):
+                    shutil.move(os.path.join(args.dir, other),
+                                os.path.join(duplicates_dir, other))
+            pruned += 1
+    index.save()
+    print("{} failures in {} buckets".format(
+        sum(bucket['count'] for bucket in index.buckets.values()),
+        len(index.buckets)))
+    if pruned:
+        print("Moved {} duplicate cases to {}".format(pruned, duplicates_dir))
+
+
+def do_report(args):
+    index = BucketIndex(args.dir, 0)
+    if not index.buckets:
+        print("No bucket in {}".format(args.dir), file=sys.stderr)
+        sys.exit(1)
+    total = sum(bucket['count'] for bucket in index.buckets.values())
+    print("{} failures in {} buckets".format(total, len(index.buckets)))
+    for key, bucket in index.sorted():
+        signature = bucket['signature']
+        print("\n{}  {} failures ({:.1f}%), first {}, last {}".format(
+            key, bucket['count'], 100. * bucket['count'] / total,
+            bucket['first'], bucket['last']))
+        for field in SIGNATURE_FIELDS:
+            if signature.get(field) is not None:
+                print("  {:<8} {}".format(field, signature[field]))
+        print("  {:<8} {}".format('cases', ' '.join(bucket['cases'])))
+
+
+def do_kept(args):
+    index = BucketIndex(args.dir, 0)
+    for key, bucket in index.sorted():
+        for case in bucket['cases']:
+            path = os.path.join(args.dir, case + '.c')
+            if os.path.exists(path):
+                print(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bucket the failing cases of csmith campaigns")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    index_parser = commands.add_parser(
+        'index', help="Rebuild the index from the cases saved in a "
+                      "directory, eg. by an older campaign; the failures "
+                      "that were not saved are no longer counted")
+    index_parser.add_argument('dir')
+    index_parser.add_argument('-k', '--keep', type=int, default=3,
+                              help="Cases kept per bucket, 0 for all "
+                                   "(default: 3)")
+    index_parser.add_argument('--prune', action='store_true',
+                              help="Move the other cases to DIR/duplicates")
+    index_parser.set_defaults(func=do_index)
+
+    report_parser = commands.add_parser(
+        'report', help="List the buckets, most failures first")
+    report_parser.add_argument('dir')
+    report_parser.set_defaults(func=do_report)
+
+    kept_parser = commands.add_parser(
+        'kept', help="Print the source files of the cases kept, eg. to "
+                     "reduce them")
+    kept_parser.add_argument('dir')
+    kept_parser.set_defaults(func=do_kept)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()